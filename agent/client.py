@@ -1,48 +1,159 @@
+import os
 import requests
 import platform
+import time
 import socket
 import json
 import logging
-from typing import Optional, Dict, Any
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime, timedelta, timezone
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from shared.tunnels import TunnelStatus
+from .platforms.linux import atomic_write
+from .scheduler import PollScheduler
+from .state import AgentState
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 logger = logging.getLogger(__name__)
 
+NO_POLICY_DETAIL = "No policy assigned to this device"
+# Compact responses when msgpack is available; requests already asks for
+# gzip (and brotli, if installed) compression
+ACCEPT = "application/msgpack, application/json;q=0.9" if msgpack is not None else "application/json"
+# Certificates expiring within this window are renewed
+CERT_RENEW_BEFORE = timedelta(days=30)
+# Device tokens are refreshed when they have less than this left (seconds)
+TOKEN_REFRESH_BEFORE = 600
+
 class OrchestratorClient:
-    def __init__(self, base_url: str, enrollment_token: str):
+    def __init__(self, base_url: str, enrollment_token: str, long_poll: bool = True, state: Optional[AgentState] = None):
         self.base_url = base_url.rstrip('/')
         self.enrollment_token = enrollment_token
-        self.device_id: Optional[int] = None
+        self.long_poll = long_poll
         self.session = requests.Session()
+        self.session.headers["Accept"] = ACCEPT
+        self._state_lock = threading.Lock()
+        # Everything below is restored from and persisted to `state`
+        self.state = state or AgentState(enrollment_token=enrollment_token)
+        self.device_id: Optional[int] = self.state.device_id
+        self.public_ip: Optional[str] = self.state.public_ip
+        # Last policy received and its ETag, reused when the server answers 304
+        # and kept in force while the orchestrator is unreachable
+        self.policy: Optional[Dict[str, Any]] = self.state.policy
+        self.policy_etag: Optional[str] = self.state.policy_etag
+        # Last server-rendered config and the policy ETag it was fetched for
+        self.rendered: Optional[Dict[str, Any]] = self.state.rendered
+        self.rendered_policy_etag: Optional[str] = self.state.rendered_policy_etag
+        # Delta sync cursor, advanced through commit_sync_cursor once a delta is applied
+        self.sync_cursor: int = self.state.sync_cursor
+        # Device token sent with every request (see ensure_token)
+        self.device_token: Optional[str] = None
+        self.device_token_expires_at: float = 0.0
+        if self.state.device_token:
+            self._set_token(self.state.device_token, self.state.device_token_expires_at)
+        # ETag of the policy last applied successfully, reported in heartbeats
+        # so staged rollouts can tell the device has taken the change
+        self.applied_etag: Optional[str] = None
+        # Outcome of requests since the last take_outcome(), for the scheduler
+        self._failed = False
+        self._retry_after: Optional[float] = None
+        self.poll_interval: Optional[float] = None
+        self.enroll_retry_after: Optional[float] = None
 
     def enroll(self) -> bool:
         """Register the device with the orchestrator."""
         hostname = socket.gethostname()
         os_type = platform.system().lower()
-        
-        # Get public IP (simple check)
-        try:
-            public_ip = requests.get('https://api.ipify.org', timeout=5).text
-        except Exception:
-            public_ip = "0.0.0.0"
 
         payload = {
             "hostname": hostname,
             "os_type": os_type,
-            "public_ip": public_ip,
+            # Last discovered address; refreshed by refresh_enrollment
+            "public_ip": self.public_ip or "0.0.0.0",
             "enrollment_token": self.enrollment_token
         }
 
         try:
-            response = self.session.post(f"{self.base_url}/devices/enroll", json=payload)
+            response = self.session.post(f"{self.base_url}/devices/enroll", json=payload, timeout=10)
+            self.enroll_retry_after = _header_seconds(response.headers.get("Retry-After"))
             response.raise_for_status()
-            data = response.json()
+            data = decode(response)
             self.device_id = data['id']
+            if data.get('token'):
+                self._set_token(data['token'], time.time() + data['token_expires_in'])
+            self._save_state()
             logger.info(f"Device enrolled successfully. ID: {self.device_id}")
             return True
         except Exception as e:
             logger.error(f"Enrollment failed: {e}")
             return False
 
+    def discover_public_ip(self) -> Optional[str]:
+        # Get public IP (simple check)
+        try:
+            return requests.get('https://api.ipify.org', timeout=5).text
+        except Exception:
+            return None
+
+    def refresh_enrollment(self, initial_delay: float = 0, scheduler: Optional[PollScheduler] = None):
+        """
+        Discover the public IP and re-enroll, backing off until the
+        orchestrator accepts it. Blocking; run it in the background with
+        start_enrollment_refresh.
+        """
+        scheduler = scheduler or PollScheduler()
+        time.sleep(initial_delay)
+        public_ip = self.discover_public_ip()
+        if public_ip and public_ip != self.public_ip:
+            self.public_ip = public_ip
+            self._save_state()
+        while not self.enroll():
+            scheduler.record_failure(self.enroll_retry_after)
+            time.sleep(scheduler.next_delay())
+
+    def start_enrollment_refresh(self, initial_delay: float = 0) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.refresh_enrollment, args=(initial_delay,), name="enrollment-refresh", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def ensure_token(self) -> bool:
+        """
+        Make sure the device token is good for a while yet: exchange it for
+        a new one shortly before it expires, or enroll again once it has
+        expired or was rejected.
+        """
+        if not self.device_id:
+            return False
+        if self.device_token and self.device_token_expires_at - time.time() > TOKEN_REFRESH_BEFORE:
+            return True
+        if self.device_token and self.device_token_expires_at > time.time():
+            try:
+                response = self.session.post(f"{self.base_url}/devices/{self.device_id}/token", timeout=10)
+                self._note_response(response)
+                if response.status_code not in (401, 403):
+                    response.raise_for_status()
+                    data = decode(response)
+                    self._set_token(data['token'], time.time() + data['token_expires_in'])
+                    self._save_state()
+                    return True
+            except Exception as e:
+                # Still valid; try again next time
+                logger.warning(f"Token refresh failed: {e}")
+                return True
+        logger.info("Device token expired or rejected, enrolling again.")
+        return self.enroll()
+
     def get_policy(self) -> Optional[Dict[str, Any]]:
         """Fetch the assigned IPsec policy."""
         if not self.device_id:
@@ -50,15 +161,293 @@ class OrchestratorClient:
             return None
 
         try:
-            response = self.session.get(f"{self.base_url}/devices/{self.device_id}/config")
-            response.raise_for_status()
-            return response.json()
+            response = self.session.get(
+                f"{self.base_url}/devices/{self.device_id}/config",
+                headers=self._conditional_headers(),
+                timeout=30
+            )
+            self._note_response(response)
+            return self._handle_config_response(response)
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
                 logger.warning("No policy assigned yet.")
-            else:
-                logger.error(f"Failed to fetch policy: {e}")
-            return None
+                self._clear_policy()
+                return None
+            logger.error(f"Failed to fetch policy: {e}")
         except Exception as e:
             logger.error(f"Error fetching policy: {e}")
+            self._failed = True
+        # Orchestrator unavailable: keep enforcing the last known policy
+        return self.policy
+
+    def get_rendered_config(self, fmt: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the policy rendered server-side in `fmt` ({"files": ..., "hash": ...}).
+        Only hits the server when the policy changed since the last fetch.
+        Returns None if rendering is unavailable; callers fall back to the raw policy.
+        """
+        if not self.device_id or self.policy is None:
+            return None
+        if self.rendered is not None and self.rendered.get("format") == fmt \
+                and self.rendered_policy_etag == self.policy_etag:
+            return self.rendered
+
+        headers = {}
+        if self.rendered is not None and self.rendered.get("format") == fmt:
+            headers["If-None-Match"] = f'"{self.rendered["hash"]}"'
+        try:
+            response = self.session.get(
+                f"{self.base_url}/devices/{self.device_id}/config/rendered",
+                params={"format": fmt},
+                headers=headers,
+                timeout=30
+            )
+            if response.status_code != 304:
+                response.raise_for_status()
+                self.rendered = decode(response)
+            self.rendered_policy_etag = self.policy_etag
+            self._save_state()
+            return self.rendered
+        except Exception as e:
+            logger.warning(f"Rendered config unavailable, rendering locally: {e}")
+            return None
+
+    def sync_policies(self, timeout: int = 30) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the policies added, changed or removed since `sync_cursor`,
+        waiting up to `timeout` seconds for a change.
+        """
+        if not self.device_id:
+            logger.error("Device not enrolled.")
             return None
+
+        try:
+            response = self.session.get(
+                f"{self.base_url}/devices/{self.device_id}/sync",
+                params={"cursor": self.sync_cursor, "timeout": timeout},
+                timeout=timeout + 10
+            )
+            self._note_response(response)
+            response.raise_for_status()
+            return decode(response)
+        except Exception as e:
+            logger.warning(f"Delta sync failed: {e}")
+            self._failed = True
+            return None
+
+    def send_heartbeat(self, tunnel_up: Optional[bool] = None, tunnels: Optional[List[TunnelStatus]] = None) -> bool:
+        """
+        Report liveness and tunnel state to the orchestrator. `tunnels` goes
+        out as one row per tunnel (see shared.tunnels) in the same request.
+        """
+        if not self.device_id:
+            return False
+        payload: Dict[str, Any] = {"tunnel_up": tunnel_up}
+        if self.applied_etag is not None:
+            payload["applied_etag"] = self.applied_etag
+        if self.sync_cursor > 0:
+            payload["sync_cursor"] = self.sync_cursor
+        if tunnels is not None:
+            payload["tunnels"] = [tunnel.as_row() for tunnel in tunnels]
+        try:
+            response = self.session.post(
+                f"{self.base_url}/devices/{self.device_id}/heartbeat",
+                json=payload,
+                timeout=10
+            )
+            self._note_response(response)
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            logger.warning(f"Heartbeat failed: {e}")
+            return False
+
+    def ensure_certificate(self, cert_dir: str) -> bool:
+        """
+        Make sure `cert_dir` holds a current device certificate (device.pem,
+        device.key, ca.pem), requesting one for a freshly generated key if
+        it is missing or about to expire. The key never leaves the device.
+        """
+        cert_path = os.path.join(cert_dir, "device.pem")
+        try:
+            with open(cert_path, "rb") as f:
+                not_after = x509.load_pem_x509_certificate(f.read()).not_valid_after_utc
+            if not_after - datetime.now(timezone.utc) > CERT_RENEW_BEFORE:
+                return True
+            logger.info(f"Device certificate expires {not_after}, renewing.")
+        except (OSError, ValueError):
+            pass
+        if not self.device_id:
+            return False
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        # The orchestrator sets the subject; this one is informational
+        csr = x509.CertificateSigningRequestBuilder() \
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, socket.gethostname())])) \
+            .sign(key, hashes.SHA256())
+        try:
+            response = self.session.post(
+                f"{self.base_url}/devices/{self.device_id}/certificate",
+                json={"csr": csr.public_bytes(serialization.Encoding.PEM).decode()},
+                timeout=30
+            )
+            self._note_response(response)
+            response.raise_for_status()
+            issued = decode(response)
+        except Exception as e:
+            logger.error(f"Certificate request failed: {e}")
+            return False
+
+        key_pem = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        try:
+            os.makedirs(cert_dir, exist_ok=True)
+            # Key first: a certificate on disk always has its key next to it
+            atomic_write(os.path.join(cert_dir, "device.key"), key_pem, 0o600)
+            atomic_write(os.path.join(cert_dir, "ca.pem"), issued["ca_certificate"], 0o644)
+            atomic_write(cert_path, issued["certificate"], 0o644)
+        except OSError as e:
+            logger.error(f"Could not write device certificate: {e}")
+            return False
+        logger.info(f"Device certificate {issued['serial']} issued, valid until {issued['not_after']}.")
+        return True
+
+    def wait_for_policy(self, timeout: float = 30) -> Optional[Dict[str, Any]]:
+        """
+        Block until the assigned policy changes or `timeout` seconds pass.
+        Uses the long-poll endpoint when available and a plain poll
+        otherwise; pacing between calls is up to the caller's scheduler.
+        """
+        if self.long_poll and self.device_id:
+            try:
+                response = self.session.get(
+                    f"{self.base_url}/devices/{self.device_id}/config/watch",
+                    params={"timeout": timeout},
+                    headers=self._conditional_headers(),
+                    timeout=timeout + 10
+                )
+                self._note_response(response)
+                if response.status_code in (200, 304) or self._is_no_policy(response):
+                    return self._handle_config_response(response)
+                if response.status_code in (404, 405):
+                    logger.warning(f"Long-poll unavailable (HTTP {response.status_code}), falling back to polling.")
+                    self.long_poll = False
+                else:
+                    logger.warning(f"Long-poll failed (HTTP {response.status_code}).")
+                    self._failed = True
+                    return self.policy
+            except requests.exceptions.HTTPError:
+                logger.warning("No policy assigned yet.")
+                self._clear_policy()
+                return None
+            except Exception as e:
+                logger.warning(f"Long-poll failed: {e}")
+                self._failed = True
+                # Keep enforcing the last known policy
+                return self.policy
+
+        return self.get_policy()
+
+    def take_outcome(self) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        (ok, retry_after, poll_interval) for the requests made since the
+        last call, for PollScheduler.
+        """
+        outcome = (not self._failed, self._retry_after, self.poll_interval)
+        self._failed = False
+        self._retry_after = None
+        return outcome
+
+    def mark_applied(self):
+        """Record that the current policy (policy_etag) is in force."""
+        self.applied_etag = self.policy_etag
+
+    def commit_sync_cursor(self, cursor: int):
+        """Record that the delta up to `cursor` has been applied."""
+        if cursor != self.sync_cursor:
+            self.sync_cursor = cursor
+            self._save_state()
+
+    def _clear_policy(self):
+        if self.policy is not None or self.policy_etag is not None:
+            self.policy = None
+            self.policy_etag = None
+            self._save_state()
+
+    def _set_token(self, token: str, expires_at: float):
+        self.device_token = token
+        self.device_token_expires_at = expires_at
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def _save_state(self):
+        # Also called from the enrollment refresh thread
+        with self._state_lock:
+            self._write_state()
+
+    def _write_state(self):
+        state = self.state
+        state.device_id = self.device_id
+        state.public_ip = self.public_ip
+        state.policy = self.policy
+        state.policy_etag = self.policy_etag
+        state.rendered = self.rendered
+        state.rendered_policy_etag = self.rendered_policy_etag
+        state.sync_cursor = self.sync_cursor
+        state.device_token = self.device_token
+        state.device_token_expires_at = self.device_token_expires_at
+        state.save()
+
+    def _note_response(self, response: requests.Response):
+        """Pick up the orchestrator's pacing hints; 429 and 5xx count as failures."""
+        interval = _header_seconds(response.headers.get("X-Poll-Interval"))
+        if interval is not None:
+            self.poll_interval = interval
+        if response.status_code == 401:
+            # Expired or revoked: ensure_token enrolls again
+            self.device_token_expires_at = 0.0
+        if response.status_code == 429 or response.status_code >= 500:
+            self._failed = True
+            self._retry_after = _header_seconds(response.headers.get("Retry-After"))
+
+    def _conditional_headers(self) -> Dict[str, str]:
+        if self.policy_etag and self.policy is not None:
+            return {"If-None-Match": self.policy_etag}
+        return {}
+
+    def _handle_config_response(self, response: requests.Response) -> Optional[Dict[str, Any]]:
+        if response.status_code == 304:
+            return self.policy
+        response.raise_for_status()
+        self.policy = decode(response)
+        self.policy_etag = response.headers.get("ETag")
+        self._save_state()
+        return self.policy
+
+    @staticmethod
+    def _is_no_policy(response: requests.Response) -> bool:
+        if response.status_code != 404:
+            return False
+        try:
+            return decode(response).get("detail") == NO_POLICY_DETAIL
+        except ValueError:
+            return False
+
+def decode(response: requests.Response) -> Any:
+    """Response body as negotiated: msgpack or JSON."""
+    if response.headers.get("Content-Type", "").startswith("application/msgpack"):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+def _header_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a delay header given in seconds or, for Retry-After, as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -3,12 +3,18 @@ import logging
 import sys
 import os
 from .client import OrchestratorClient
+from .scheduler import PollScheduler
+from .state import AgentState, default_state_path
 from .platforms.base import PlatformManager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Agent")
 
+# How often a running agent checks whether its device certificate is due
+# for renewal (ensure_certificate renews within CERT_RENEW_BEFORE of expiry)
+CERT_CHECK_INTERVAL = 3600
+
 # Mock platform for now until we implement specific ones
 class MockPlatform(PlatformManager):
     def apply_policy(self, policy):
@@ -18,10 +24,20 @@ class MockPlatform(PlatformManager):
     def check_tunnel_status(self):
         return True
 
+    def collect_tunnel_status(self):
+        return []
+
 def get_platform_manager() -> PlatformManager:
     if sys.platform == "linux":
-        # from .platforms.linux import LinuxManager
-        # return LinuxManager()
+        # AGENT_LINUX_BACKEND=swanctl uses VICI (per-connection reloads),
+        # =ipsec uses the legacy ipsec.conf + `ipsec restart` backend
+        backend = os.environ.get("AGENT_LINUX_BACKEND", "mock")
+        if backend == "swanctl":
+            from .platforms.swanctl import SwanctlManager
+            return SwanctlManager()
+        if backend == "ipsec":
+            from .platforms.linux import LinuxManager
+            return LinuxManager()
         return MockPlatform() # Placeholder
     elif sys.platform == "win32":
         from .platforms.windows import WindowsManager
@@ -31,36 +47,112 @@ def get_platform_manager() -> PlatformManager:
         logger.warning("Unsupported platform, using mock")
         return MockPlatform()
 
+def apply_cached(platform_mgr: PlatformManager, client: OrchestratorClient, server_render: bool):
+    """Apply the policy from the state file without contacting the orchestrator."""
+    rendered = client.rendered
+    if (server_render and rendered and rendered.get("format") == platform_mgr.render_format
+            and client.rendered_policy_etag == client.policy_etag):
+        applied = platform_mgr.apply_rendered(rendered)
+    else:
+        applied = platform_mgr.apply_policy(client.policy)
+    if applied:
+        client.mark_applied()
+
 def main():
     orchestrator_url = os.environ.get("ORCHESTRATOR_URL", "http://127.0.0.1:8000")
     enrollment_token = os.environ.get("ENROLLMENT_TOKEN", "default_token")
+    long_poll = os.environ.get("AGENT_LONG_POLL", "1") != "0"
+    server_render = os.environ.get("AGENT_SERVER_RENDER", "1") != "0"
+    delta_sync = os.environ.get("AGENT_DELTA_SYNC", "1") != "0"
+    poll_interval = float(os.environ.get("AGENT_POLL_INTERVAL", "30"))
+    # Request a device certificate (for pubkey policies) into this directory
+    cert_dir = os.environ.get("AGENT_CERT_DIR")
+    
+    state_path = os.environ.get("AGENT_STATE_PATH", default_state_path())
     
-    client = OrchestratorClient(orchestrator_url, enrollment_token)
+    state = AgentState.load(state_path, enrollment_token)
+    client = OrchestratorClient(orchestrator_url, enrollment_token, long_poll=long_poll, state=state)
     platform_mgr = get_platform_manager()
     
     logger.info("Starting Agent...")
     
+    # Backends with one connection per policy apply every assigned policy,
+    # syncing only what changed since the last applied cursor
+    delta_sync = delta_sync and platform_mgr.supports_delta
+
     # 1. Enroll
-    if not client.enroll():
+    restored = client.device_id is not None
+    if restored:
+        # Known device: enforce the cached policy right away, before any
+        # network round trip (delta backends keep their own applied state)
+        logger.info(f"Restored state for device {client.device_id}.")
+        if client.policy and not delta_sync:
+            apply_cached(platform_mgr, client, server_render)
+    elif not client.enroll():
         logger.error("Failed to enroll. Exiting.")
         return
 
+    # Public IP discovery and re-enrollment don't hold up the main loop. A
+    # restored agent already enforces its policy, so it also spreads these
+    # and its first poll out: after a mass reboot agents arrive staggered
+    scheduler = PollScheduler(interval=poll_interval)
+    delay = scheduler.startup_delay() if restored else 0
+    client.start_enrollment_refresh(delay)
+    next_cert_check = time.monotonic()
+
     # 2. Main Loop
     while True:
         try:
-            policy = client.get_policy()
-            if policy:
-                platform_mgr.apply_policy(policy)
+            time.sleep(delay)
+            client.ensure_token()
+            if cert_dir and time.monotonic() >= next_cert_check:
+                # Retried on the next check if it fails
+                client.ensure_certificate(cert_dir)
+                next_cert_check = time.monotonic() + CERT_CHECK_INTERVAL
+            apply_failed = False
+            if delta_sync:
+                delta = client.sync_policies(scheduler.long_poll_timeout())
+                if delta is not None:
+                    if platform_mgr.apply_delta(delta["changed"], delta["removed"], full=delta["full"]):
+                        client.commit_sync_cursor(delta["cursor"])
+                    else:
+                        apply_failed = True
+                    client.send_heartbeat(platform_mgr.check_tunnel_status(), platform_mgr.tunnel_status())
+            else:
+                # Returns early when the orchestrator pushes a change
+                policy = client.wait_for_policy(scheduler.long_poll_timeout())
+                if policy:
+                    # Prefer the config rendered by the orchestrator, so the agent
+                    # only compares hashes and writes bytes
+                    rendered = None
+                    if platform_mgr.render_format and server_render:
+                        rendered = client.get_rendered_config(platform_mgr.render_format)
+                    if rendered:
+                        applied = platform_mgr.apply_rendered(rendered)
+                    else:
+                        applied = platform_mgr.apply_policy(policy)
+                    if applied:
+                        client.mark_applied()
+                    else:
+                        apply_failed = True
+                    client.send_heartbeat(platform_mgr.check_tunnel_status(), platform_mgr.tunnel_status())
+                else:
+                    logger.info("No policy assigned.")
+
+            ok, retry_after, server_interval = client.take_outcome()
+            # The next poll hands back the same change right away, so a failed
+            # apply backs off like a failed request instead of spinning
+            if ok and not apply_failed:
+                scheduler.record_success(server_interval)
             else:
-                logger.info("No policy assigned.")
-            
-            time.sleep(30) # Check every 30 seconds
+                scheduler.record_failure(retry_after)
         except KeyboardInterrupt:
             logger.info("Stopping Agent.")
             break
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
-            time.sleep(30)
+            scheduler.record_failure()
+        delay = scheduler.next_delay(long_poll=delta_sync or client.long_poll)
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,17 @@
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from shared.tunnels import TunnelStatus
 
 class PlatformManager(ABC):
+    # Server-side rendering format (see shared.rendering) this backend can
+    # apply through apply_rendered, None if it only applies raw policies
+    render_format: Optional[str] = None
+    # Whether apply_delta is implemented (one connection per policy)
+    supports_delta: bool = False
+    # How long tunnel_status() reuses the last SA listing
+    status_ttl: float = 5.0
+
     @abstractmethod
     def apply_policy(self, policy: Dict[str, Any]) -> bool:
         """
@@ -10,9 +20,44 @@ class PlatformManager(ABC):
         """
         pass
 
-    @abstractmethod
     def check_tunnel_status(self) -> bool:
         """
         Check if the tunnel is up and running.
         """
+        return any(tunnel.up for tunnel in self.tunnel_status())
+
+    def tunnel_status(self) -> List[TunnelStatus]:
+        """
+        Per-connection SA state, collected at most once every `status_ttl`
+        seconds however often it is asked for.
+        """
+        now = time.monotonic()
+        cached = getattr(self, "_status_cache", None)
+        if cached is None or now - cached[0] >= self.status_ttl:
+            cached = (now, self.collect_tunnel_status())
+            self._status_cache = cached
+        return cached[1]
+
+    @abstractmethod
+    def collect_tunnel_status(self) -> List[TunnelStatus]:
+        """
+        Query the IPsec stack for the state of every connection, including
+        configured connections without SAs (state DOWN).
+        """
         pass
+
+    def apply_rendered(self, rendered: Dict[str, Any]) -> bool:
+        """
+        Apply a config rendered by the orchestrator ({"files": {...}, "hash": ...}).
+        Returns True if successful, False otherwise.
+        """
+        raise NotImplementedError
+
+    def apply_delta(self, changed: List[Dict[str, Any]], removed: List[int], full: bool = False) -> bool:
+        """
+        Apply a delta sync: add or update the connections for `changed`
+        policies and tear down those of `removed` policy ids. With `full`,
+        `changed` is the complete set and anything else is torn down.
+        Returns True if successful, False otherwise.
+        """
+        raise NotImplementedError
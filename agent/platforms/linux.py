@@ -1,37 +1,77 @@
 import os
+import re
+import tempfile
 import subprocess
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Callable
+from shared import rendering
+from shared.tunnels import TunnelStatus
 from .base import PlatformManager
+from .status import parse_list_sas, parse_statusall
+from .vici import ViciSession, ViciError
 
 logger = logging.getLogger(__name__)
 
+def atomic_write(path: str, content: str, mode: int):
+    """
+    Write to a temp file in the same directory and rename it over the
+    target, so strongSwan never reads a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 class LinuxManager(PlatformManager):
-    def __init__(self):
+    render_format = "ipsec"
+
+    def __init__(
+        self,
+        state_path: str = "/var/lib/unified-ipsec-agent/linux.sha256",
+        session_factory: Callable[[], ViciSession] = ViciSession
+    ):
         self.conf_path = "/etc/ipsec.conf"
         self.secrets_path = "/etc/ipsec.secrets"
+        # Hash of the last config we successfully applied, persisted so a
+        # restarted agent doesn't restart strongSwan for an unchanged policy
+        self.state_path = state_path
+        self.applied_hash: Optional[str] = self._load_applied_hash()
+        # Tunnel status is read over VICI when charon has the plugin loaded
+        self.session_factory = session_factory
 
     def apply_policy(self, policy: Dict[str, Any]) -> bool:
-        logger.info(f"Generating strongSwan config for policy: {policy['name']}")
-        
-        # Generate ipsec.conf content
-        conf_content = self._generate_ipsec_conf(policy)
-        
-        # Generate ipsec.secrets content
-        secrets_content = self._generate_ipsec_secrets(policy)
+        # Generate ipsec.conf and ipsec.secrets content
+        files = rendering.render_policy(policy, self.render_format)
+        return self._apply_files(files, rendering.artifact_hash(files), policy['name'])
+
+    def apply_rendered(self, rendered: Dict[str, Any]) -> bool:
+        return self._apply_files(rendered["files"], rendered["hash"], rendered.get("policy_name", "rendered"))
+
+    def _apply_files(self, files: Dict[str, str], config_hash: str, name: str) -> bool:
+        if config_hash == self.applied_hash and self._on_disk_hash() == config_hash:
+            logger.debug(f"strongSwan config for policy {name} unchanged, skipping apply.")
+            return True
         
+        logger.info(f"Writing strongSwan config for policy: {name}")
         try:
             # Write files (Requires root)
-            # In a real scenario, we'd handle permissions carefully
-            with open(self.conf_path, 'w') as f:
-                f.write(conf_content)
-            
-            with open(self.secrets_path, 'w') as f:
-                f.write(secrets_content)
+            atomic_write(self.conf_path, files["ipsec.conf"], 0o644)
+            atomic_write(self.secrets_path, files["ipsec.secrets"], 0o600)
                 
             # Reload strongSwan
             subprocess.run(["ipsec", "restart"], check=True)
             logger.info("strongSwan restarted successfully.")
+            self._save_applied_hash(config_hash)
             return True
         except PermissionError:
             logger.error("Permission denied. Run as root.")
@@ -40,48 +80,56 @@ class LinuxManager(PlatformManager):
             logger.error(f"Failed to apply Linux policy: {e}")
             return False
 
-    def check_tunnel_status(self) -> bool:
+    def collect_tunnel_status(self) -> List[TunnelStatus]:
         try:
-            result = subprocess.run(["ipsec", "status"], capture_output=True, text=True)
-            return "ESTABLISHED" in result.stdout
-        except FileNotFoundError:
-            logger.error("strongSwan (ipsec) command not found.")
-            return False
+            with self.session_factory() as session:
+                tunnels = parse_list_sas(session.streamed_request("list-sas", "list-sa"))
+        except (ViciError, OSError):
+            # No VICI socket (stroke-only charon): one `ipsec statusall` per TTL
+            try:
+                result = subprocess.run(["ipsec", "statusall"], capture_output=True, text=True, timeout=10)
+            except FileNotFoundError:
+                logger.error("strongSwan (ipsec) command not found.")
+                return []
+            except subprocess.TimeoutExpired:
+                logger.error("ipsec statusall timed out.")
+                return []
+            tunnels = parse_statusall(result.stdout)
+        for name in self._configured_connections():
+            tunnels.setdefault(name, TunnelStatus(name))
+        return list(tunnels.values())
 
-    def _generate_ipsec_conf(self, policy: Dict[str, Any]) -> str:
-        # Map API fields to strongSwan config
-        # This is a simplified template
-        
-        left = "%defaultroute"
-        leftsubnet = policy.get('local_network_cidr', '0.0.0.0/0')
-        right = policy.get('remote_gateway', '%any') # Needs to be passed in policy or discovered
-        rightsubnet = policy.get('remote_network_cidr', '0.0.0.0/0')
-        
-        ike = f"{policy.get('encryption_algorithm', 'aes256')}-{policy.get('integrity_algorithm', 'sha256')}-{policy.get('dh_group', 'modp2048')}!"
-        esp = f"{policy.get('encryption_algorithm', 'aes256')}-{policy.get('integrity_algorithm', 'sha256')}!"
-        
-        config = f"""# Generated by Unified IPsec Agent
-config setup
-    charondebug="ike 1, knl 1, cfg 0"
-    uniqueids=no
+    def _configured_connections(self) -> List[str]:
+        try:
+            with open(self.conf_path) as f:
+                return [name for name in re.findall(r"^conn\s+(\S+)", f.read(), re.MULTILINE) if name != "%default"]
+        except OSError:
+            return []
 
-conn {policy['name']}
-    authby={policy.get('auth_method', 'secret')}
-    auto=start
-    keyexchange={policy.get('ike_version', 'ikev2')}
-    ike={ike}
-    esp={esp}
-    left={left}
-    leftsubnet={leftsubnet}
-    right={right}
-    rightsubnet={rightsubnet}
-    type=tunnel
-"""
-        return config
+    @staticmethod
+    def _hash_config(conf_content: str, secrets_content: str) -> str:
+        # Same hash the orchestrator serves with rendered configs
+        return rendering.artifact_hash({"ipsec.conf": conf_content, "ipsec.secrets": secrets_content})
 
-    def _generate_ipsec_secrets(self, policy: Dict[str, Any]) -> str:
-        if policy.get('auth_method') == 'psk':
-            psk = policy.get('psk_secret', 'default_psk')
-            # Format: left_id right_id : PSK "secret"
-            return f': PSK "{psk}"\n'
-        return ""
+    def _on_disk_hash(self) -> Optional[str]:
+        # Catches manual edits to the files since our last apply
+        try:
+            with open(self.conf_path) as conf, open(self.secrets_path) as secrets:
+                return self._hash_config(conf.read(), secrets.read())
+        except OSError:
+            return None
+
+    def _load_applied_hash(self) -> Optional[str]:
+        try:
+            with open(self.state_path) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _save_applied_hash(self, config_hash: str):
+        self.applied_hash = config_hash
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            atomic_write(self.state_path, config_hash + "\n", 0o600)
+        except OSError as e:
+            logger.warning(f"Could not persist applied config state: {e}")
@@ -0,0 +1,144 @@
+import json
+import queue
+import base64
+import logging
+import threading
+import subprocess
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Read one JSON request per line from stdin, run it in this long-lived session
+# and answer with one JSON line on stdout. NetSecurity is imported once here
+# instead of on every call.
+HOST_SCRIPT = r"""
+$ErrorActionPreference = "Stop"
+Import-Module NetSecurity -ErrorAction SilentlyContinue
+$stdout = [Console]::Out
+while ($true) {
+    $line = [Console]::In.ReadLine()
+    if ($line -eq $null) { break }
+    $request = $null
+    try {
+        # Inside the try: with ErrorActionPreference Stop a malformed line
+        # would otherwise end the session
+        $request = $line | ConvertFrom-Json
+        $output = & ([ScriptBlock]::Create($request.script)) 2>&1 | Out-String
+        $response = @{ id = $request.id; ok = $true; output = $output }
+    } catch {
+        $response = @{ id = $request.id; ok = $false; error = ($_ | Out-String) }
+    }
+    $stdout.WriteLine(($response | ConvertTo-Json -Compress))
+    $stdout.Flush()
+}
+"""
+
+def default_command() -> List[str]:
+    encoded = base64.b64encode(HOST_SCRIPT.encode("utf-16-le")).decode()
+    return ["powershell", "-NoLogo", "-NoProfile", "-NonInteractive", "-EncodedCommand", encoded]
+
+class PowerShellError(Exception):
+    pass
+
+class PowerShellHost:
+    """
+    Long-lived PowerShell process that runs scripts sent as framed
+    (newline-delimited) JSON over stdin/stdout. The process is started
+    lazily and restarted if it dies.
+    """
+
+    def __init__(self, command: Optional[List[str]] = None, timeout: float = 60.0):
+        self.command = command or default_command()
+        self.timeout = timeout
+        self._process: Optional[subprocess.Popen] = None
+        self._responses: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def run(self, script: str, timeout: Optional[float] = None) -> str:
+        """Run `script` in the host session and return its output as text."""
+        with self._lock:
+            try:
+                return self._run_once(script, timeout)
+            except (BrokenPipeError, EOFError, OSError) as e:
+                # Host crashed or was killed; start a fresh one and retry once
+                logger.warning(f"PowerShell host failed ({e}), restarting.")
+                self._stop()
+                try:
+                    return self._run_once(script, timeout)
+                except (BrokenPipeError, EOFError, OSError) as e:
+                    self._stop()
+                    raise PowerShellError(f"PowerShell host unavailable: {e}") from e
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def _run_once(self, script: str, timeout: Optional[float]) -> str:
+        self._ensure_started()
+        self._next_id += 1
+        request_id = self._next_id
+        self._process.stdin.write(json.dumps({"id": request_id, "script": script}) + "\n")
+        self._process.stdin.flush()
+
+        while True:
+            try:
+                line = self._responses.get(timeout=timeout or self.timeout)
+            except queue.Empty:
+                # The session is in an unknown state, don't reuse it
+                self._stop()
+                raise PowerShellError("Timed out waiting for PowerShell host")
+            if line is None:
+                raise EOFError("PowerShell host exited")
+            try:
+                response = json.loads(line)
+            except ValueError:
+                logger.debug(f"Ignoring non-protocol output from PowerShell host: {line!r}")
+                continue
+            # A request the host couldn't parse is answered without an id;
+            # only one request is in flight, so it's this one
+            if response.get("id") not in (request_id, None):
+                continue
+            if not response.get("ok"):
+                raise PowerShellError(response.get("error") or "PowerShell command failed")
+            return response.get("output") or ""
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        self._stop()
+        self._responses = queue.Queue()
+        self._process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            bufsize=1
+        )
+        threading.Thread(
+            target=self._read_responses,
+            args=(self._process.stdout, self._responses),
+            daemon=True
+        ).start()
+
+    @staticmethod
+    def _read_responses(stdout, responses: "queue.Queue[Optional[str]]"):
+        for line in stdout:
+            responses.put(line.strip())
+        responses.put(None)
+
+    def _stop(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
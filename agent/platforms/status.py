@@ -0,0 +1,140 @@
+"""
+Parsers turning platform SA listings into per-connection TunnelStatus:
+VICI list-sas events, `ipsec statusall` text and the NetSecurity JSON
+collected by WindowsManager.
+"""
+import re
+import ipaddress
+from typing import Dict, Any, List, Iterable, Optional
+from shared.tunnels import TunnelStatus, ESTABLISHED, DOWN
+
+_COUNTERS = (
+    ("bytes-in", "bytes_in"),
+    ("bytes-out", "bytes_out"),
+    ("packets-in", "packets_in"),
+    ("packets-out", "packets_out"),
+)
+
+def parse_list_sas(events: Iterable[Dict[str, Any]]) -> Dict[str, TunnelStatus]:
+    """Aggregate VICI list-sa events (one IKE SA each) by connection name."""
+    tunnels: Dict[str, TunnelStatus] = {}
+    for event in events:
+        for name, ike in event.items():
+            if not isinstance(ike, dict):
+                continue
+            tunnel = tunnels.setdefault(name, TunnelStatus(name))
+            # A connection has several IKE SAs while rekeying; prefer an established one
+            if not tunnel.up:
+                tunnel.state = ike.get("state", DOWN)
+                tunnel.established = _int(ike.get("established"))
+                tunnel.rekey_in = _int(ike.get("rekey-time"))
+            children = ike.get("child-sas")
+            for child in (children.values() if isinstance(children, dict) else ()):
+                if child.get("state") != "INSTALLED":
+                    continue
+                tunnel.child_sas += 1
+                for key, attr in _COUNTERS:
+                    setattr(tunnel, attr, (getattr(tunnel, attr) or 0) + (_int(child.get(key)) or 0))
+    return tunnels
+
+# `ipsec statusall` lines, e.g.
+#   office[3]: ESTABLISHED 12 minutes ago, 192.0.2.1[...]...198.51.100.7[...]
+#   office[3]: IKEv2 SPIs: 7d1c..._i* 9e2f..._r, rekeying in 2 hours
+#   office{5}:  INSTALLED, TUNNEL, reqid 1, ESP SPIs: c7a5d3e1_i cb2f2a3b_o
+#   office{5}:  AES_CBC_256/HMAC_SHA2_256_128, 16328 bytes_i (123 pkts, 2s ago), 9876 bytes_o (98 pkts, 2s ago), rekeying in 41 minutes
+_IKE_STATE = re.compile(
+    r"^\s*(?P<name>[^\s\[{]+)\[\d+\]: "
+    r"(?P<state>CREATED|CONNECTING|ESTABLISHED|PASSIVE|REKEYING|REKEYED|DELETING|DESTROYING)"
+    r"(?: (?P<ago>\d+ \w+) ago)?"
+)
+_IKE_REKEY = re.compile(r"^\s*(?P<name>[^\s\[{]+)\[\d+\]: IKEv\d SPIs:.*?(?:rekeying|reauthentication) in (?P<when>\d+ \w+)")
+_CHILD_STATE = re.compile(r"^\s*(?P<name>[^\s\[{]+)\{\d+\}:\s+(?P<state>[A-Z_]+),")
+_CHILD_TRAFFIC = re.compile(
+    r"^\s*(?P<name>[^\s\[{]+)\{\d+\}:.*?(?P<bytes_in>\d+) bytes_i(?: \((?P<packets_in>\d+) pkts?)?"
+    r".*?(?P<bytes_out>\d+) bytes_o(?: \((?P<packets_out>\d+) pkts?)?"
+)
+_DURATION_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+def parse_statusall(text: str) -> Dict[str, TunnelStatus]:
+    """Parse `ipsec statusall` output by connection name."""
+    tunnels: Dict[str, TunnelStatus] = {}
+    for line in text.splitlines():
+        match = _IKE_STATE.match(line)
+        if match:
+            tunnel = tunnels.setdefault(match["name"], TunnelStatus(match["name"]))
+            if not tunnel.up:
+                tunnel.state = match["state"]
+                tunnel.established = _duration(match["ago"])
+            continue
+        match = _IKE_REKEY.match(line)
+        if match:
+            tunnel = tunnels.setdefault(match["name"], TunnelStatus(match["name"]))
+            if tunnel.rekey_in is None:
+                tunnel.rekey_in = _duration(match["when"])
+            continue
+        match = _CHILD_STATE.match(line)
+        if match:
+            if match["state"] == "INSTALLED":
+                tunnels.setdefault(match["name"], TunnelStatus(match["name"])).child_sas += 1
+            continue
+        match = _CHILD_TRAFFIC.match(line)
+        if match:
+            tunnel = tunnels.setdefault(match["name"], TunnelStatus(match["name"]))
+            for _, attr in _COUNTERS:
+                setattr(tunnel, attr, (getattr(tunnel, attr) or 0) + (_int(match[attr]) or 0))
+    return tunnels
+
+def parse_windows_sas(data: Dict[str, Any]) -> Dict[str, TunnelStatus]:
+    """
+    Match main and quick mode SA remote endpoints against each IPsec rule's
+    remote addresses ({"rules": [{"name", "remote"}], "main": [...], "quick": [...]}).
+    NetSecurity has no traffic counters, so those stay None.
+    """
+    main = [_address(endpoint) for endpoint in _as_list(data.get("main"))]
+    quick = [_address(endpoint) for endpoint in _as_list(data.get("quick"))]
+    tunnels: Dict[str, TunnelStatus] = {}
+    for rule in _as_list(data.get("rules")):
+        networks = [_network(remote) for remote in _as_list(rule.get("remote"))]
+        networks = [network for network in networks if network is not None]
+
+        def matches(endpoint) -> bool:
+            return endpoint is not None and any(endpoint in network for network in networks)
+
+        tunnel = TunnelStatus(rule["name"], child_sas=sum(1 for endpoint in quick if matches(endpoint)))
+        if any(matches(endpoint) for endpoint in main):
+            tunnel.state = ESTABLISHED
+        tunnels[tunnel.name] = tunnel
+    return tunnels
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _duration(text: Optional[str]) -> Optional[int]:
+    """'12 minutes' -> 720"""
+    if not text:
+        return None
+    count, unit = text.split()
+    return int(count) * _DURATION_UNITS.get(unit.rstrip("s"), 0)
+
+def _as_list(value: Any) -> List[Any]:
+    # ConvertTo-Json turns one-element arrays into scalars
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _address(value: Any):
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+def _network(value: Any):
+    if value == "Any":
+        value = "0.0.0.0/0"
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional, Callable
+from shared import rendering
+from .base import PlatformManager
+from shared.tunnels import TunnelStatus
+from .linux import atomic_write
+from .status import parse_list_sas
+from .vici import ViciSession, ViciError
+
+logger = logging.getLogger(__name__)
+
+class SwanctlManager(PlatformManager):
+    """
+    strongSwan backend that talks to charon over VICI. Each policy becomes one
+    swanctl connection; only connections whose rendered config changed are
+    (re)loaded, so unrelated tunnels stay up.
+    """
+
+    supports_delta = True
+
+    def __init__(
+        self,
+        session_factory: Callable[[], ViciSession] = ViciSession,
+        conf_dir: str = "/etc/swanctl/conf.d",
+        state_path: str = "/var/lib/unified-ipsec-agent/swanctl.json"
+    ):
+        self.session_factory = session_factory
+        # Connections are also written to conf.d so `swanctl --load-all`
+        # restores them after a charon restart
+        self.conf_dir = conf_dir
+        self.state_path = state_path
+        # connection name -> hash of the config we loaded for it, and
+        # policy id -> connection name for delta syncs
+        self.applied: Dict[str, str] = {}
+        self.policy_names: Dict[int, str] = {}
+        self._load_state()
+
+    def apply_policy(self, policy: Dict[str, Any]) -> bool:
+        return self.apply_connections({policy['name']: policy})
+
+    def apply_connections(self, policies: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Make the set of managed connections match `policies` (name -> policy),
+        loading changed connections and unloading ones no longer wanted.
+        """
+        removed = [name for name in self.applied if name not in policies]
+        if not self._update_connections(policies, removed):
+            return False
+        self.policy_names = {policy['id']: name for name, policy in policies.items() if 'id' in policy}
+        self._save_state()
+        return True
+
+    def apply_delta(self, changed: List[Dict[str, Any]], removed: List[int], full: bool = False) -> bool:
+        upsert = {policy['name']: policy for policy in changed}
+        if full:
+            return self.apply_connections(upsert)
+
+        names = {policy['id']: policy['name'] for policy in changed}
+        unload = [self.policy_names[policy_id] for policy_id in removed if policy_id in self.policy_names]
+        # A renamed policy leaves its connection under the old name behind
+        unload += [self.policy_names[policy_id] for policy_id, name in names.items()
+                   if self.policy_names.get(policy_id, name) != name]
+        if not self._update_connections(upsert, [name for name in unload if name not in upsert]):
+            return False
+        for policy_id in removed:
+            self.policy_names.pop(policy_id, None)
+        self.policy_names.update(names)
+        self._save_state()
+        return True
+
+    def _update_connections(self, policies: Dict[str, Dict[str, Any]], removed: List[str]) -> bool:
+        """Load `policies` (name -> policy) whose config changed and unload `removed`."""
+        desired = {}
+        for name, policy in policies.items():
+            conn, secret = rendering.swanctl_connection(policy), rendering.swanctl_secret(policy)
+            desired[name] = (conn, secret, self._hash_connection(conn, secret))
+
+        changed = {name: entry for name, entry in desired.items() if self.applied.get(name) != entry[2]}
+        if not changed and not removed:
+            logger.debug("swanctl connections unchanged, skipping apply.")
+            return True
+
+        try:
+            with self.session_factory() as session:
+                for name in removed:
+                    logger.info(f"Unloading swanctl connection: {name}")
+                    self._unload(session, name)
+                    self.applied.pop(name, None)
+
+                for name, (conn, secret, conn_hash) in changed.items():
+                    logger.info(f"Loading swanctl connection: {name}")
+                    if secret is not None:
+                        session.request("load-shared", secret)
+                    session.request("load-conn", {name: conn})
+                    self._write_conf(name, conn, secret)
+                    self.applied[name] = conn_hash
+            return True
+        except (ViciError, OSError) as e:
+            logger.error(f"Failed to apply swanctl connections: {e}")
+            return False
+        finally:
+            self._save_state()
+
+    def collect_tunnel_status(self) -> List[TunnelStatus]:
+        try:
+            with self.session_factory() as session:
+                sas = session.streamed_request("list-sas", "list-sa")
+        except (ViciError, OSError) as e:
+            logger.error(f"Failed to query strongSwan SAs: {e}")
+            return []
+        tunnels = parse_list_sas(sas)
+        for name in self.applied:
+            tunnels.setdefault(name, TunnelStatus(name))
+        return list(tunnels.values())
+
+    def _unload(self, session: ViciSession, name: str):
+        try:
+            session.request("unload-conn", {"name": name})
+        except ViciError as e:
+            # Already gone (e.g. charon restarted without our conf.d file)
+            logger.warning(f"Could not unload connection {name}: {e}")
+        try:
+            session.request("unload-shared", {"id": rendering.swanctl_secret_id(name)})
+        except ViciError:
+            pass
+        try:
+            os.remove(self._conf_path(name))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _hash_connection(conn: Dict[str, Any], secret: Optional[Dict[str, Any]]) -> str:
+        return hashlib.sha256(json.dumps([conn, secret], sort_keys=True).encode()).hexdigest()
+
+    def _conf_path(self, name: str) -> str:
+        return os.path.join(self.conf_dir, rendering.swanctl_conf_name(name))
+
+    def _write_conf(self, name: str, conn: Dict[str, Any], secret: Optional[Dict[str, Any]]):
+        content = rendering.swanctl_conf_content(name, conn, secret)
+        os.makedirs(self.conf_dir, exist_ok=True)
+        atomic_write(self._conf_path(name), content, 0o600)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if "connections" not in state:
+            # Older state files only held the connection hashes
+            state = {"connections": state}
+        self.applied = state["connections"]
+        self.policy_names = {int(policy_id): name for policy_id, name in state.get("policies", {}).items()}
+
+    def _save_state(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            atomic_write(self.state_path, json.dumps({"connections": self.applied, "policies": self.policy_names}), 0o600)
+        except OSError as e:
+            logger.warning(f"Could not persist swanctl state: {e}")
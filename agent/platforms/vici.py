@@ -0,0 +1,216 @@
+import socket
+import struct
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/var/run/charon.vici"
+
+# Packet types
+CMD_REQUEST = 0
+CMD_RESPONSE = 1
+CMD_UNKNOWN = 2
+EVENT_REGISTER = 3
+EVENT_UNREGISTER = 4
+EVENT_CONFIRM = 5
+EVENT_UNKNOWN = 6
+EVENT = 7
+
+# Message element types
+SECTION_START = 1
+SECTION_END = 2
+KEY_VALUE = 3
+LIST_START = 4
+LIST_ITEM = 5
+LIST_END = 6
+
+
+class ViciError(Exception):
+    pass
+
+
+class SocketTransport:
+    """
+    Stream transport for VICI packets. Defaults to charon's UNIX socket;
+    pass family=socket.AF_INET and a (host, port) address to talk to a
+    local fake server instead.
+    """
+
+    def __init__(self, address: Any = DEFAULT_SOCKET, family: int = socket.AF_UNIX, timeout: float = 10.0):
+        self.address = address
+        self.family = family
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+
+    def connect(self):
+        self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.address)
+
+    def send(self, data: bytes):
+        self.sock.sendall(data)
+
+    def recv(self, size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise ViciError("VICI connection closed")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    out = bytearray()
+    for key, value in message.items():
+        name = key.encode()
+        if isinstance(value, dict):
+            out += struct.pack("!BB", SECTION_START, len(name)) + name
+            out += encode_message(value)
+            out += struct.pack("!B", SECTION_END)
+        elif isinstance(value, (list, tuple)):
+            out += struct.pack("!BB", LIST_START, len(name)) + name
+            for item in value:
+                data = _encode_value(item)
+                out += struct.pack("!BH", LIST_ITEM, len(data)) + data
+            out += struct.pack("!B", LIST_END)
+        else:
+            data = _encode_value(value)
+            out += struct.pack("!BB", KEY_VALUE, len(name)) + name
+            out += struct.pack("!H", len(data)) + data
+    return bytes(out)
+
+
+def _encode_value(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, bool):
+        return b"yes" if value else b"no"
+    return str(value).encode()
+
+
+def decode_message(data: bytes) -> Dict[str, Any]:
+    root: Dict[str, Any] = {}
+    stack = [root]
+    current_list: Optional[List[str]] = None
+    pos = 0
+    while pos < len(data):
+        element = data[pos]
+        pos += 1
+        if element == SECTION_START:
+            name, pos = _read_name(data, pos)
+            section: Dict[str, Any] = {}
+            stack[-1][name] = section
+            stack.append(section)
+        elif element == SECTION_END:
+            if len(stack) == 1:
+                raise ViciError("Unbalanced VICI section")
+            stack.pop()
+        elif element == KEY_VALUE:
+            name, pos = _read_name(data, pos)
+            value, pos = _read_value(data, pos)
+            stack[-1][name] = value
+        elif element == LIST_START:
+            name, pos = _read_name(data, pos)
+            current_list = []
+            stack[-1][name] = current_list
+        elif element == LIST_ITEM:
+            if current_list is None:
+                raise ViciError("VICI list item outside of list")
+            value, pos = _read_value(data, pos)
+            current_list.append(value)
+        elif element == LIST_END:
+            current_list = None
+        else:
+            raise ViciError(f"Unknown VICI element type {element}")
+    return root
+
+
+def _read_name(data: bytes, pos: int) -> Tuple[str, int]:
+    length = data[pos]
+    return data[pos + 1:pos + 1 + length].decode(), pos + 1 + length
+
+
+def _read_value(data: bytes, pos: int) -> Tuple[str, int]:
+    (length,) = struct.unpack_from("!H", data, pos)
+    return data[pos + 2:pos + 2 + length].decode(errors="replace"), pos + 2 + length
+
+
+class ViciSession:
+    """Minimal client for strongSwan's VICI protocol."""
+
+    def __init__(self, transport: Optional[SocketTransport] = None):
+        self.transport = transport or SocketTransport()
+        self.transport.connect()
+
+    def request(self, command: str, message: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Send a command and return its response, raising ViciError on failure."""
+        self._send(CMD_REQUEST, command, message)
+        packet_type, _, payload = self._recv()
+        if packet_type == CMD_UNKNOWN:
+            raise ViciError(f"Unknown VICI command '{command}'")
+        if packet_type != CMD_RESPONSE:
+            raise ViciError(f"Unexpected VICI packet type {packet_type}")
+        response = decode_message(payload)
+        if response.get("success") == "no":
+            raise ViciError(f"{command} failed: {response.get('errmsg', 'unknown error')}")
+        return response
+
+    def streamed_request(self, command: str, event: str, message: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Send a command that streams its results as events (e.g. list-sas)."""
+        self._register(EVENT_REGISTER, event)
+        try:
+            self._send(CMD_REQUEST, command, message)
+            events = []
+            while True:
+                packet_type, name, payload = self._recv()
+                if packet_type == EVENT and name == event:
+                    events.append(decode_message(payload))
+                elif packet_type == CMD_RESPONSE:
+                    response = decode_message(payload)
+                    if response.get("success") == "no":
+                        raise ViciError(f"{command} failed: {response.get('errmsg', 'unknown error')}")
+                    return events
+                elif packet_type == CMD_UNKNOWN:
+                    raise ViciError(f"Unknown VICI command '{command}'")
+        finally:
+            self._register(EVENT_UNREGISTER, event)
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _register(self, packet_type: int, event: str):
+        self._send(packet_type, event)
+        confirm, _, _ = self._recv()
+        if confirm != EVENT_CONFIRM:
+            raise ViciError(f"Registering for VICI event '{event}' failed")
+
+    def _send(self, packet_type: int, name: str, message: Optional[Dict[str, Any]] = None):
+        encoded_name = name.encode()
+        payload = struct.pack("!BB", packet_type, len(encoded_name)) + encoded_name
+        if message:
+            payload += encode_message(message)
+        self.transport.send(struct.pack("!I", len(payload)) + payload)
+
+    def _recv(self) -> Tuple[int, Optional[str], bytes]:
+        (length,) = struct.unpack("!I", self.transport.recv(4))
+        payload = self.transport.recv(length)
+        packet_type = payload[0]
+        if packet_type == EVENT:
+            name_length = payload[1]
+            name = payload[2:2 + name_length].decode()
+            return packet_type, name, payload[2 + name_length:]
+        return packet_type, None, payload[1:]
@@ -1,59 +1,141 @@
-import subprocess
+import os
+import json
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from shared import rendering
+from shared.tunnels import TunnelStatus
 from .base import PlatformManager
+from .linux import atomic_write
+from .pshost import PowerShellHost, PowerShellError
+from .status import parse_windows_sas
 
 logger = logging.getLogger(__name__)
 
+# IPsec rules with their remote addresses (address filters share the rule's
+# InstanceID) and the remote endpoints of all main and quick mode SAs
+STATUS_SCRIPT = r"""
+$remote = @{}
+Get-NetIPsecAddressFilter -ErrorAction SilentlyContinue | ForEach-Object { $remote[$_.InstanceID] = @($_.RemoteAddress) }
+@{
+    rules = @(Get-NetIPsecRule -ErrorAction SilentlyContinue | ForEach-Object { @{ name = $_.DisplayName; remote = $remote[$_.InstanceID] } })
+    main = @(Get-NetIPsecMainModeSA -ErrorAction SilentlyContinue | ForEach-Object { $_.RemoteEndpoint })
+    quick = @(Get-NetIPsecQuickModeSA -ErrorAction SilentlyContinue | ForEach-Object { $_.RemoteEndpoint })
+} | ConvertTo-Json -Compress -Depth 4
+"""
+
 class WindowsManager(PlatformManager):
+    render_format = "powershell"
+    supports_delta = True
+
+    def __init__(self, host: Optional[PowerShellHost] = None, state_path: Optional[str] = None):
+        # One PowerShell session for the agent's lifetime instead of a
+        # powershell.exe launch (and NetSecurity import) per call
+        self.host = host or PowerShellHost()
+        # Hash of the last script applied; the rule is only recreated when the
+        # rendered script changes. Rules persist across reboots, so does this.
+        self.applied_hash: Optional[str] = None
+        # Delta syncs: one rule per policy, rule name -> script hash and
+        # policy id -> rule name
+        self.rule_hashes: Dict[str, str] = {}
+        self.policy_names: Dict[int, str] = {}
+        self.state_path = state_path or os.path.join(
+            os.environ.get("PROGRAMDATA", r"C:\ProgramData"), "UnifiedIPsecAgent", "windows.json"
+        )
+        self._load_state()
+
     def apply_policy(self, policy: Dict[str, Any]) -> bool:
-        logger.info(f"Applying Windows IPsec policy: {policy['name']}")
-        
         # PowerShell script to apply IPsec rule
-        # This is a simplified example. Real implementation needs robust error handling and parameter mapping.
-        
-        local_net = policy.get('local_network_cidr', '0.0.0.0/0')
-        remote_net = policy.get('remote_network_cidr', '0.0.0.0/0')
-        auth_method = "PSK" if policy.get('auth_method') == 'psk' else "Certificate"
-        
-        # Note: New-NetIPsecRule is complex. We'll use a wrapper script or direct command.
-        # For this MVP, we'll construct a command string.
-        
-        ps_command = f"""
-        $ErrorActionPreference = "Stop"
-        
-        # Remove existing rule if exists
-        Remove-NetIPsecRule -DisplayName "{policy['name']}" -ErrorAction SilentlyContinue
-        
-        # Create new rule
-        New-NetIPsecRule -DisplayName "{policy['name']}" `
-            -LocalAddress {local_net} `
-            -RemoteAddress {remote_net} `
-            -Phase1AuthSet DefaultPhase1AuthSet `
-            -Phase2AuthSet DefaultPhase2AuthSet `
-            -KeyModule IKEv2 `
-            -Enabled True
-        """
-        
-        if policy.get('auth_method') == 'psk':
+        files = rendering.render_policy(policy, self.render_format)
+        script_hash = rendering.artifact_hash(files)
+
+        if policy.get('auth_method') == 'psk' and script_hash != self.applied_hash:
             # Windows IPsec with PSK usually requires specific setup or machine key.
             # This is a placeholder for the actual PSK logic which might involve 'netsh' or advanced PS.
             logger.warning("PSK authentication on Windows via PowerShell requires advanced configuration.")
-            
+
+        return self._apply_script(files["apply.ps1"], script_hash, policy['name'])
+
+    def apply_rendered(self, rendered: Dict[str, Any]) -> bool:
+        return self._apply_script(rendered["files"]["apply.ps1"], rendered["hash"], rendered.get("policy_name", "rendered"))
+
+    def apply_delta(self, changed: List[Dict[str, Any]], removed: List[int], full: bool = False) -> bool:
+        names = {policy['id']: policy['name'] for policy in changed}
+        if full:
+            stale = [name for name in self.rule_hashes if name not in names.values()]
+        else:
+            stale = [self.policy_names[policy_id] for policy_id in removed if policy_id in self.policy_names]
+            # A renamed policy leaves its rule under the old name behind
+            stale += [self.policy_names[policy_id] for policy_id, name in names.items()
+                      if self.policy_names.get(policy_id, name) != name]
+
+        try:
+            for name in stale:
+                if name in names.values():
+                    continue
+                logger.info(f"Removing Windows IPsec rule: {name}")
+                self.host.run(rendering.render_powershell_removal(name))
+                self.rule_hashes.pop(name, None)
+
+            for policy in changed:
+                files = rendering.render_policy(policy, self.render_format)
+                script_hash = rendering.artifact_hash(files)
+                if self.rule_hashes.get(policy['name']) == script_hash:
+                    continue
+                logger.info(f"Applying Windows IPsec policy: {policy['name']}")
+                self.host.run(files["apply.ps1"])
+                self.rule_hashes[policy['name']] = script_hash
+        except PowerShellError as e:
+            logger.error(f"Failed to apply Windows policy delta: {e}")
+            return False
+
+        if full:
+            self.policy_names = names
+        else:
+            for policy_id in removed:
+                self.policy_names.pop(policy_id, None)
+            self.policy_names.update(names)
+        self._save_state()
+        return True
+
+    def _apply_script(self, script: str, script_hash: str, name: str) -> bool:
+        if script_hash == self.applied_hash:
+            logger.debug(f"Windows IPsec policy {name} unchanged, skipping apply.")
+            return True
+
+        logger.info(f"Applying Windows IPsec policy: {name}")
         try:
-            subprocess.run(["powershell", "-Command", ps_command], check=True)
+            self.host.run(script)
             logger.info("Windows IPsec rule applied successfully.")
+            self.applied_hash = script_hash
+            self._save_state()
             return True
-        except subprocess.CalledProcessError as e:
+        except PowerShellError as e:
             logger.error(f"Failed to apply Windows policy: {e}")
             return False
 
-    def check_tunnel_status(self) -> bool:
+    def collect_tunnel_status(self) -> List[TunnelStatus]:
+        # One round trip for every rule and SA, matched up in Python
         try:
-            # Check if there are any active main mode SAs
-            cmd = "Get-NetIPsecMainModeSA | Measure-Object | Select-Object -ExpandProperty Count"
-            result = subprocess.run(["powershell", "-Command", cmd], capture_output=True, text=True)
-            count = int(result.stdout.strip())
-            return count > 0
-        except Exception:
-            return False
+            data = json.loads(self.host.run(STATUS_SCRIPT) or "{}")
+        except (PowerShellError, ValueError) as e:
+            logger.error(f"Failed to query Windows IPsec SAs: {e}")
+            return []
+        return list(parse_windows_sas(data).values())
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.applied_hash = state.get("applied_hash")
+        self.rule_hashes = state.get("rules", {})
+        self.policy_names = {int(policy_id): name for policy_id, name in state.get("policies", {}).items()}
+
+    def _save_state(self):
+        state = {"applied_hash": self.applied_hash, "rules": self.rule_hashes, "policies": self.policy_names}
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            atomic_write(self.state_path, json.dumps(state), 0o600)
+        except OSError as e:
+            logger.warning(f"Could not persist Windows IPsec state: {e}")
@@ -0,0 +1,75 @@
+import random
+from typing import Optional
+
+class PollScheduler:
+    """
+    Decides how long the agent waits between orchestrator requests.
+
+    Every delay is randomized so agents that started together (mass reboot,
+    orchestrator restart) drift apart instead of polling in lockstep.
+    Consecutive failures back off exponentially up to `max_backoff`, and
+    the orchestrator can slow agents down with Retry-After (on 429/503) or
+    an X-Poll-Interval above the agent's own interval.
+    """
+
+    def __init__(
+        self,
+        interval: float = 30.0,
+        jitter: float = 0.2,
+        min_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        max_long_poll: float = 55.0,
+        rng: Optional[random.Random] = None
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # Stay below the orchestrator's LONG_POLL_MAX_TIMEOUT
+        self.max_long_poll = max_long_poll
+        self.rng = rng or random.Random()
+        self.failures = 0
+        self.server_interval: Optional[float] = None
+        self.retry_after: Optional[float] = None
+
+    @property
+    def effective_interval(self) -> float:
+        # The server may slow agents down, never speed them up
+        return max(self.interval, self.server_interval or 0)
+
+    def startup_delay(self) -> float:
+        """Random splay for the first poll of an agent that already has a policy."""
+        return self.rng.uniform(0, self.effective_interval)
+
+    def long_poll_timeout(self) -> float:
+        return min(self.max_long_poll, self._jittered(self.effective_interval))
+
+    def record_success(self, poll_interval: Optional[float] = None):
+        self.failures = 0
+        self.retry_after = None
+        if poll_interval is not None:
+            self.server_interval = poll_interval
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        self.failures += 1
+        self.retry_after = retry_after
+
+    def next_delay(self, long_poll: bool = False) -> float:
+        """Seconds to wait before the next request."""
+        if self.failures:
+            # Exponential backoff with "equal jitter": at least half the step
+            step = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+            delay = step / 2 + self.rng.uniform(0, step / 2)
+            if self.retry_after is not None:
+                delay = max(delay, self.retry_after * self.rng.uniform(1, 1 + self.jitter))
+            return delay
+
+        if long_poll:
+            # The wait already happened on the server; only spread reconnects,
+            # plus whatever the server asks for beyond the long-poll timeout
+            extra = max(0.0, self.effective_interval - self.max_long_poll)
+            return extra + self.rng.uniform(0, min(1.0, self.jitter * self.effective_interval))
+        return self._jittered(self.effective_interval)
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import logging
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, Any, Optional
+from .platforms.linux import atomic_write
+
+logger = logging.getLogger(__name__)
+
+def default_state_path() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get("PROGRAMDATA", r"C:\ProgramData")
+        return os.path.join(base, "UnifiedIPsecAgent", "state.json")
+    return "/var/lib/unified-ipsec-agent/state.json"
+
+@dataclass
+class AgentState:
+    """
+    What the agent knows from the orchestrator, persisted so a restarted
+    agent can enforce its last policy without waiting on the network.
+    Holds PSKs, so the file is written owner-readable only.
+    """
+    enrollment_token: Optional[str] = None
+    device_id: Optional[int] = None
+    public_ip: Optional[str] = None
+    policy: Optional[Dict[str, Any]] = None
+    policy_etag: Optional[str] = None
+    rendered: Optional[Dict[str, Any]] = None
+    rendered_policy_etag: Optional[str] = None
+    sync_cursor: int = 0
+    # Bearer token for the agent endpoints and when it expires (Unix time)
+    device_token: Optional[str] = None
+    device_token_expires_at: float = 0.0
+    # Set by save(); not persisted
+    path: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: str, enrollment_token: str) -> "AgentState":
+        """Load the state for `enrollment_token`; a state file for another token is ignored."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable agent state {path}: {e}")
+            data = {}
+
+        if data.get("enrollment_token") != enrollment_token:
+            return cls(enrollment_token=enrollment_token, path=path)
+        known = {field.name for field in fields(cls)} - {"path"}
+        return cls(**{key: value for key, value in data.items() if key in known}, path=path)
+
+    def save(self):
+        if not self.path:
+            return
+        data = asdict(self)
+        data.pop("path")
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            atomic_write(self.path, json.dumps(data), 0o600)
+        except OSError as e:
+            logger.warning(f"Could not persist agent state: {e}")
@@ -71,6 +71,8 @@ def run_tests():
     }
     success, device = print_result("Enroll Device", requests.post(f"{BASE_URL}/devices/enroll", json=device_data, headers=HEADERS))
     device_id = device['id'] if success else None
+    # Agent endpoints take the device token returned by enrollment
+    device_headers = {"Authorization": f"Bearer {device['token']}"} if success else {}
 
     # 7. List Devices
     print_result("List Devices", requests.get(f"{BASE_URL}/devices/"))
@@ -85,7 +87,7 @@ def run_tests():
 
     # 10. Get Device Config (Verify Policy Assignment)
     if device_id:
-        print_result(f"Get Device {device_id} Config", requests.get(f"{BASE_URL}/devices/{device_id}/config"))
+        print_result(f"Get Device {device_id} Config", requests.get(f"{BASE_URL}/devices/{device_id}/config", headers=device_headers))
 
     print("\nTest Suite Completed.")
 
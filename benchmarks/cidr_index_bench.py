@@ -0,0 +1,94 @@
+"""
+Benchmarks the orchestrator's selector index (orchestrator/cidr_index.py)
+against a linear scan over every policy, for overlap checks and "which
+policies cover this address" lookups.
+
+    python -m benchmarks.cidr_index_bench --policies 10000 50000
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import ipaddress
+from typing import Dict, List, Tuple
+
+from orchestrator.cidr_index import SelectorIndex
+
+def random_network(rng: random.Random, prefixlens=(16, 20, 24, 24, 24, 28, 32)) -> ipaddress.IPv4Network:
+    prefixlen = rng.choice(prefixlens)
+    address = rng.getrandbits(32) & ~((1 << (32 - prefixlen)) - 1)
+    return ipaddress.IPv4Network((address, prefixlen))
+
+def make_policies(count: int, rng: random.Random) -> Dict[int, Tuple[ipaddress.IPv4Network, ipaddress.IPv4Network]]:
+    # Hub and spoke: a handful of hub networks, spokes mostly distinct
+    hubs = [random_network(rng, (16, 24)) for _ in range(8)]
+    return {policy_id: (rng.choice(hubs), random_network(rng)) for policy_id in range(1, count + 1)}
+
+def scan_conflicts(policies, local, remote) -> List[int]:
+    return sorted(policy_id for policy_id, (l, r) in policies.items() if l.overlaps(local) and r.overlaps(remote))
+
+def scan_covering(policies, address) -> List[int]:
+    return sorted(policy_id for policy_id, (_, r) in policies.items() if address in r)
+
+def per_op_us(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+def run(count: int, queries: int, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    policies = make_policies(count, rng)
+    hubs = sorted({local for local, _ in policies.values()})
+
+    start = time.perf_counter()
+    index = SelectorIndex()
+    for policy_id, (local, remote) in policies.items():
+        index.set(policy_id, local, remote)
+    build_s = time.perf_counter() - start
+
+    checks = [(rng.choice(hubs), random_network(rng)) for _ in range(queries)]
+    addresses = [ipaddress.IPv4Address(rng.getrandbits(32)) for _ in range(queries)]
+    # Half the lookups hit a policy's remote network
+    remotes = [remote for _, remote in policies.values()]
+    addresses[::2] = [rng.choice(remotes)[0] for _ in addresses[::2]]
+
+    # The index must agree with the scan
+    for local, remote in checks[:50]:
+        assert index.conflicts(local, remote) == scan_conflicts(policies, local, remote)
+    for address in addresses[:50]:
+        assert index.covering(address) == scan_covering(policies, address)
+
+    scan_sample = max(1, queries // 20)  # The scans are slow; time fewer of them
+    return {
+        "policies": count,
+        "build_s": round(build_s, 3),
+        "conflicts_index_us": round(per_op_us(lambda check: index.conflicts(*check), checks), 1),
+        "conflicts_scan_us": round(per_op_us(lambda check: scan_conflicts(policies, *check), checks[:scan_sample]), 1),
+        "covering_index_us": round(per_op_us(index.covering, addresses), 1),
+        "covering_scan_us": round(per_op_us(lambda address: scan_covering(policies, address), addresses[:scan_sample]), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policies", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [run(count, args.queries, args.seed) for count in args.policies]
+    print(f"{'policies':>9} {'build s':>8} {'conflicts us (index/scan)':>26} {'covering us (index/scan)':>25}")
+    for result in results:
+        print(f"{result['policies']:>9} {result['build_s']:>8} "
+              f"{result['conflicts_index_us']:>12} / {result['conflicts_scan_us']:<11} "
+              f"{result['covering_index_us']:>11} / {result['covering_scan_us']:<11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Serialization cost and size of a device listing (GET /devices/ and the
+compact GET /devices/compact page) per response encoding: the stdlib JSON
+path older FastAPI versions used, pydantic-core JSON (current FastAPI),
+orjson, msgpack as produced by MsgpackMiddleware, and gzip/brotli on top.
+
+    python -m benchmarks.encoding_bench --devices 10000
+"""
+import sys
+import json
+import gzip
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from orchestrator import schemas
+from orchestrator.encoding import MsgpackMiddleware, brotli, msgpack, orjson, BROTLI_QUALITY, GZIP_LEVEL
+
+def make_listing(count: int, policies: int, seed: int):
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    policy_objs = [
+        schemas.Policy(
+            id=i, name=f"policy-{i}", local_network_cidr=f"10.{i % 250}.0.0/16",
+            remote_network_cidr=f"172.16.{i % 250}.0/24", auth_method="psk", revision=rng.randint(1, 20), created_at=now
+        )
+        for i in range(1, policies + 1)
+    ]
+    devices = []
+    for i in range(1, count + 1):
+        policy = rng.choice(policy_objs)
+        devices.append(schemas.Device(
+            id=i, hostname=f"host-{i:06d}.branch.example.com", os_type=rng.choice(["linux", "windows", "macos"]),
+            public_ip=f"198.51.{rng.randint(0, 255)}.{rng.randint(1, 254)}", is_active=True,
+            last_seen=now - timedelta(seconds=rng.randint(0, 3600)), tunnel_up=rng.random() < 0.9,
+            policy_id=policy.id, created_at=now, policy=policy
+        ))
+    page = schemas.DevicePage(
+        devices=[schemas.DeviceSummary(**device.model_dump(exclude={"policy"})) for device in devices],
+        policies={policy.id: policy for policy in policy_objs}
+    )
+    return devices, page
+
+def best_ms(fn: Callable[[], bytes], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 2)
+
+def measure(name: str, value, adapter: TypeAdapter, repeat: int) -> Dict:
+    encoders = {
+        "stdlib_json": lambda: json.dumps(jsonable_encoder(value)).encode(),
+        "pydantic_json": lambda: adapter.dump_json(value),
+    }
+    if orjson is not None:
+        encoders["orjson"] = lambda: orjson.dumps(adapter.dump_python(value, mode="json"))
+    json_body = adapter.dump_json(value)
+    if msgpack is not None:
+        middleware = MsgpackMiddleware(app=None)
+        # What a msgpack client costs the server: JSON from the route, transcoded
+        encoders["msgpack"] = lambda: middleware.pack(adapter.dump_json(value))
+
+    result = {"payload": name, "encode_ms": {}, "bytes": {}}
+    bodies = {}
+    for encoder, fn in encoders.items():
+        result["encode_ms"][encoder] = best_ms(fn, repeat)
+        bodies[encoder] = fn()
+    result["bytes"]["json"] = len(json_body)
+    variants = {"json": json_body}
+    if msgpack is not None:
+        result["bytes"]["msgpack"] = len(bodies["msgpack"])
+        variants["msgpack"] = bodies["msgpack"]
+
+    for variant, body in variants.items():
+        result["encode_ms"][f"{variant}+gzip"] = best_ms(lambda: gzip.compress(body, GZIP_LEVEL), repeat)
+        result["bytes"][f"{variant}+gzip"] = len(gzip.compress(body, GZIP_LEVEL))
+        if brotli is not None:
+            result["encode_ms"][f"{variant}+br"] = best_ms(lambda: brotli.compress(body, quality=BROTLI_QUALITY), repeat)
+            result["bytes"][f"{variant}+br"] = len(brotli.compress(body, quality=BROTLI_QUALITY))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--policies", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    devices, page = make_listing(args.devices, args.policies, args.seed)
+    results: List[Dict] = [
+        measure(f"GET /devices/ ({args.devices} devices)", devices, TypeAdapter(List[schemas.Device]), args.repeat),
+        measure(f"GET /devices/compact ({args.devices} devices)", page, TypeAdapter(schemas.DevicePage), args.repeat),
+    ]
+    for result in results:
+        print(result["payload"])
+        print(f"  {'encoding':<16} {'ms':>9}")
+        for encoder, ms in result["encode_ms"].items():
+            print(f"  {encoder:<16} {ms:>9}")
+        print(f"  {'body':<16} {'bytes':>9}")
+        for variant, size in result["bytes"].items():
+            print(f"  {variant:<16} {size:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+Simulates a fleet of agents against the orchestrator and reports throughput,
+latency percentiles and DB query counts per endpoint.
+
+    # In-process (temporary SQLite database, DB query counts available)
+    python -m benchmarks.load_test --agents 2000 --output bench.json
+
+    # Against a running server (e.g. uvicorn orchestrator.main:app)
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --agents 2000
+
+    # Compare with an earlier run
+    python -m benchmarks.load_test --agents 2000 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latency samples and status codes per endpoint label."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.queries: Dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[label].append(time.perf_counter() - started)
+        self.statuses[label][response.status_code] += 1
+        return response
+
+
+class QueryCounter:
+    """Counts SQL statements on the in-process engines."""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+@asynccontextmanager
+async def in_process_client():
+    # Point the orchestrator at a throwaway database before importing it
+    db_path = os.path.join(tempfile.mkdtemp(prefix="ipsec-bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    from orchestrator.main import app
+    from orchestrator.database import engine, async_engine
+
+    counter = QueryCounter([engine, async_engine.sync_engine])
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://orchestrator") as client:
+            yield client, counter
+
+
+@asynccontextmanager
+async def remote_client(url: str, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        yield client, None
+
+
+async def run_phase(name: str, jobs, concurrency: int, counter: Optional[QueryCounter], results: dict):
+    """Run coroutine factories with bounded concurrency and record phase totals."""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def run(job):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await job()
+            except Exception:
+                errors += 1
+
+    queries_before = counter.count if counter else 0
+    started = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+    elapsed = time.perf_counter() - started
+    results[name] = {
+        "jobs": len(jobs),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "db_queries": (counter.count - queries_before) if counter else None,
+    }
+    print(f"  {name}: {len(jobs)} jobs in {elapsed:.2f}s ({errors} errors)")
+
+
+def summarize(recorder: Recorder, phases: dict) -> dict:
+    endpoints = {}
+    for label, samples in recorder.latencies.items():
+        ordered = sorted(samples)
+        phase = phases.get(label.split(" ", 1)[0], {})
+        endpoints[label] = {
+            "requests": len(samples),
+            "statuses": dict(recorder.statuses[label]),
+            "throughput_rps": round(len(samples) / phase["seconds"], 1) if phase.get("seconds") else None,
+            "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        }
+    return endpoints
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run_benchmark(args) -> dict:
+    recorder = Recorder()
+    phases: dict = {}
+    run_id = uuid.uuid4().hex[:8]
+    factory = remote_client(args.url, args.concurrency) if args.url else in_process_client()
+
+    async with factory as (client, counter):
+        # 1. Enrollment storm: every agent enrolls at once
+        device_ids: List[int] = []
+        tokens: Dict[int, str] = {}
+
+        def enroll_job(i):
+            async def job():
+                response = await recorder.request(client, "enroll POST /devices/enroll", "POST", "/devices/enroll", json={
+                    "hostname": f"bench-{run_id}-{i}",
+                    "os_type": "linux" if i % 2 else "windows",
+                    "public_ip": "198.51.100.1",
+                    "enrollment_token": f"bench-{run_id}-{i}",
+                })
+                response.raise_for_status()
+                data = response.json()
+                device_ids.append(data["id"])
+                tokens[data["id"]] = data["token"]
+            return job
+
+        await run_phase("enroll", [enroll_job(i) for i in range(args.agents)], args.concurrency, counter, phases)
+
+        response = await client.post("/policies/", json={
+            "name": f"bench-{run_id}",
+            "local_network_cidr": "10.0.0.0/24",
+            "remote_network_cidr": "10.1.0.0/24",
+            "auth_method": "psk",
+            "psk_secret": "bench",
+        })
+        response.raise_for_status()
+        policy_id = response.json()["id"]
+
+        # 2. Assignment storm: one request per device, as the admin UI does
+        def assign_job(device_id):
+            async def job():
+                response = await recorder.request(
+                    client, "assign POST /policies/{id}/assign/{id}", "POST", f"/policies/{policy_id}/assign/{device_id}"
+                )
+                response.raise_for_status()
+            return job
+
+        await run_phase("assign", [assign_job(d) for d in device_ids], args.concurrency, counter, phases)
+
+        # 3. Poll storm: agents fetch their config, then re-poll with the ETag
+        etags: Dict[int, str] = {}
+
+        def poll_job(device_id):
+            async def job():
+                for _ in range(args.polls):
+                    # Verified in memory after the first poll: still no DB query per poll
+                    headers = {"Authorization": f"Bearer {tokens[device_id]}"}
+                    if device_id in etags:
+                        headers["If-None-Match"] = etags[device_id]
+                    response = await recorder.request(
+                        client, "poll GET /devices/{id}/config", "GET", f"/devices/{device_id}/config", headers=headers
+                    )
+                    if response.status_code == 200:
+                        etags[device_id] = response.headers.get("ETag", "")
+            return job
+
+        await run_phase("poll", [poll_job(d) for d in device_ids], args.concurrency, counter, phases)
+
+        # 4. Dashboard-style listing of the whole fleet
+        async def list_job():
+            after = None
+            while True:
+                params = {"limit": 1000, **({"after": after} if after else {})}
+                response = await recorder.request(client, "list GET /devices/", "GET", "/devices/", params=params)
+                after = response.headers.get("X-Next-Cursor")
+                if not after:
+                    break
+
+        await run_phase("list", [list_job], 1, counter, phases)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "target": args.url or "in-process",
+            "agents": args.agents,
+            "concurrency": args.concurrency,
+            "polls_per_agent": args.polls,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "phases": phases,
+        "endpoints": summarize(recorder, phases),
+    }
+
+
+def print_report(results: dict, baseline: Optional[dict] = None):
+    print(f"\n{'endpoint':45} {'reqs':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, stats in results["endpoints"].items():
+        line = (f"{label:45} {stats['requests']:>7} {stats['throughput_rps'] or 0:>9} "
+                f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+        old = (baseline or {}).get("endpoints", {}).get(label)
+        if old and old["p95_ms"]:
+            line += f"   p95 {(stats['p95_ms'] - old['p95_ms']) / old['p95_ms']:+.0%} vs baseline"
+        print(line)
+    for name, phase in results["phases"].items():
+        if phase["db_queries"] is not None:
+            print(f"{name}: {phase['db_queries']} DB queries ({phase['db_queries'] / max(phase['jobs'], 1):.2f} per job)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Orchestrator base URL (default: run the app in-process)")
+    parser.add_argument("--agents", type=int, default=1000, help="Number of simulated agents")
+    parser.add_argument("--concurrency", type=int, default=200, help="Maximum requests in flight")
+    parser.add_argument("--polls", type=int, default=3, help="Config polls per agent")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(f"Simulating {args.agents} agents against {args.url or 'in-process app'}...")
+    results = asyncio.run(run_benchmark(args))
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
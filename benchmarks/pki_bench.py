@@ -0,0 +1,129 @@
+"""
+Measures device certificate issuance throughput (orchestrator/pki.py):
+signing CSRs inline with the CA key loaded per request or cached, and
+through the batching process pool; then issuing without a CSR, with keys
+generated on demand or taken from a pre-generated pool.
+
+    python -m benchmarks.pki_bench --requests 2000 --workers 1 2 4
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+
+from orchestrator.pki import CertificateAuthority, SigningRequest, create_ca, generate_key, key_to_pem, sign_request
+
+def make_csrs(count: int, key_type: str) -> List[bytes]:
+    csrs = []
+    for i in range(count):
+        csr = x509.CertificateSigningRequestBuilder() \
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, f"bench-{i}")])) \
+            .sign(generate_key(key_type), hashes.SHA256())
+        csrs.append(csr.public_bytes(serialization.Encoding.PEM))
+    return csrs
+
+def requests_for(csrs: List[bytes]) -> List[SigningRequest]:
+    return [SigningRequest(csr, f"device-{i}", [f"host-{i}.example"], 365) for i, csr in enumerate(csrs)]
+
+def per_second(count: int, elapsed: float) -> float:
+    return round(count / elapsed, 1)
+
+def inline(requests: List[SigningRequest], cert_path: str, key_path: str, cached: bool) -> float:
+    with open(cert_path, "rb") as f:
+        ca_cert = x509.load_pem_x509_certificate(f.read())
+    ca_key = None
+    start = time.perf_counter()
+    for request in requests:
+        if ca_key is None or not cached:
+            with open(key_path, "rb") as f:
+                ca_key = serialization.load_pem_private_key(f.read(), password=None)
+        sign_request(request, ca_cert, ca_key)
+    return per_second(len(requests), time.perf_counter() - start)
+
+async def pooled(requests: List[SigningRequest], ca: CertificateAuthority, concurrency: int) -> float:
+    queue = list(reversed(requests))
+
+    async def client():
+        while queue:
+            await ca.sign(queue.pop())
+
+    # Warm the workers up (spawn + CA load) before timing
+    await asyncio.gather(*(ca.sign(request) for request in requests[:ca.workers * 2]))
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return per_second(len(requests), time.perf_counter() - start)
+
+def keyless(count: int, cert_path: str, key_path: str, key_type: str, pool: List[bytes]) -> float:
+    """Sign `count` server-keyed requests inline; keys come from `pool` if given."""
+    with open(cert_path, "rb") as f:
+        ca_cert = x509.load_pem_x509_certificate(f.read())
+    with open(key_path, "rb") as f:
+        ca_key = serialization.load_pem_private_key(f.read(), password=None)
+    start = time.perf_counter()
+    for i in range(count):
+        key_pem = pool.pop() if pool else key_to_pem(generate_key(key_type))
+        sign_request(SigningRequest(None, f"device-{i}", [], 365, key_pem=key_pem), ca_cert, ca_key)
+    return per_second(count, time.perf_counter() - start)
+
+def run(count: int, workers: List[int], concurrency: int, key_type: str, batch_size: int) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path, key_path = os.path.join(tmp, "ca.pem"), os.path.join(tmp, "ca.key")
+        create_ca(cert_path, key_path, "Benchmark CA")
+        requests = requests_for(make_csrs(count, key_type))
+
+        results = {
+            "requests": count,
+            "key_type": key_type,
+            "inline_reload_per_s": inline(requests, cert_path, key_path, cached=False),
+            "inline_cached_per_s": inline(requests, cert_path, key_path, cached=True),
+            "pool_per_s": {},
+        }
+        for worker_count in workers:
+            ca = CertificateAuthority(cert_path, key_path, workers=worker_count, batch_size=batch_size)
+            ca.start()
+            try:
+                results["pool_per_s"][worker_count] = asyncio.run(pooled(requests, ca, concurrency))
+            finally:
+                ca.close()
+
+        keyless_count = max(1, count // 4)
+        results["keygen_on_demand_per_s"] = keyless(keyless_count, cert_path, key_path, key_type, [])
+        key_pool = [key_to_pem(generate_key(key_type)) for _ in range(keyless_count)]
+        results["keygen_pooled_per_s"] = keyless(keyless_count, cert_path, key_path, key_type, key_pool)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=256, help="Concurrent requests against the pool")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--key-type", choices=["ec", "rsa"], default="ec")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.workers, args.concurrency, args.key_type, args.batch_size)
+    print(f"Issuance throughput, {results['requests']} CSRs ({results['key_type']}), certificates/s:")
+    print(f"  inline, CA key loaded per request  {results['inline_reload_per_s']:>10}")
+    print(f"  inline, CA key cached              {results['inline_cached_per_s']:>10}")
+    for worker_count, rate in results["pool_per_s"].items():
+        print(f"  process pool, {worker_count} worker(s)          {rate:>10}")
+    print("Without a CSR (inline, cached CA key):")
+    print(f"  key generated per request          {results['keygen_on_demand_per_s']:>10}")
+    print(f"  key from pre-generated pool        {results['keygen_pooled_per_s']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Simulates a fleet of agents polling an orchestrator that is down for the
+first --outage seconds and can serve --capacity requests per second after
+that (excess requests get 503 + Retry-After). Compares the legacy fixed
+30s loop with agent.scheduler.PollScheduler and reports how evenly the
+request rate is spread once the orchestrator is back.
+
+    python -m benchmarks.poll_schedule_sim --agents 5000 --capacity 400
+
+tests/test_scheduler.py runs a small fleet through the same simulation and
+asserts that the rate flattens and nothing is rejected after recovery.
+"""
+import sys
+import json
+import heapq
+import random
+import argparse
+from collections import Counter
+from typing import Dict, List
+
+from agent.scheduler import PollScheduler
+
+
+class SimulatedOrchestrator:
+    def __init__(self, outage: float, capacity: int, retry_after: float):
+        self.outage = outage
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.requests: Counter = Counter()  # second -> requests received
+        self.served: Counter = Counter()
+
+    def request(self, now: float):
+        """Returns (ok, retry_after)."""
+        second = int(now)
+        self.requests[second] += 1
+        if now < self.outage:
+            return False, None  # Connection refused, no hint
+        if self.served[second] >= self.capacity:
+            return False, self.retry_after
+        self.served[second] += 1
+        return True, None
+
+
+def simulate(strategy: str, args) -> Dict[str, object]:
+    rng = random.Random(args.seed)
+    server = SimulatedOrchestrator(args.outage, args.capacity, args.retry_after)
+    schedulers: List[PollScheduler] = []
+    events = []
+    for agent in range(args.agents):
+        # Mass reboot: every agent comes up at t=0 with a cached policy
+        scheduler = PollScheduler(interval=args.interval, rng=random.Random(rng.random()))
+        schedulers.append(scheduler)
+        first = scheduler.startup_delay() if strategy == "scheduler" else 0.0
+        heapq.heappush(events, (first, agent))
+
+    while events:
+        now, agent = heapq.heappop(events)
+        if now >= args.duration:
+            break
+        ok, retry_after = server.request(now)
+        if strategy == "fixed":
+            # Legacy loop: time.sleep(30) whatever happened
+            delay = args.interval
+        else:
+            scheduler = schedulers[agent]
+            if ok:
+                scheduler.record_success()
+            else:
+                scheduler.record_failure(retry_after)
+            delay = scheduler.next_delay()
+        heapq.heappush(events, (now + delay, agent))
+
+    # Rate statistics once the orchestrator is back up
+    seconds = range(int(args.outage), int(args.duration))
+    rates = sorted(server.requests[second] for second in seconds)
+    mean = sum(rates) / len(rates)
+    variance = sum((rate - mean) ** 2 for rate in rates) / len(rates)
+    overloaded = sum(1 for second in seconds if server.requests[second] > args.capacity)
+    served = sum(server.served[second] for second in seconds)
+    return {
+        "strategy": strategy,
+        "peak_rps": rates[-1],
+        "p99_rps": rates[min(len(rates) - 1, int(len(rates) * 0.99))],
+        "mean_rps": round(mean, 1),
+        "stddev_rps": round(variance ** 0.5, 1),
+        "seconds_over_capacity": overloaded,
+        "rejected": sum(server.requests[second] for second in seconds) - served,
+        "served": served,
+        "timeline": [server.requests[second] for second in range(int(args.duration))],
+    }
+
+
+def sparkline(values: List[int], width: int = 60) -> str:
+    """Peak requests per second in `width` buckets, as a text bar chart."""
+    blocks = " ▁▂▃▄▅▆▇█"
+    size = max(1, len(values) // width)
+    peaks = [max(values[i:i + size]) for i in range(0, len(values), size)]
+    top = max(peaks) or 1
+    return "".join(blocks[round(peak / top * (len(blocks) - 1))] for peak in peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=5000)
+    parser.add_argument("--interval", type=float, default=30.0, help="Agent poll interval (seconds)")
+    parser.add_argument("--capacity", type=int, default=400, help="Requests per second the orchestrator can serve")
+    parser.add_argument("--outage", type=float, default=120.0, help="Seconds the orchestrator is down at the start")
+    parser.add_argument("--retry-after", type=float, default=30.0, help="Retry-After sent with 503s")
+    parser.add_argument("--duration", type=float, default=900.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    print(f"{args.agents} agents, {args.interval:g}s interval, outage {args.outage:g}s, "
+          f"capacity {args.capacity} req/s; rates measured after recovery\n")
+    results = [simulate(strategy, args) for strategy in ("fixed", "scheduler")]
+    print(f"{'strategy':10} {'peak':>6} {'p99':>6} {'mean':>7} {'stddev':>7} {'s>cap':>6} {'rejected':>9}")
+    for result in results:
+        print(f"{result['strategy']:10} {result['peak_rps']:>6} {result['p99_rps']:>6} {result['mean_rps']:>7} "
+              f"{result['stddev_rps']:>7} {result['seconds_over_capacity']:>6} {result['rejected']:>9}")
+    print()
+    for result in results:
+        print(f"{result['strategy']:10} |{sparkline(result['timeline'])}|")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Device tokens: enrollment hands the agent a signed, expiring JWT naming
+its device, which agent requests carry as a bearer token. Verification
+needs no database access: signatures are checked in memory, tokens
+already verified are cached, and revocations are a small in-memory
+device_id -> cutoff map that every worker reloads in the background.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from fastapi import Header, HTTPException, status
+from jose import jwt, JWTError
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, database
+from .config import get_settings
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TYPE = "device"
+
+class TokenError(Exception):
+    """The token is malformed, badly signed, expired or revoked."""
+
+class DeviceTokens:
+    """
+    Issues and verifies device tokens. A token's claims are its device
+    (sub), issue time (iat, fractional so a revocation never catches
+    tokens issued right after it) and expiry (exp).
+    """
+
+    def __init__(self, secret_key: str, algorithm: str, lifetime: float, cache_size: int = 100_000):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.lifetime = lifetime
+        self.cache_size = cache_size
+        # token -> (device_id, issued_at, expires_at) for tokens that passed
+        # signature checks; a hit skips decoding and the HMAC
+        self._verified: "OrderedDict[str, Tuple[int, float, float]]" = OrderedDict()
+        # device_id -> tokens issued before this time are revoked
+        self._revoked: Dict[int, float] = {}
+
+    def issue(self, device_id: int) -> Tuple[str, int]:
+        """A new token for `device_id` and its lifetime in seconds."""
+        now = time.time()
+        expires_at = int(now + self.lifetime)
+        token = jwt.encode(
+            {"sub": str(device_id), "typ": TOKEN_TYPE, "iat": now, "exp": expires_at},
+            self.secret_key, algorithm=self.algorithm
+        )
+        return token, expires_at - int(now)
+
+    def verify(self, token: str) -> int:
+        """The device id the token was issued to; raises TokenError."""
+        now = time.time()
+        verified = self._verified.get(token)
+        if verified is None:
+            try:
+                claims = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+                if claims.get("typ") != TOKEN_TYPE:
+                    raise TokenError("Not a device token")
+                verified = (int(claims["sub"]), float(claims["iat"]), float(claims["exp"]))
+            except JWTError as e:
+                raise TokenError(f"Invalid token: {e}")
+            except (KeyError, TypeError, ValueError):
+                raise TokenError("Invalid token claims")
+            self._verified[token] = verified
+            if len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        else:
+            self._verified.move_to_end(token)
+
+        device_id, issued_at, expires_at = verified
+        if expires_at <= now:
+            self._verified.pop(token, None)
+            raise TokenError("Token expired")
+        if issued_at < self._revoked.get(device_id, 0.0):
+            raise TokenError("Token revoked")
+        return device_id
+
+    async def revoke(self, db: AsyncSession, device_id: int):
+        """Invalidate every token issued to `device_id` so far, in all workers."""
+        now = time.time()
+        await database.upsert(
+            db, models.DeviceTokenRevocation, [{"device_id": device_id, "revoked_before": now}],
+            ["device_id"], ["revoked_before"]
+        )
+        await db.commit()
+        self._revoked[device_id] = now
+
+    async def sync(self):
+        """
+        Reload revocations. Revocations older than the token lifetime can no
+        longer match a live token, so they are dropped; the table stays as
+        small as the number of devices revoked within one token lifetime.
+        """
+        cutoff = time.time() - self.lifetime
+        revocation = models.DeviceTokenRevocation
+        async with database.AsyncSessionLocal() as db:
+            rows = (await db.execute(select(revocation.device_id, revocation.revoked_before))).all()
+            if any(revoked_before < cutoff for _, revoked_before in rows):
+                await db.execute(delete(revocation).where(revocation.revoked_before < cutoff))
+                await db.commit()
+        self._revoked = {device_id: revoked_before for device_id, revoked_before in rows if revoked_before >= cutoff}
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Token revocation sync failed: {e}")
+
+device_tokens = DeviceTokens(
+    settings.SECRET_KEY, settings.ALGORITHM, settings.DEVICE_TOKEN_EXPIRE_MINUTES * 60
+)
+
+async def require_device(device_id: int, authorization: Optional[str] = Header(None)):
+    """
+    Dependency for agent endpoints: the request must carry a valid token
+    for the {device_id} in its path. Costs no database query.
+    """
+    if authorization is None and not settings.DEVICE_TOKEN_REQUIRED:
+        return
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Device token required",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    try:
+        token_device_id = device_tokens.verify(token)
+    except TokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    if token_device_id != device_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token was issued to another device")
@@ -0,0 +1,286 @@
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, database
+from .cidr_index import selector_index
+from .config import get_settings
+from .notifier import notifier
+from shared import rendering
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+# Above this many devices a change is published as "all devices changed"
+# rather than one change row per device
+MAX_DEVICE_CHANGE_ROWS = 1000
+# Change event ids are allocated at insert but become visible at commit,
+# so a lower id can appear after a higher one was read. Recent events are
+# re-read for this long and applied once each.
+CHANGE_EVENT_LOOKBACK = timedelta(seconds=60)
+
+@dataclass
+class CachedPolicy:
+    policy_id: int
+    revision: int
+    etag: str
+    body: bytes  # Pre-serialized schemas.Policy JSON
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+@dataclass
+class CachedRender:
+    revision: int
+    etag: str
+    body: bytes  # Pre-serialized schemas.RenderedConfig JSON
+
+def policy_etag(policy_id: int, revision: int) -> str:
+    return f'"{policy_id}-{revision}"'
+
+class PolicyCache:
+    """
+    Read-through cache of serialized policies plus a device -> policy_id
+    index, so config fetches for known devices need no database access.
+
+    Writers publish changes through `publish_changes`, which invalidates this
+    worker immediately and appends rows to the change_events table; every
+    worker polls that table and invalidates its own copy, so other workers
+    converge within CACHE_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 64 * 1024 * 1024, max_devices: int = 1_000_000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_devices = max_devices
+        self._policies: "OrderedDict[int, CachedPolicy]" = OrderedDict()
+        self._bytes = 0
+        # device_id -> policy_id (None: no policy assigned)
+        self._device_policy: "OrderedDict[int, Optional[int]]" = OrderedDict()
+        # (policy_id, format) -> rendered config, valid while the revision matches
+        self._rendered: "OrderedDict[tuple, CachedRender]" = OrderedDict()
+        # Bumped on every invalidation, so a DB read that raced with one
+        # doesn't put stale data back into the cache
+        self._generation = 0
+        self._last_change_id = 0
+        # Change event id -> when it was applied (by sync, or by this worker
+        # when it published it), kept while the event can still be re-read
+        self._applied: Dict[int, datetime] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def device_policy(self, db: AsyncSession, device_id: int) -> Optional[CachedPolicy]:
+        """Policy assigned to a device, None if unassigned. 404s for unknown devices."""
+        if device_id in self._device_policy:
+            self._device_policy.move_to_end(device_id)
+            policy_id = self._device_policy[device_id]
+        else:
+            self.misses += 1
+            generation = self._generation
+            row = (await db.execute(
+                select(models.Device.policy_id).where(models.Device.id == device_id)
+            )).first()
+            if row is None:
+                raise HTTPException(status_code=404, detail="Device not found")
+            policy_id = row[0]
+            if generation == self._generation:
+                self._remember_device(device_id, policy_id)
+        if policy_id is None:
+            return None
+        return await self.policy(db, policy_id)
+
+    async def policy(self, db: AsyncSession, policy_id: int) -> Optional[CachedPolicy]:
+        cached = self._policies.get(policy_id)
+        if cached is not None:
+            self.hits += 1
+            self._policies.move_to_end(policy_id)
+            return cached
+
+        self.misses += 1
+        generation = self._generation
+        policy = await db.get(models.Policy, policy_id)
+        if policy is None:
+            return None
+        cached = CachedPolicy(
+            policy_id=policy.id,
+            revision=policy.revision,
+            etag=policy_etag(policy.id, policy.revision),
+            body=schemas.Policy.model_validate(policy).model_dump_json().encode()
+        )
+        if generation == self._generation:
+            self._store(cached)
+        return cached
+
+    async def rendered(self, db: AsyncSession, policy_id: int, fmt: str) -> Optional[CachedRender]:
+        """Policy rendered in a platform format, rendered once per revision."""
+        cached = await self.policy(db, policy_id)
+        if cached is None:
+            return None
+        key = (policy_id, fmt)
+        entry = self._rendered.get(key)
+        if entry is not None and entry.revision == cached.revision:
+            self._rendered.move_to_end(key)
+            return entry
+
+        policy = json.loads(cached.body)
+        files = rendering.render_policy(policy, fmt)
+        digest = rendering.artifact_hash(files)
+        entry = CachedRender(
+            revision=cached.revision,
+            etag=f'"{digest}"',
+            body=schemas.RenderedConfig(
+                policy_id=policy_id,
+                policy_name=policy["name"],
+                revision=cached.revision,
+                format=fmt,
+                files=files,
+                hash=digest
+            ).model_dump_json().encode()
+        )
+        self._rendered[key] = entry
+        if len(self._rendered) > self.max_entries:
+            self._rendered.popitem(last=False)
+        return entry
+
+    def invalidate(self, policy_ids: Iterable[int] = (), device_ids: Iterable[int] = (), all_devices: bool = False):
+        self._generation += 1
+        for policy_id in policy_ids:
+            cached = self._policies.pop(policy_id, None)
+            if cached is not None:
+                self._bytes -= cached.size
+        if all_devices:
+            self._device_policy.clear()
+        else:
+            for device_id in device_ids:
+                self._device_policy.pop(device_id, None)
+
+    def mark_published(self, change_ids: Iterable[int]):
+        """Change events this worker applies itself; `sync` skips them."""
+        now = datetime.utcnow()
+        self._applied.update((change_id, now) for change_id in change_ids)
+
+    def devices_using(self, policy_ids: Iterable[int]) -> list:
+        """Devices in the index assigned to any of `policy_ids`."""
+        wanted = set(policy_ids)
+        return [device_id for device_id, policy_id in self._device_policy.items() if policy_id in wanted]
+
+    def stats(self) -> dict:
+        return {
+            "policies": len(self._policies),
+            "bytes": self._bytes,
+            "devices": len(self._device_policy),
+            "rendered": len(self._rendered),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _remember_device(self, device_id: int, policy_id: Optional[int]):
+        self._device_policy[device_id] = policy_id
+        if len(self._device_policy) > self.max_devices:
+            self._device_policy.popitem(last=False)
+
+    def _store(self, cached: CachedPolicy):
+        previous = self._policies.pop(cached.policy_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._policies[cached.policy_id] = cached
+        self._bytes += cached.size
+        while self._policies and (len(self._policies) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._policies.popitem(last=False)
+            self._bytes -= evicted.size
+
+    async def start(self):
+        """Skip change events from before this process started (the cache is empty)."""
+        async with database.AsyncSessionLocal() as db:
+            self._last_change_id = (await db.execute(select(func.max(models.ChangeEvent.id)))).scalar() or 0
+
+    async def sync(self):
+        """Apply change events published by any worker since the last sync."""
+        now = datetime.utcnow()
+        since = now - CHANGE_EVENT_LOOKBACK
+        async with database.AsyncSessionLocal() as db:
+            events = (await db.execute(
+                select(models.ChangeEvent)
+                .where(or_(models.ChangeEvent.id > self._last_change_id, models.ChangeEvent.created_at >= since))
+                .order_by(models.ChangeEvent.id)
+            )).scalars().all()
+        if events:
+            self._last_change_id = max(self._last_change_id, events[-1].id)
+        events = [event for event in events if event.id not in self._applied]
+        self._applied.update((event.id, now) for event in events)
+        # An event applied before the window started is older than the window
+        # too, so it can't be re-read any more
+        self._applied = {change_id: applied_at for change_id, applied_at in self._applied.items() if applied_at >= since}
+        if not events:
+            return
+        policy_ids = {event.policy_id for event in events if event.policy_id is not None}
+        device_ids = {event.device_id for event in events if event.device_id is not None}
+        all_devices = any(event.policy_id is None and event.device_id is None for event in events)
+        # Find affected long-pollers before the index entries are dropped
+        woken = set(device_ids) | set(self.devices_using(policy_ids))
+        if policy_ids:
+            async with database.AsyncSessionLocal() as db:
+                woken.update((await db.execute(
+                    select(models.DevicePolicy.device_id).where(
+                        models.DevicePolicy.policy_id.in_(policy_ids), models.DevicePolicy.removed.is_(False)
+                    )
+                )).scalars())
+        self.invalidate(policy_ids, device_ids, all_devices)
+        if policy_ids:
+            await selector_index.reload(policy_ids)
+        if all_devices:
+            # Too many devices to list; every waiter re-checks its ETag or cursor
+            notifier.notify_all()
+        else:
+            notifier.notify(woken)
+
+    async def prune(self, retention: timedelta):
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(models.ChangeEvent).where(models.ChangeEvent.created_at < datetime.utcnow() - retention))
+            await db.commit()
+
+    async def run(self, interval: float, retention: timedelta):
+        polls_per_prune = max(1, int(retention.total_seconds() / interval / 10))
+        polls = 0
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync()
+                polls += 1
+                if polls % polls_per_prune == 0:
+                    await self.prune(retention)
+            except Exception as e:
+                logger.error(f"Policy cache sync failed: {e}")
+
+async def publish_changes(
+    db: AsyncSession,
+    policy_ids: Iterable[int] = (),
+    device_ids: Iterable[int] = (),
+):
+    """
+    Commit the session together with change events for the given policies
+    and devices, then invalidate this worker's cache right away.
+    """
+    policy_ids, device_ids = list(policy_ids), list(device_ids)
+    all_devices = len(device_ids) > MAX_DEVICE_CHANGE_ROWS
+    now = datetime.utcnow()
+    rows = [models.ChangeEvent(policy_id=policy_id, created_at=now) for policy_id in policy_ids]
+    if all_devices:
+        rows.append(models.ChangeEvent(created_at=now))
+    else:
+        rows += [models.ChangeEvent(device_id=device_id, created_at=now) for device_id in device_ids]
+    db.add_all(rows)
+    await db.flush()
+    policy_cache.mark_published(row.id for row in rows)
+    await db.commit()
+    policy_cache.invalidate(policy_ids, device_ids, all_devices)
+
+policy_cache = PolicyCache(settings.POLICY_CACHE_MAX_ENTRIES, settings.POLICY_CACHE_MAX_BYTES)
@@ -0,0 +1,183 @@
+import bisect
+import logging
+import ipaddress
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+from sqlalchemy import exists, or_, select
+from . import models, database
+
+logger = logging.getLogger(__name__)
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+def parse_cidr(value: str) -> IPNetwork:
+    """Parse a selector; host bits are allowed (10.0.0.1/24 is 10.0.0.0/24). Raises ValueError."""
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+def holds_conflicting_policy(conflicts: List[int], replacing_primary: bool = False):
+    """
+    Criterion on Device: its policy set already holds one of `conflicts`.
+    With `replacing_primary`, the device's current primary doesn't count:
+    the assignment being checked replaces it (e.g. v2 of a policy over v1).
+    """
+    assignment = models.DevicePolicy
+    criteria = [
+        assignment.device_id == models.Device.id,
+        assignment.policy_id.in_(conflicts),
+        assignment.removed.is_(False)
+    ]
+    if replacing_primary:
+        criteria.append(or_(models.Device.policy_id.is_(None), assignment.policy_id != models.Device.policy_id))
+    return exists().where(*criteria)
+
+class PrefixIndex:
+    """
+    Networks -> policy ids. Two prefixes overlap only if one contains the
+    other, so the networks overlapping a query are its supernets (one dict
+    probe per prefix length in use) plus its subnets (a contiguous range of
+    a list sorted by first address, found by bisection).
+    """
+
+    def __init__(self):
+        self._ids: Dict[IPNetwork, Set[int]] = {}
+        # Per IP version: sorted (first address, prefix length) keys and
+        # how many indexed networks use each prefix length
+        self._sorted: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        self._lengths: Dict[int, Counter] = {4: Counter(), 6: Counter()}
+
+    def add(self, network: IPNetwork, policy_id: int):
+        ids = self._ids.get(network)
+        if ids is None:
+            ids = self._ids[network] = set()
+            bisect.insort(self._sorted[network.version], (int(network.network_address), network.prefixlen))
+            self._lengths[network.version][network.prefixlen] += 1
+        ids.add(policy_id)
+
+    def remove(self, network: IPNetwork, policy_id: int):
+        ids = self._ids.get(network)
+        if ids is None:
+            return
+        ids.discard(policy_id)
+        if not ids:
+            del self._ids[network]
+            keys = self._sorted[network.version]
+            del keys[bisect.bisect_left(keys, (int(network.network_address), network.prefixlen))]
+            lengths = self._lengths[network.version]
+            lengths[network.prefixlen] -= 1
+            if not lengths[network.prefixlen]:
+                del lengths[network.prefixlen]
+
+    def overlapping(self, network: IPNetwork) -> Iterator[Tuple[IPNetwork, Set[int]]]:
+        """(network, policy ids) for every indexed network overlapping `network`."""
+        yield from self.supernets(network, strict=True)
+        keys = self._sorted[network.version]
+        start, end = int(network.network_address), int(network.broadcast_address)
+        first = bisect.bisect_left(keys, (start, network.prefixlen))
+        last = bisect.bisect_right(keys, (end, network.max_prefixlen))
+        network_class = type(network)
+        for address, prefixlen in keys[first:last]:
+            subnet = network_class((address, prefixlen))
+            yield subnet, self._ids[subnet]
+
+    def supernets(self, network: IPNetwork, strict: bool = False) -> Iterator[Tuple[IPNetwork, Set[int]]]:
+        """Indexed networks containing `network` (itself included unless `strict`)."""
+        for prefixlen in self._lengths[network.version]:
+            if prefixlen > network.prefixlen or (strict and prefixlen == network.prefixlen):
+                continue
+            supernet = network.supernet(new_prefix=prefixlen)
+            ids = self._ids.get(supernet)
+            if ids:
+                yield supernet, ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+class SelectorIndex:
+    """
+    In-memory index of every policy's local and remote selectors, so
+    overlap checks and "which policies cover this address" lookups don't
+    scan all policies. Each worker keeps its own copy: loaded at startup,
+    updated by this worker's writes and by the policy cache's change sync.
+    """
+
+    def __init__(self):
+        self.local = PrefixIndex()
+        self.remote = PrefixIndex()
+        self._selectors: Dict[int, Tuple[IPNetwork, IPNetwork]] = {}
+
+    def set(self, policy_id: int, local: IPNetwork, remote: IPNetwork):
+        self.discard(policy_id)
+        self._selectors[policy_id] = (local, remote)
+        self.local.add(local, policy_id)
+        self.remote.add(remote, policy_id)
+
+    def set_policy(self, policy: models.Policy):
+        try:
+            self.set(policy.id, parse_cidr(policy.local_network_cidr), parse_cidr(policy.remote_network_cidr))
+        except (AttributeError, ValueError) as e:
+            # Rows written before selectors were validated
+            logger.warning(f"Policy {policy.id} has invalid selectors, not indexed: {e}")
+            self.discard(policy.id)
+
+    def discard(self, policy_id: int):
+        selectors = self._selectors.pop(policy_id, None)
+        if selectors is not None:
+            self.local.remove(selectors[0], policy_id)
+            self.remote.remove(selectors[1], policy_id)
+
+    def conflicts(self, local: IPNetwork, remote: IPNetwork, exclude: Iterable[int] = ()) -> List[int]:
+        """
+        Policies whose traffic selectors overlap (local, remote) on both
+        sides, i.e. that would claim some of the same packets.
+        """
+        local_matches = list(self.local.overlapping(local))
+        remote_matches = list(self.remote.overlapping(remote))
+        # Walk the side with fewer candidates and check the other side directly
+        if sum(len(ids) for _, ids in local_matches) <= sum(len(ids) for _, ids in remote_matches):
+            candidates, side, other = local_matches, 1, remote
+        else:
+            candidates, side, other = remote_matches, 0, local
+        excluded = set(exclude)
+        return sorted(
+            policy_id
+            for _, ids in candidates for policy_id in ids
+            if policy_id not in excluded and self._selectors[policy_id][side].overlaps(other)
+        )
+
+    def covering(self, address: IPAddress, side: str = "remote") -> List[int]:
+        """Policies whose `side` ("local" or "remote") selector contains `address`."""
+        index = self.remote if side == "remote" else self.local
+        host = ipaddress.ip_network(address)
+        return sorted(policy_id for _, ids in index.supernets(host) for policy_id in ids)
+
+    def policy_conflicts(self, policy_id: int) -> List[int]:
+        """Other policies conflicting with an indexed policy."""
+        selectors = self._selectors.get(policy_id)
+        if selectors is None:
+            return []
+        return self.conflicts(*selectors, exclude=[policy_id])
+
+    async def load(self):
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(models.Policy))
+            for policy in result.scalars():
+                self.set_policy(policy)
+
+    async def reload(self, policy_ids: Iterable[int]):
+        """Re-read the selectors of policies changed by other workers."""
+        policy_ids = list(policy_ids)
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(models.Policy).where(models.Policy.id.in_(policy_ids)))
+            found = set()
+            for policy in result.scalars():
+                self.set_policy(policy)
+                found.add(policy.id)
+        for policy_id in policy_ids:
+            if policy_id not in found:
+                self.discard(policy_id)
+
+    def __len__(self) -> int:
+        return len(self._selectors)
+
+selector_index = SelectorIndex()
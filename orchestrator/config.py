@@ -1,16 +1,87 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Unified IPsec Orchestrator"
     DATABASE_URL: str = "sqlite:///./ipsec_orchestrator.db"  # Default to SQLite for dev
+    # Routes use an async engine derived from DATABASE_URL
+    # (sqlite -> sqlite+aiosqlite, postgresql -> postgresql+asyncpg)
+    # unless ASYNC_DATABASE_URL is set explicitly
+    ASYNC_DATABASE_URL: Optional[str] = None
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Comma-separated read replica URLs; read-only listings and lookups are
+    # spread over them round robin. A device or policy written to reads from
+    # the primary for READ_YOUR_WRITES_WINDOW seconds afterwards.
+    READ_REPLICA_URLS: str = ""
+    READ_YOUR_WRITES_WINDOW: float = 5.0
     SECRET_KEY: str = "change_this_in_production_secret_key"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Enrollment returns a device token signed with SECRET_KEY; agents send
+    # it as a bearer token and refresh it before it expires. Set
+    # DEVICE_TOKEN_REQUIRED=false while agents without tokens are upgraded
+    # (tokens that are sent are still checked).
+    DEVICE_TOKEN_EXPIRE_MINUTES: int = 24 * 60
+    DEVICE_TOKEN_REQUIRED: bool = True
+
+    # Upper bound for the ?timeout of long-poll config requests (seconds)
+    LONG_POLL_MAX_TIMEOUT: int = 60
+
+    # Heartbeats are buffered in memory and written every N seconds
+    HEARTBEAT_FLUSH_INTERVAL: float = 10.0
+    # Devices heard from within this many seconds count as online
+    DEVICE_ONLINE_WINDOW: int = 90
+    # GET /devices/rollup is recomputed every N seconds
+    ROLLUP_REFRESH_INTERVAL: float = 15.0
+    # Running rollouts are advanced (acks checked, next devices assigned)
+    # every N seconds
+    ROLLOUT_TICK_INTERVAL: float = 5.0
+
+    # In-process policy cache; other workers' changes are picked up from the
+    # change_events table every CACHE_SYNC_INTERVAL seconds
+    POLICY_CACHE_MAX_ENTRIES: int = 10000
+    POLICY_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_SYNC_INTERVAL: float = 1.0
+    CHANGE_EVENT_RETENTION: int = 3600
+
+    # Agent pacing: agent-facing responses carry X-Poll-Interval (raised as
+    # the worker gets busy); with MAX_IN_FLIGHT_REQUESTS > 0, agent requests
+    # beyond it get 503 + Retry-After. Admin requests are never shed.
+    AGENT_POLL_INTERVAL: int = 30
+    MAX_IN_FLIGHT_REQUESTS: int = 0
+    OVERLOAD_RETRY_AFTER: int = 30
+
+    # Responses of at least this many bytes are brotli/gzip compressed for
+    # clients that accept it (0 disables); clients sending
+    # Accept: application/msgpack get msgpack instead of JSON
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024
+
+    # New or updated policies whose local and remote selectors both overlap
+    # an existing policy's: "reject" (409) or "flag" (X-Policy-Conflicts
+    # header). Conflicting policies are never assigned to the same device.
+    POLICY_OVERLAP_ACTION: str = "flag"
+
+    # Allow `X-Profile: 1` requests to return a cProfile breakdown
+    ENABLE_PROFILING: bool = False
     
     # CA Settings
     CA_CERT_PATH: str = "ca_cert.pem"
     CA_KEY_PATH: str = "ca_key.pem"
+    # Certificates are signed in a pool of PKI_WORKERS processes, in batches
+    # of up to PKI_BATCH_SIZE CSRs collected over PKI_BATCH_WINDOW seconds
+    PKI_WORKERS: int = 2
+    PKI_BATCH_SIZE: int = 64
+    PKI_BATCH_WINDOW: float = 0.01
+    PKI_CERT_VALIDITY_DAYS: int = 365
+    # Pre-generated device keys ("ec" or "rsa") for enrollments without a
+    # CSR; 0 disables server-side key generation
+    PKI_KEY_POOL_SIZE: int = 0
+    PKI_KEY_TYPE: str = "ec"
 
     class Config:
         env_file = ".env"
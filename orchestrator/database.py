@@ -1,22 +1,199 @@
-from sqlalchemy import create_engine
+import time
+import itertools
+from typing import Dict, Hashable, List, Optional, Sequence
+from sqlalchemy import create_engine, insert, select, tuple_, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 from .config import get_settings
 
 settings = get_settings()
 
+# Rows per statement for bulk operations, well below SQLite's bind parameter limit
+BULK_CHUNK_SIZE = 500
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    if driver is None:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+def engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite uses a single shared connection, no pool to tune
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
 connect_args = {"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 
+# Sync engine, used for schema creation and scripts
 engine = create_engine(
-    settings.DATABASE_URL, connect_args=connect_args
+    settings.DATABASE_URL, connect_args=connect_args, **engine_options(settings.DATABASE_URL)
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine, used by the API routes
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Read replicas, for read-only handlers (see ReadRouter)
+REPLICA_URLS = [url.strip() for url in settings.READ_REPLICA_URLS.split(",") if url.strip()]
+replica_engines = [
+    create_async_engine(async_database_url(url), **engine_options(async_database_url(url)))
+    for url in REPLICA_URLS
+]
+
+class ReadRouter:
+    """
+    Picks the session factory for read-only handlers: replicas in round
+    robin, or the primary if there are none. Writes to a device or policy
+    pin reads of it to the primary for `window` seconds, so whoever wrote
+    reads their own writes despite replication lag. Pins are per worker.
+    """
+
+    def __init__(self, primary: async_sessionmaker, replicas: List[async_sessionmaker], window: float = 5.0):
+        self.primary = primary
+        self.replicas = replicas
+        self.window = window
+        self._next = itertools.cycle(replicas) if replicas else None
+        self._pinned: Dict[Hashable, float] = {}  # Key -> monotonic expiry
+
+    def note_write(self, kind: str, *ids: int):
+        if self._next is None:
+            return
+        expires = time.monotonic() + self.window
+        for id_ in ids:
+            self._pinned[(kind, id_)] = expires
+        if len(self._pinned) > 10_000:
+            self._prune()
+
+    def session_factory(self, kind: Optional[str] = None, id_: Optional[int] = None) -> async_sessionmaker:
+        if self._next is None:
+            return self.primary
+        if kind is not None:
+            expires = self._pinned.get((kind, id_))
+            if expires is not None:
+                if expires > time.monotonic():
+                    return self.primary
+                del self._pinned[(kind, id_)]
+        return next(self._next)
+
+    def _prune(self):
+        now = time.monotonic()
+        self._pinned = {key: expires for key, expires in self._pinned.items() if expires > now}
+
+read_router = ReadRouter(
+    AsyncSessionLocal,
+    [async_sessionmaker(replica, autoflush=False, expire_on_commit=False) for replica in replica_engines],
+    settings.READ_YOUR_WRITES_WINDOW
+)
+
 Base = declarative_base()
 
+async def upsert(
+    db,
+    model,
+    rows: List[dict],
+    index_elements: Sequence[str],
+    update_columns: Sequence[str] = (),
+    returning: Sequence[str] = ()
+) -> list:
+    """
+    Insert `rows`; where one conflicts on the unique `index_elements`, set
+    `update_columns` from the row instead (or leave it alone if none are
+    given). Returns the `returning` columns of every row. Rows must have
+    distinct keys. PostgreSQL and SQLite do it in one INSERT ... ON
+    CONFLICT statement; other dialects select the existing keys first,
+    which is not atomic against concurrent writers of the same keys.
+    """
+    if not rows:
+        return []
+    keys = [getattr(model, name) for name in index_elements]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(model).values(rows)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=keys, set_={name: stmt.excluded[name] for name in update_columns}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+        if not returning:
+            await db.execute(stmt)
+            return []
+        return (await db.execute(stmt.returning(*[getattr(model, name) for name in returning]))).all()
+
+    def key_of(row):
+        return tuple(row[name] for name in index_elements)
+
+    def key_filter(values):
+        if len(keys) == 1:
+            return keys[0].in_([value[0] for value in values])
+        return tuple_(*keys).in_(values)
+
+    wanted = [key_of(row) for row in rows]
+    existing = set(tuple(key) for key in (await db.execute(select(*keys).where(key_filter(wanted)))).all())
+    new_rows = [row for row in rows if key_of(row) not in existing]
+    if new_rows:
+        await db.execute(insert(model), new_rows)
+    if update_columns:
+        for row in rows:
+            if key_of(row) in existing:
+                await db.execute(
+                    update(model)
+                    .where(*[key == row[name] for key, name in zip(keys, index_elements)])
+                    .values({name: row[name] for name in update_columns})
+                    .execution_options(synchronize_session=False)
+                )
+    if not returning:
+        return []
+    return (await db.execute(
+        select(*[getattr(model, name) for name in returning]).where(key_filter(wanted))
+    )).all()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Read-only handlers only: replica sessions may lag the primary, and
+# anything cached from them (policy cache, selector index) would be stale
+
+async def get_read_db():
+    async with read_router.session_factory()() as db:
+        yield db
+
+async def get_device_read_db(device_id: int):
+    async with read_router.session_factory("device", device_id)() as db:
+        yield db
+
+async def get_policy_read_db(policy_id: int):
+    async with read_router.session_factory("policy", policy_id)() as db:
+        yield db
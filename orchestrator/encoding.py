@@ -0,0 +1,225 @@
+"""
+Negotiated response encoding. Routes keep producing JSON (FastAPI
+serializes response models with pydantic-core, cached bodies are JSON
+already); these ASGI middlewares turn it into msgpack for clients that
+prefer it and compress large bodies with brotli or gzip.
+"""
+import json
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+# Bodies worth compressing; msgpack still shrinks by half or more
+COMPRESSIBLE = (JSON, MSGPACK, "application/x-ndjson", "text/")
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # Higher levels cost far more CPU for little gain on dynamic bodies
+
+loads = orjson.loads if orjson is not None else json.loads
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+def _weights(header: str) -> Dict[str, float]:
+    """Value -> q weight for an Accept or Accept-Encoding header."""
+    weights = {}
+    for item in header.split(","):
+        value, *params = [part.strip() for part in item.split(";")]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[value.lower()] = q
+    return weights
+
+def prefers_msgpack(accept: str) -> bool:
+    """True if msgpack is acceptable and weighted at least as high as JSON."""
+    if msgpack is None or "msgpack" not in accept:
+        return False
+    weights = _weights(accept)
+    packed = max(weights.get(media_type, 0.0) for media_type in MSGPACK_TYPES)
+    return packed > 0 and packed >= weights.get(JSON, weights.get("application/*", weights.get("*/*", 0.0)))
+
+def preferred_encoding(accept_encoding: str) -> Optional[str]:
+    """"br" or "gzip" per the client's Accept-Encoding, None for identity."""
+    weights = _weights(accept_encoding)
+    candidates = [("br", weights.get("br", 0.0))] if brotli is not None else []
+    candidates.append(("gzip", weights.get("gzip", weights.get("*", 0.0))))
+    encoding, q = max(candidates, key=lambda candidate: candidate[1])
+    return encoding if q > 0 else None
+
+def _replace_headers(headers: List[Tuple[bytes, bytes]], **values: Optional[str]) -> List[Tuple[bytes, bytes]]:
+    """Set (or with None, drop) headers; keyword names use _ for -."""
+    names = {name.replace("_", "-").encode(): value for name, value in values.items()}
+    kept = [(key, value) for key, value in headers if key.lower() not in names]
+    return kept + [(name, value.encode("latin-1")) for name, value in names.items() if value is not None]
+
+def _add_vary(headers: List[Tuple[bytes, bytes]], value: str) -> List[Tuple[bytes, bytes]]:
+    for i, (key, existing) in enumerate(headers):
+        if key.lower() == b"vary":
+            headers[i] = (key, existing + b", " + value.encode())
+            return headers
+    return headers + [(b"vary", value.encode())]
+
+class MsgpackMiddleware:
+    """
+    Re-encodes 200 JSON responses as msgpack when the client's Accept
+    prefers it. Bodies with an ETag (cached config, rollups) are only
+    converted once per ETag and worker.
+    """
+
+    def __init__(self, app, cache_size: int = 4096):
+        self.app = app
+        self.cache_size = cache_size
+        self._packed: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def pack(self, body: bytes, etag: Optional[str] = None) -> bytes:
+        if etag:
+            packed = self._packed.get(etag)
+            if packed is not None:
+                self._packed.move_to_end(etag)
+                return packed
+        packed = msgpack.packb(loads(body))
+        if etag:
+            self._packed[etag] = packed
+            if len(self._packed) > self.cache_size:
+                self._packed.popitem(last=False)
+        return packed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not prefers_msgpack(_header(scope, b"accept")):
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = dict(headers).get(b"content-type", b"")
+                if message["status"] == 200 and content_type.startswith(JSON.encode()):
+                    start = message  # Held back until the body is complete
+                    return
+            elif message["type"] == "http.response.body" and start is not None:
+                chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                headers = start.get("headers", [])
+                body = self.pack(b"".join(chunks), dict(headers).get(b"etag", b"").decode("latin-1"))
+                start["headers"] = _add_vary(
+                    _replace_headers(headers, content_type=MSGPACK, content_length=str(len(body))), "Accept"
+                )
+                await send(start)
+                await send({"type": "http.response.body", "body": body})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+class CompressionMiddleware:
+    """
+    Compresses response bodies of at least `minimum_size` bytes with brotli
+    (if installed and accepted) or gzip. Streamed responses of unknown
+    length are compressed chunk by chunk, flushing after each one.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = preferred_encoding(_header(scope, b"accept-encoding")) if scope["type"] == "http" else None
+        if encoding is None or not self.minimum_size:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                length = headers.get(b"content-length")
+                if (b"content-encoding" in headers
+                        or not content_type.startswith(COMPRESSIBLE)
+                        or (length is not None and int(length) < self.minimum_size)):
+                    await send(message)
+                    return
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    await send(start)
+                    await send(message)
+                    start = None
+                    return
+                compressor = _Compressor(encoding)
+                headers = _add_vary(start.get("headers", []), "Accept-Encoding")
+                if not more_body:
+                    body = compressor.finish(body)
+                    start["headers"] = _replace_headers(headers, content_encoding=encoding, content_length=str(len(body)))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                # Streamed: length unknown up front
+                start["headers"] = _replace_headers(headers, content_encoding=encoding, content_length=None)
+                await send(start)
+            await send({
+                "type": "http.response.body",
+                "body": compressor.flush(body) if more_body else compressor.finish(body),
+                "more_body": more_body,
+            })
+
+        await self.app(scope, receive, send_wrapper)
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.brotli = encoding == "br"
+        if self.brotli:
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+    def flush(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it so the client can decode it right away."""
+        if self.brotli:
+            return self._obj.process(data) + self._obj.flush()
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        if self.brotli:
+            return self._obj.process(data) + self._obj.finish()
+        return self._obj.compress(data) + self._obj.flush()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from shared.tunnels import TunnelStatus
+from . import models, database
+
+logger = logging.getLogger(__name__)
+
+# Devices per DELETE when replacing reported tunnels
+TUNNEL_DELETE_CHUNK = 500
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    `value` as a naive UTC datetime, the kind datetime.utcnow() returns.
+    DateTime(timezone=True) columns read back aware on PostgreSQL and naive
+    on SQLite; the in-memory view must hold one kind to compare them.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def tunnel_row(device_id: int, tunnel: TunnelStatus, now: datetime) -> Dict[str, Any]:
+    """device_tunnels row for a reported status; relative times become timestamps."""
+    def counter(value) -> Optional[int]:
+        return None if value is None else int(value)
+
+    established, rekey_in = counter(tunnel.established), counter(tunnel.rekey_in)
+    return {
+        "device_id": device_id,
+        "name": str(tunnel.name),
+        "state": str(tunnel.state),
+        "child_sas": int(tunnel.child_sas or 0),
+        "established_at": None if established is None else now - timedelta(seconds=established),
+        "rekey_at": None if rekey_in is None else now + timedelta(seconds=rekey_in),
+        "bytes_in": counter(tunnel.bytes_in),
+        "bytes_out": counter(tunnel.bytes_out),
+        "packets_in": counter(tunnel.packets_in),
+        "packets_out": counter(tunnel.packets_out),
+        "updated_at": now,
+    }
+
+class HeartbeatBuffer:
+    """
+    Collects agent heartbeats in memory and writes them to the devices table
+    in one bulk UPDATE per flush interval, instead of a write per poll.
+    Liveness is answered from the in-memory view. With several workers,
+    each flush also reads back the heartbeats and enrollments other workers
+    wrote since the previous one, so every worker's view lags by at most
+    about one flush interval.
+    """
+
+    def __init__(self, refresh_overlap: timedelta = timedelta(seconds=20)):
+        # device_id -> (seen_at, tunnel_up, applied_etag, applied_sync_seq)
+        # waiting to be flushed
+        self._pending: Dict[int, Tuple[datetime, Optional[bool], Optional[str], Optional[int]]] = {}
+        # device_id -> last time we heard from it
+        self._last_seen: Dict[int, Optional[datetime]] = {}
+        # device_id -> device_tunnels rows from its latest status report
+        self._pending_tunnels: Dict[int, List[Dict[str, Any]]] = {}
+        # Other workers write heartbeats up to a flush interval after they
+        # arrive, so each refresh re-reads this far behind the previous one
+        self.refresh_overlap = refresh_overlap
+        self._refreshed_at: Optional[datetime] = None
+        self._max_device_id = 0
+
+    async def load(self):
+        """Seed liveness data from the database."""
+        self._refreshed_at = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(models.Device.id, models.Device.last_seen))
+            for device_id, last_seen in result:
+                self._last_seen.setdefault(device_id, naive_utc(last_seen))
+                self._max_device_id = max(self._max_device_id, device_id)
+
+    async def refresh(self):
+        """Merge in devices other workers enrolled or flushed heartbeats for."""
+        if self._refreshed_at is None:
+            await self.load()
+            return
+        since = self._refreshed_at - self.refresh_overlap
+        refreshed_at = datetime.utcnow()
+        device = models.Device
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(device.id, device.last_seen)
+                .where(or_(device.last_seen > since, device.id > self._max_device_id))
+            )
+            for device_id, last_seen in result:
+                last_seen = naive_utc(last_seen)
+                known = self._last_seen.get(device_id)
+                if known is None or (last_seen is not None and last_seen > known):
+                    self._last_seen[device_id] = last_seen
+                self._max_device_id = max(self._max_device_id, device_id)
+        # Only advanced on success, so a failed refresh is caught up next time
+        self._refreshed_at = refreshed_at
+
+    def is_known(self, device_id: int) -> bool:
+        return device_id in self._last_seen
+
+    def track(self, device_id: int, seen_at: Optional[datetime] = None):
+        """Register a device (e.g. on enrollment) without queueing a write."""
+        self._last_seen.setdefault(device_id, naive_utc(seen_at))
+        self._max_device_id = max(self._max_device_id, device_id)
+
+    def record(
+        self,
+        device_id: int,
+        tunnel_up: Optional[bool] = None,
+        tunnels: Optional[List[TunnelStatus]] = None,
+        applied_etag: Optional[str] = None,
+        applied_sync_seq: Optional[int] = None
+    ):
+        """
+        Queue a heartbeat. `tunnels` is the device's full per-tunnel status
+        and replaces what it reported before; raises ValueError if malformed.
+        `applied_etag`/`applied_sync_seq` are the config ETag and sync cursor
+        the agent has applied.
+        """
+        now = datetime.utcnow()
+        if tunnels is not None:
+            rows = {tunnel.name: tunnel_row(device_id, tunnel, now) for tunnel in tunnels}
+            self._pending_tunnels[device_id] = list(rows.values())
+            if tunnel_up is None:
+                tunnel_up = any(tunnel.up for tunnel in tunnels)
+        previous = self._pending.get(device_id)
+        if previous is not None:
+            # Don't let a plain poll erase a status not yet flushed
+            _, previous_up, previous_etag, previous_seq = previous
+            tunnel_up = previous_up if tunnel_up is None else tunnel_up
+            applied_etag = applied_etag or previous_etag
+            applied_sync_seq = previous_seq if applied_sync_seq is None else applied_sync_seq
+        self._pending[device_id] = (now, tunnel_up, applied_etag, applied_sync_seq)
+        self._last_seen[device_id] = now
+
+    def liveness(self, online_window: timedelta) -> Dict[str, int]:
+        cutoff = datetime.utcnow() - online_window
+        online = sum(1 for seen in self._last_seen.values() if seen is not None and seen >= cutoff)
+        never_seen = sum(1 for seen in self._last_seen.values() if seen is None)
+        return {
+            "online": online,
+            "offline": len(self._last_seen) - online - never_seen,
+            "never_seen": never_seen,
+            "total": len(self._last_seen),
+        }
+
+    async def flush(self):
+        if self._pending:
+            await self._write()
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Failed to refresh liveness from the database: {e}")
+
+    async def _write(self):
+        # Swap the buffer first so heartbeats arriving during the write
+        # land in the next batch
+        pending, self._pending = self._pending, {}
+        pending_tunnels, self._pending_tunnels = self._pending_tunnels, {}
+        rows = [
+            {
+                "b_id": device_id,
+                "b_last_seen": seen_at,
+                "b_tunnel_up": tunnel_up,
+                "b_applied_etag": applied_etag,
+                "b_applied_sync_seq": applied_sync_seq,
+            }
+            for device_id, (seen_at, tunnel_up, applied_etag, applied_sync_seq) in pending.items()
+        ]
+        # One executemany UPDATE; NULLs keep the stored values
+        devices = models.Device.__table__
+        stmt = update(devices) \
+            .where(devices.c.id == bindparam("b_id")) \
+            .values(
+                last_seen=bindparam("b_last_seen"),
+                tunnel_up=func.coalesce(bindparam("b_tunnel_up"), devices.c.tunnel_up),
+                applied_etag=func.coalesce(bindparam("b_applied_etag"), devices.c.applied_etag),
+                applied_sync_seq=func.coalesce(bindparam("b_applied_sync_seq"), devices.c.applied_sync_seq)
+            )
+        tunnels = models.DeviceTunnel.__table__
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await db.execute(stmt, rows)
+                # Tunnel reports replace the device's rows: one DELETE per
+                # chunk of devices and one executemany INSERT
+                device_ids = list(pending_tunnels)
+                for start in range(0, len(device_ids), TUNNEL_DELETE_CHUNK):
+                    chunk = device_ids[start:start + TUNNEL_DELETE_CHUNK]
+                    await db.execute(delete(tunnels).where(tunnels.c.device_id.in_(chunk)))
+                tunnel_rows = [row for device_rows in pending_tunnels.values() for row in device_rows]
+                if tunnel_rows:
+                    await db.execute(insert(tunnels), tunnel_rows)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to flush {len(rows)} heartbeats: {e}")
+            # Keep them for the next attempt unless newer ones arrived
+            for device_id, entry in pending.items():
+                self._pending.setdefault(device_id, entry)
+            for device_id, device_rows in pending_tunnels.items():
+                self._pending_tunnels.setdefault(device_id, device_rows)
+
+    async def run(self, interval: float):
+        self.refresh_overlap = timedelta(seconds=2 * interval)
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+heartbeats = HeartbeatBuffer()
@@ -1,17 +1,84 @@
-from fastapi import FastAPI
+import asyncio
+from datetime import timedelta
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, Base
-from routers import devices, policies
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, metrics
+from .throttle import AgentThrottleMiddleware
+from .encoding import MsgpackMiddleware, CompressionMiddleware
+from .sync import init_sync_state
+from .auth import device_tokens
+from .config import get_settings
+from .cache import policy_cache
+from .cidr_index import selector_index
+from .database import engine, async_engine, replica_engines, Base, get_read_db
+from .heartbeat import heartbeats
+from .pki import certificate_authority
+from .rollup import fleet_rollup
+from .rollouts import rollout_scheduler
+from .routers import devices, device_policies, certificates, tokens, policies, rollouts, watch
+
+settings = get_settings()
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+init_sync_state(engine)
+
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+for replica in replica_engines:
+    metrics.instrument_engine(replica.sync_engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await heartbeats.load()
+    await policy_cache.start()
+    await selector_index.load()
+    await device_tokens.sync()
+    flusher = asyncio.create_task(heartbeats.run(settings.HEARTBEAT_FLUSH_INTERVAL))
+    cache_sync = asyncio.create_task(policy_cache.run(
+        settings.CACHE_SYNC_INTERVAL, timedelta(seconds=settings.CHANGE_EVENT_RETENTION)
+    ))
+    online_window = timedelta(seconds=settings.DEVICE_ONLINE_WINDOW)
+    await fleet_rollup.refresh(online_window)
+    rollup = asyncio.create_task(fleet_rollup.run(settings.ROLLUP_REFRESH_INTERVAL, online_window))
+    certificate_authority.start()
+    key_pool = asyncio.create_task(certificate_authority.run())
+    scheduler = asyncio.create_task(rollout_scheduler.run(settings.ROLLOUT_TICK_INTERVAL))
+    # Revocations by other workers take effect within one cache sync interval
+    revocations = asyncio.create_task(device_tokens.run(settings.CACHE_SYNC_INTERVAL))
+    yield
+    revocations.cancel()
+    scheduler.cancel()
+    key_pool.cancel()
+    certificate_authority.close()
+    rollup.cancel()
+    cache_sync.cancel()
+    flusher.cancel()
+    await heartbeats.flush()
 
 app = FastAPI(
     title="Unified IPsec Orchestrator",
     description="Central management server for cross-platform IPsec tunnels",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
+# Innermost, so shed requests still show up in metrics
+app.add_middleware(
+    AgentThrottleMiddleware,
+    poll_interval=settings.AGENT_POLL_INTERVAL,
+    max_in_flight=settings.MAX_IN_FLIGHT_REQUESTS,
+    retry_after=settings.OVERLOAD_RETRY_AFTER
+)
+
+# Transcode first, then compress the result
+app.add_middleware(MsgpackMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE)
+
 # CORS (Allow all for now, restrict in production)
 app.add_middleware(
     CORSMiddleware,
@@ -21,8 +88,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so it measures everything including CORS handling
+app.add_middleware(metrics.MetricsMiddleware, enable_profiling=settings.ENABLE_PROFILING)
+
 app.include_router(devices.router)
+app.include_router(watch.router)
+app.include_router(device_policies.router)
+app.include_router(certificates.router)
+app.include_router(tokens.router)
 app.include_router(policies.router)
+app.include_router(rollouts.router)
 
 @app.get("/")
 async def root():
@@ -31,3 +106,12 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics(db: AsyncSession = Depends(get_read_db)):
+    enrolled, active = (await db.execute(
+        select(func.count(models.Device.id), func.count(models.Device.id).filter(models.Device.is_active.is_(True)))
+    )).one()
+    metrics.devices_enrolled.set(value=enrolled)
+    metrics.devices_active.set(value=active)
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
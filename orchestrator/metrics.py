@@ -0,0 +1,201 @@
+import io
+import time
+import pstats
+import cProfile
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _label_text(self, labels: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{self._label_text(labels)} {value}" for labels, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, *labels: str, value: float):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def _samples(self):
+        lines = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = self._label_text(labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {total}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cumulative}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# HTTP
+http_requests = Counter("ipsec_http_requests_total", "HTTP requests by route, method and status.", ("method", "route", "status"))
+http_latency = Histogram("ipsec_http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+http_in_flight = Gauge("ipsec_http_requests_in_flight", "HTTP requests currently being served.")
+http_response_size = Histogram("ipsec_http_response_size_bytes", "HTTP response body size.", ("method", "route"), SIZE_BUCKETS)
+
+# Database
+db_query_latency = Histogram("ipsec_db_query_duration_seconds", "SQL statement execution time.")
+db_queries_per_request = Histogram("ipsec_db_queries_per_request", "SQL statements issued per HTTP request.", ("method", "route"), COUNT_BUCKETS)
+
+# Fleet (refreshed on scrape)
+devices_enrolled = Gauge("ipsec_devices_enrolled", "Enrolled devices.")
+devices_active = Gauge("ipsec_devices_active", "Devices marked active.")
+
+REGISTRY: List[Metric] = [
+    http_requests, http_latency, http_in_flight, http_response_size,
+    db_query_latency, db_queries_per_request, devices_enrolled, devices_active,
+]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+# Per-request SQL statement counter, set by the middleware
+_request_queries: ContextVar[Optional[List[int]]] = ContextVar("request_queries", default=None)
+
+def instrument_engine(engine):
+    """Time every statement on `engine` (a sync Engine, or AsyncEngine.sync_engine)."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+        counter = _request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_query_latency.observe(value=time.perf_counter() - conn.info["query_start"].pop())
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route request metrics. With profiling
+    enabled, a request carrying `X-Profile: 1` gets a cProfile breakdown
+    (top functions by cumulative time) as its response instead of the
+    normal body. The profiler sees everything the event loop runs while the
+    request is in flight, so profile on a quiet instance.
+    """
+
+    def __init__(self, app, enable_profiling: bool = False):
+        self.app = app
+        self.enable_profiling = enable_profiling
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        response_size = 0
+        queries = [0]
+        token = _request_queries.set(queries)
+        profiler = None
+        if self.enable_profiling and (b"x-profile", b"1") in scope.get("headers", []):
+            profiler = cProfile.Profile()
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            if profiler is None:
+                await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_queries.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(method, route, str(status_code))
+            http_latency.observe(method, route, value=elapsed)
+            http_response_size.observe(method, route, value=response_size)
+            db_queries_per_request.observe(method, route, value=queries[0])
+
+        if profiler is not None:
+            await self._send_profile(send, profiler, status_code, elapsed, queries[0])
+
+    @staticmethod
+    async def _send_profile(send, profiler: cProfile.Profile, status_code: int, elapsed: float, queries: int):
+        output = io.StringIO()
+        output.write(f"status={status_code} elapsed={elapsed * 1000:.2f}ms db_queries={queries}\n\n")
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(40)
+        body = output.getvalue().encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Float, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -23,6 +23,11 @@ class Policy(Base):
     # Authentication
     auth_method = Column(String, default="psk") # psk, pubkey
     psk_secret = Column(String, nullable=True) # Encrypted in real app
+
+    # Bumped on every change that affects what agents receive (used as ETag)
+    revision = Column(Integer, default=1, nullable=False)
+    # Sync sequence number of the last content change (see DevicePolicy)
+    sync_seq = Column(Integer, default=0, nullable=False, index=True)
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -32,6 +37,13 @@ class Policy(Base):
 
 class Device(Base):
     __tablename__ = "devices"
+    # Composite (filter, id) indexes let filtered listings page by id
+    # without sorting; hostname prefix and last_seen ranges use their own
+    __table_args__ = (
+        Index("ix_devices_os_type_id", "os_type", "id"),
+        Index("ix_devices_is_active_id", "is_active", "id"),
+        Index("ix_devices_policy_id_id", "policy_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     hostname = Column(String, index=True)
@@ -40,9 +52,136 @@ class Device(Base):
     
     enrollment_token = Column(String, unique=True, index=True)
     is_active = Column(Boolean, default=True)
-    last_seen = Column(DateTime(timezone=True), nullable=True)
+    last_seen = Column(DateTime(timezone=True), nullable=True, index=True)
+    tunnel_up = Column(Boolean, nullable=True) # As last reported by the agent
+    # What the agent last reported as applied: the config ETag and the
+    # delta sync cursor (acknowledge rollout targets)
+    applied_etag = Column(String, nullable=True)
+    applied_sync_seq = Column(Integer, nullable=True)
     
     policy_id = Column(Integer, ForeignKey("policies.id"), nullable=True)
     policy = relationship("Policy", back_populates="devices")
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DevicePolicy(Base):
+    """
+    Many-to-many device <-> policy assignments, one connection each on the
+    device. Device.policy_id stays the primary policy served by /config.
+    Removed assignments are kept as tombstones so delta syncs can report them.
+    """
+    __tablename__ = "device_policies"
+    __table_args__ = (
+        Index("ix_device_policies_device_id_seq", "device_id", "seq"),
+        Index("ix_device_policies_policy_id", "policy_id"),
+    )
+
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    policy_id = Column(Integer, ForeignKey("policies.id"), primary_key=True)
+    # Sync sequence number of the last add/remove of this assignment
+    seq = Column(Integer, nullable=False)
+    removed = Column(Boolean, default=False, nullable=False)
+
+
+class DeviceTunnel(Base):
+    """
+    Per-connection SA state from the device's last status heartbeat. Each
+    report replaces all of the device's rows.
+    """
+    __tablename__ = "device_tunnels"
+    __table_args__ = (
+        Index("ix_device_tunnels_state_device_id", "state", "device_id"),
+    )
+
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    name = Column(String, primary_key=True)
+    state = Column(String, nullable=False)  # IKE SA state, DOWN if none
+    child_sas = Column(Integer, default=0, nullable=False)
+    established_at = Column(DateTime(timezone=True), nullable=True)
+    rekey_at = Column(DateTime(timezone=True), nullable=True)
+    bytes_in = Column(BigInteger, nullable=True)
+    bytes_out = Column(BigInteger, nullable=True)
+    packets_in = Column(BigInteger, nullable=True)
+    packets_out = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class DeviceCertificate(Base):
+    """Certificates issued to devices by the orchestrator's CA."""
+    __tablename__ = "device_certificates"
+
+    serial = Column(String, primary_key=True)  # Hex
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False, index=True)
+    not_after = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DeviceTokenRevocation(Base):
+    """Device tokens issued before revoked_before are rejected (see orchestrator.auth)."""
+    __tablename__ = "device_token_revocations"
+
+    device_id = Column(Integer, primary_key=True)
+    revoked_before = Column(Float, nullable=False)  # Unix time, compared with the token's iat
+
+
+class Rollout(Base):
+    """
+    Staged assignment of a policy to a set of devices, in waves (the
+    first one optionally a canary) with a cap on unacknowledged applies.
+    Driven by the rollout scheduler (orchestrator/rollouts.py).
+    """
+    __tablename__ = "rollouts"
+
+    id = Column(Integer, primary_key=True)
+    policy_id = Column(Integer, ForeignKey("policies.id"), nullable=False, index=True)
+    state = Column(String, nullable=False)  # running, paused, completed, aborted
+    reason = Column(String, nullable=True)  # Why it was paused or aborted
+    waves = Column(Integer, nullable=False)
+    current_wave = Column(Integer, default=0, nullable=False)
+    canary_size = Column(Integer, default=0, nullable=False)
+    max_in_flight = Column(Integer, nullable=False)
+    ack_timeout = Column(Integer, nullable=False)  # Seconds
+    max_failures = Column(Integer, nullable=False)
+    # Timed-out targets an operator accepted by resuming
+    accepted_failures = Column(Integer, default=0, nullable=False)
+    # Scheduler lease, so only one worker drives a rollout at a time
+    lease_until = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+class RolloutTarget(Base):
+    __tablename__ = "rollout_targets"
+    __table_args__ = (
+        Index("ix_rollout_targets_rollout_id_state_wave", "rollout_id", "state", "wave"),
+    )
+
+    rollout_id = Column(Integer, ForeignKey("rollouts.id"), primary_key=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    wave = Column(Integer, nullable=False)  # 0 is the canary wave if there is one
+    state = Column(String, nullable=False)  # pending, applying, acked, timed_out, skipped
+    # Sync sequence number of the assignment; acked once the device reports
+    # a cursor at least this far, or the policy's current config ETag
+    seq = Column(Integer, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class SyncCounter(Base):
+    """Single-row counter handing out sync sequence numbers."""
+    __tablename__ = "sync_counter"
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+
+class ChangeEvent(Base):
+    """Append-only log of config changes, polled by every worker to invalidate caches."""
+    __tablename__ = "change_events"
+
+    id = Column(Integer, primary_key=True)
+    policy_id = Column(Integer, nullable=True) # Policy content changed
+    device_id = Column(Integer, nullable=True) # Device assignment changed
+    # Both NULL: assignments of many devices changed
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
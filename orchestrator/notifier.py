@@ -0,0 +1,48 @@
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterable
+
+class PolicyNotifier:
+    """
+    In-process registry of agents long-polling for config changes.
+    Notifications only reach waiters in the same worker process; agents
+    connected to another worker pick up the change when their poll times out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)  # device_id -> {(loop, event)}
+
+    @contextmanager
+    def subscribe(self, device_id: int):
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        with self._lock:
+            self._waiters[device_id].add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(device_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[device_id]
+
+    def notify(self, device_ids: Iterable[int]):
+        # Safe to call from any thread, not just the waiters' event loops
+        with self._lock:
+            waiters = [waiter for device_id in device_ids for waiter in self._waiters.get(device_id, ())]
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def notify_all(self):
+        """Wake every waiter, e.g. after a change to an unknown set of devices."""
+        with self._lock:
+            waiters = [waiter for device_waiters in self._waiters.values() for waiter in device_waiters]
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+notifier = PolicyNotifier()
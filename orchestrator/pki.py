@@ -0,0 +1,274 @@
+"""
+Device certificate issuance. CSR signing and key generation are CPU-bound,
+so they run in a process pool whose workers load the CA key once at start;
+CSRs arriving within a short window go to a worker as one batch, so an
+enrollment storm costs one round trip per batch rather than per device.
+
+Pool workers import this module, so it stays clear of the database and
+web layers.
+"""
+import os
+import asyncio
+import logging
+import multiprocessing
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from cryptography import x509
+from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID, ObjectIdentifier
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# id-kp-ipsecIKE (RFC 4945)
+IPSEC_IKE = ObjectIdentifier("1.3.6.1.5.5.7.3.17")
+
+class CertificateError(Exception):
+    pass
+
+@dataclass
+class SigningRequest:
+    csr_pem: Optional[bytes]  # None: issue for `key_pem` instead
+    common_name: str
+    dns_names: List[str]
+    validity_days: int
+    key_pem: Optional[bytes] = None
+
+@dataclass
+class IssuedCertificate:
+    serial: int
+    not_after: datetime
+    cert_pem: bytes
+    key_pem: Optional[bytes] = None  # Only for pool-generated keys
+
+def generate_key(key_type: str = "ec"):
+    if key_type == "rsa":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return ec.generate_private_key(ec.SECP256R1())
+
+def key_to_pem(key) -> bytes:
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+
+def create_ca(cert_path: str, key_path: str, common_name: str, days: int = 3650):
+    """Write a self-signed CA for development setups that don't provide one."""
+    key = generate_key("ec")
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.utcnow()
+    cert = x509.CertificateBuilder() \
+        .subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - timedelta(minutes=5)) \
+        .not_valid_after(now + timedelta(days=days)) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True) \
+        .add_extension(x509.KeyUsage(
+            digital_signature=True, content_commitment=False, key_encipherment=False, data_encipherment=False,
+            key_agreement=False, key_cert_sign=True, crl_sign=True, encipher_only=False, decipher_only=False
+        ), critical=True) \
+        .sign(key, hashes.SHA256())
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key_to_pem(key))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+# Per pool worker: the CA, loaded once by _init_worker
+_ca_cert: Optional[x509.Certificate] = None
+_ca_key = None
+
+def _init_worker(ca_cert_pem: bytes, ca_key_pem: bytes):
+    global _ca_cert, _ca_key
+    _ca_cert = x509.load_pem_x509_certificate(ca_cert_pem)
+    _ca_key = serialization.load_pem_private_key(ca_key_pem, password=None)
+
+def sign_request(request: SigningRequest, ca_cert: x509.Certificate, ca_key) -> IssuedCertificate:
+    if request.csr_pem is not None:
+        try:
+            csr = x509.load_pem_x509_csr(request.csr_pem)
+        except ValueError as e:
+            raise CertificateError(f"Invalid CSR: {e}")
+        if not csr.is_signature_valid:
+            raise CertificateError("CSR signature is invalid")
+        public_key = csr.public_key()
+    else:
+        # Our own pool key: skip the (slow) RSA consistency checks
+        key = serialization.load_pem_private_key(request.key_pem, password=None, unsafe_skip_rsa_key_validation=True)
+        public_key = key.public_key()
+
+    now = datetime.utcnow()
+    not_after = now + timedelta(days=request.validity_days)
+    serial = x509.random_serial_number()
+    # Subject and SANs come from the orchestrator, not from the CSR
+    builder = x509.CertificateBuilder() \
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, request.common_name)])) \
+        .issuer_name(ca_cert.subject) \
+        .public_key(public_key) \
+        .serial_number(serial) \
+        .not_valid_before(now - timedelta(minutes=5)) \
+        .not_valid_after(not_after) \
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True) \
+        .add_extension(x509.KeyUsage(
+            digital_signature=True, content_commitment=False, key_encipherment=False, data_encipherment=False,
+            key_agreement=False, key_cert_sign=False, crl_sign=False, encipher_only=False, decipher_only=False
+        ), critical=True) \
+        .add_extension(x509.ExtendedKeyUsage([IPSEC_IKE, ExtendedKeyUsageOID.CLIENT_AUTH, ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+    if request.dns_names:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(name) for name in request.dns_names]), critical=False
+        )
+    cert = builder.sign(ca_key, hashes.SHA256())
+    return IssuedCertificate(serial, not_after, cert.public_bytes(serialization.Encoding.PEM), request.key_pem)
+
+def _sign_batch(requests: List[SigningRequest]) -> List[Tuple[Optional[IssuedCertificate], Optional[str]]]:
+    """Runs in a pool worker; one bad CSR doesn't fail the rest of the batch."""
+    results = []
+    for request in requests:
+        try:
+            results.append((sign_request(request, _ca_cert, _ca_key), None))
+        except (CertificateError, ValueError, TypeError) as e:
+            results.append((None, str(e)))
+    return results
+
+def _generate_keys(count: int, key_type: str) -> List[bytes]:
+    return [key_to_pem(generate_key(key_type)) for _ in range(count)]
+
+class CertificateAuthority:
+    """
+    Signs device certificates with the CA at CA_CERT_PATH/CA_KEY_PATH. With
+    a key pool size > 0, it also keeps that many pre-generated device keys
+    (refilled in the background) for devices that can't send a CSR.
+    """
+
+    def __init__(
+        self,
+        cert_path: str,
+        key_path: str,
+        workers: int = 2,
+        batch_size: int = 64,
+        batch_window: float = 0.01,
+        key_pool_size: int = 0,
+        key_type: str = "ec"
+    ):
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.key_pool_size = key_pool_size
+        self.key_type = key_type
+        self.ca_cert_pem: Optional[bytes] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: List[Tuple[SigningRequest, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._keys: List[bytes] = []
+
+    def start(self):
+        """Load the CA (creating a development CA if there is none) and set up the pool."""
+        if not os.path.exists(self.cert_path) and not os.path.exists(self.key_path):
+            logger.warning(f"No CA at {self.cert_path}, creating a self-signed development CA")
+            create_ca(self.cert_path, self.key_path, "Unified IPsec Orchestrator CA")
+        with open(self.cert_path, "rb") as f:
+            self.ca_cert_pem = f.read()
+        with open(self.key_path, "rb") as f:
+            ca_key_pem = f.read()
+        # Check both parse here rather than in every worker
+        _init_worker(self.ca_cert_pem, ca_key_pem)
+        # spawn: forking a process with a running event loop and DB threads is unsafe
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.ca_cert_pem, ca_key_pem)
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def sign(self, request: SigningRequest) -> IssuedCertificate:
+        """Queue `request` for the next batch; raises CertificateError if it can't be signed."""
+        if self._pool is None:
+            raise CertificateError("Certificate authority is not running")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.batch_size:
+            self._dispatch()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._dispatch)
+        return await future
+
+    async def issue_with_key(self, common_name: str, dns_names: List[str], validity_days: int) -> IssuedCertificate:
+        """Issue a certificate for a key from the pool (generated on the spot if it's empty)."""
+        if self._keys:
+            key_pem = self._keys.pop()
+        else:
+            loop = asyncio.get_running_loop()
+            key_pem = (await loop.run_in_executor(self._pool, _generate_keys, 1, self.key_type))[0]
+        return await self.sign(SigningRequest(None, common_name, dns_names, validity_days, key_pem=key_pem))
+
+    @property
+    def pooled_keys(self) -> int:
+        return len(self._keys)
+
+    async def run(self, interval: float = 1.0):
+        """Keep the key pool topped up, a batch per worker at a time."""
+        loop = asyncio.get_running_loop()
+        while True:
+            missing = self.key_pool_size - len(self._keys)
+            if missing > 0 and self._pool is not None:
+                per_worker = max(1, min(missing, 16) // self.workers)
+                try:
+                    batches = await asyncio.gather(*(
+                        loop.run_in_executor(self._pool, _generate_keys, per_worker, self.key_type)
+                        for _ in range(self.workers)
+                    ))
+                    for keys in batches:
+                        self._keys.extend(keys[:self.key_pool_size - len(self._keys)])
+                    continue
+                except Exception as e:
+                    logger.error(f"Key pool refill failed: {e}")
+            await asyncio.sleep(interval)
+
+    def _dispatch(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().run_in_executor(self._pool, _sign_batch, [request for request, _ in batch])
+
+        def deliver(done: asyncio.Future):
+            if done.cancelled() or done.exception() is not None:
+                error = CertificateError(f"Signing failed: {done.exception() if not done.cancelled() else 'cancelled'}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            for (_, future), (issued, error) in zip(batch, done.result()):
+                if future.done():
+                    continue
+                if issued is None:
+                    future.set_exception(CertificateError(error))
+                else:
+                    future.set_result(issued)
+
+        task.add_done_callback(deliver)
+
+certificate_authority = CertificateAuthority(
+    settings.CA_CERT_PATH,
+    settings.CA_KEY_PATH,
+    workers=settings.PKI_WORKERS,
+    batch_size=settings.PKI_BATCH_SIZE,
+    batch_window=settings.PKI_BATCH_WINDOW,
+    key_pool_size=settings.PKI_KEY_POOL_SIZE,
+    key_type=settings.PKI_KEY_TYPE
+)
@@ -0,0 +1,246 @@
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List
+from sqlalchemy import exists, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, database
+from .cache import publish_changes, policy_etag
+from .cidr_index import selector_index, holds_conflicting_policy
+from .notifier import notifier
+from .sync import next_sync_seq, assign_primary
+
+logger = logging.getLogger(__name__)
+
+# Rollout states
+RUNNING = "running"
+PAUSED = "paused"
+COMPLETED = "completed"
+ABORTED = "aborted"
+
+# Target states
+PENDING = "pending"
+APPLYING = "applying"  # Assigned, waiting for the device to acknowledge
+ACKED = "acked"
+TIMED_OUT = "timed_out"
+SKIPPED = "skipped"  # Device gone, or holds a conflicting policy
+
+# Rows per statement, well below SQLite's bind parameter limit
+TARGET_CHUNK_SIZE = 500
+
+def plan_waves(device_ids: List[int], wave_size: int, canary_size: int = 0, seed=None) -> Dict[int, int]:
+    """
+    device_id -> wave. Devices are shuffled so canaries and early waves
+    are spread across the fleet; with canaries, wave 0 is the canary wave.
+    """
+    order = list(device_ids)
+    random.Random(seed).shuffle(order)
+    waves = {}
+    if canary_size:
+        for device_id in order[:canary_size]:
+            waves[device_id] = 0
+        order = order[canary_size:]
+    first = 1 if canary_size else 0
+    for i, device_id in enumerate(order):
+        waves[device_id] = first + i // wave_size
+    return waves
+
+async def add_targets(db: AsyncSession, rollout_id: int, waves: Dict[int, int]):
+    rows = [
+        {"rollout_id": rollout_id, "device_id": device_id, "wave": wave, "state": PENDING}
+        for device_id, wave in waves.items()
+    ]
+    for start in range(0, len(rows), TARGET_CHUNK_SIZE):
+        await db.execute(insert(models.RolloutTarget), rows[start:start + TARGET_CHUNK_SIZE])
+
+async def target_counts(db: AsyncSession, rollout_id: int) -> Dict[str, int]:
+    target = models.RolloutTarget
+    result = await db.execute(
+        select(target.state, func.count()).where(target.rollout_id == rollout_id).group_by(target.state)
+    )
+    return dict(result.all())
+
+class RolloutScheduler:
+    """
+    Drives running rollouts, one tick every interval: acknowledges targets
+    whose device reported the new config as applied, times out the ones
+    that didn't in time, and assigns the policy to more devices of the
+    current wave while fewer than max_in_flight are unacknowledged. The
+    next wave starts once every target of the current one is settled.
+
+    Every worker runs a scheduler; a lease on the rollout row makes sure
+    only one of them advances a given rollout at a time.
+    """
+
+    def __init__(self, lease: timedelta = timedelta(seconds=60)):
+        self.lease = lease
+
+    async def tick(self):
+        async with database.AsyncSessionLocal() as db:
+            rollout_ids = (await db.execute(
+                select(models.Rollout.id).where(models.Rollout.state == RUNNING).order_by(models.Rollout.id)
+            )).scalars().all()
+        for rollout_id in rollout_ids:
+            if not await self._claim(rollout_id):
+                continue
+            try:
+                await self.advance(rollout_id)
+            except Exception as e:
+                logger.error(f"Rollout {rollout_id} step failed: {e}")
+            finally:
+                await self._release(rollout_id)
+
+    async def advance(self, rollout_id: int):
+        target = models.RolloutTarget
+        async with database.AsyncSessionLocal() as db:
+            rollout = await db.get(models.Rollout, rollout_id)
+            if rollout is None or rollout.state != RUNNING:
+                return
+            policy = await db.get(models.Policy, rollout.policy_id)
+            if policy is None:
+                rollout.state, rollout.reason = ABORTED, "Policy was deleted"
+                await db.commit()
+                return
+            now = datetime.utcnow()
+            of_rollout = target.rollout_id == rollout_id
+
+            # Acknowledged: the device applied the policy's current config,
+            # or a delta sync at least as recent as its assignment
+            device = models.Device
+            applied = exists().where(
+                device.id == target.device_id,
+                or_(device.applied_etag == policy_etag(policy.id, policy.revision), device.applied_sync_seq >= target.seq)
+            )
+            await db.execute(
+                update(target).where(of_rollout, target.state == APPLYING, applied)
+                .values(state=ACKED, finished_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                update(target).where(
+                    of_rollout, target.state == APPLYING,
+                    target.started_at < now - timedelta(seconds=rollout.ack_timeout)
+                )
+                .values(state=TIMED_OUT, finished_at=now)
+                .execution_options(synchronize_session=False)
+            )
+
+            counts = await target_counts(db, rollout_id)
+            failures = counts.get(TIMED_OUT, 0) - rollout.accepted_failures
+            if failures > rollout.max_failures:
+                self._pause(rollout, f"{failures} devices did not acknowledge within {rollout.ack_timeout}s")
+                await db.commit()
+                return
+
+            # Move on once the current wave is settled
+            while True:
+                open_targets = (await db.execute(
+                    select(func.count()).where(
+                        of_rollout, target.wave == rollout.current_wave, target.state.in_([PENDING, APPLYING])
+                    )
+                )).scalar()
+                if open_targets:
+                    break
+                if rollout.canary_size and rollout.current_wave == 0 and failures > 0:
+                    self._pause(rollout, f"{failures} canary devices did not acknowledge")
+                    await db.commit()
+                    return
+                if rollout.current_wave + 1 >= rollout.waves:
+                    rollout.state = COMPLETED
+                    await db.commit()
+                    logger.info(f"Rollout {rollout_id} of policy {policy.id} completed")
+                    return
+                rollout.current_wave += 1
+                logger.info(f"Rollout {rollout_id} starting wave {rollout.current_wave}")
+
+            capacity = rollout.max_in_flight - counts.get(APPLYING, 0)
+            device_ids = []
+            if capacity > 0:
+                device_ids = (await db.execute(
+                    select(target.device_id)
+                    .where(of_rollout, target.wave == rollout.current_wave, target.state == PENDING)
+                    .order_by(target.device_id)
+                    .limit(capacity)
+                )).scalars().all()
+            if not device_ids:
+                await db.commit()
+                return
+            await self._start(db, rollout, policy, device_ids, now)
+
+    async def _start(self, db: AsyncSession, rollout: models.Rollout, policy: models.Policy, device_ids: List[int], now: datetime):
+        """Assign the policy to `device_ids` (as in POST /policies/{id}/assign/{device_id})."""
+        target = models.RolloutTarget
+        of_rollout = target.rollout_id == rollout.id
+        # A policy overlapping the new one blocks a device, unless it's the
+        # primary being replaced (assign_primary tombstones that one)
+        conflicts = selector_index.policy_conflicts(policy.id)
+        # One sequence number for the whole batch
+        seq = await next_sync_seq(db)
+        assigned = []
+        for start in range(0, len(device_ids), TARGET_CHUNK_SIZE):
+            chunk = device_ids[start:start + TARGET_CHUNK_SIZE]
+            criteria = [models.Device.id.in_(chunk)]
+            if conflicts:
+                criteria.append(~holds_conflicting_policy(conflicts, replacing_primary=True))
+            chunk_assigned = await assign_primary(db, policy.id, criteria, seq)
+            if chunk_assigned:
+                await db.execute(
+                    update(target).where(of_rollout, target.device_id.in_(chunk_assigned))
+                    .values(state=APPLYING, seq=seq, started_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+            skipped = set(chunk) - set(chunk_assigned)
+            if skipped:
+                await db.execute(
+                    update(target).where(of_rollout, target.device_id.in_(skipped))
+                    .values(state=SKIPPED, finished_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+            assigned += chunk_assigned
+        await publish_changes(db, device_ids=assigned)
+        notifier.notify(assigned)
+        database.read_router.note_write("device", *assigned)
+
+    @staticmethod
+    def _pause(rollout: models.Rollout, reason: str):
+        rollout.state, rollout.reason = PAUSED, reason
+        logger.warning(f"Rollout {rollout.id} paused: {reason}")
+
+    async def _claim(self, rollout_id: int) -> bool:
+        now = datetime.utcnow()
+        rollout = models.Rollout
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(rollout)
+                .where(
+                    rollout.id == rollout_id,
+                    rollout.state == RUNNING,
+                    or_(rollout.lease_until.is_(None), rollout.lease_until < now)
+                )
+                .values(lease_until=now + self.lease)
+                .returning(rollout.id)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = result.first() is not None
+            await db.commit()
+        return claimed
+
+    async def _release(self, rollout_id: int):
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(
+                update(models.Rollout).where(models.Rollout.id == rollout_id)
+                .values(lease_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Rollout scheduler tick failed: {e}")
+
+rollout_scheduler = RolloutScheduler()
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case, exists, func, select
+from . import models, schemas, database
+
+logger = logging.getLogger(__name__)
+
+def status_bucket(online_cutoff: datetime):
+    """
+    SQL expression putting a device in one of the StatusCounts buckets:
+    stale/never_seen by last_seen, otherwise by its last reported tunnel state.
+    """
+    device = models.Device
+    return case(
+        (device.last_seen.is_(None), "never_seen"),
+        (device.last_seen < online_cutoff, "stale"),
+        (device.tunnel_up.is_(True), "up"),
+        (device.tunnel_up.is_(False), "down"),
+        else_="unknown"
+    ).label("bucket")
+
+class FleetRollup:
+    """
+    Device counts by status, per policy and per os_type, recomputed with a
+    few GROUP BY queries every refresh interval. Dashboards get the last
+    result as pre-serialized JSON, so polling it costs no database work.
+    """
+
+    def __init__(self):
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+
+    async def refresh(self, online_window: timedelta):
+        now = datetime.utcnow()
+        bucket = status_bucket(now - online_window)
+        device, assignment = models.Device, models.DevicePolicy
+        live = assignment.removed.is_(False)
+
+        async with database.AsyncSessionLocal() as db:
+            by_os_type = await db.execute(
+                select(device.os_type, bucket, func.count()).group_by(device.os_type, "bucket")
+            )
+            # A device counts towards every policy in its policy set
+            by_policy = await db.execute(
+                select(assignment.policy_id, bucket, func.count())
+                .join(device, device.id == assignment.device_id)
+                .where(live)
+                .group_by(assignment.policy_id, "bucket")
+            )
+            unassigned = await db.execute(
+                select(bucket, func.count())
+                .where(~exists().where(assignment.device_id == device.id, live))
+                .group_by("bucket")
+            )
+
+            rollup = schemas.FleetRollup(
+                generated_at=now,
+                online_window_seconds=int(online_window.total_seconds()),
+                total=schemas.StatusCounts(),
+                by_os_type={},
+                by_policy={},
+                unassigned=schemas.StatusCounts(),
+            )
+            for os_type, status, count in by_os_type:
+                _add(rollup.total, status, count)
+                _add(rollup.by_os_type.setdefault(os_type or "unknown", schemas.StatusCounts()), status, count)
+            for policy_id, status, count in by_policy:
+                _add(rollup.by_policy.setdefault(policy_id, schemas.StatusCounts()), status, count)
+            for status, count in unassigned:
+                _add(rollup.unassigned, status, count)
+
+        self.body = rollup.model_dump_json().encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    async def run(self, interval: float, online_window: timedelta):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(online_window)
+            except Exception as e:
+                logger.error(f"Fleet rollup refresh failed: {e}")
+
+def _add(counts: "schemas.StatusCounts", status: str, count: int):
+    setattr(counts, status, getattr(counts, status) + count)
+    counts.total += count
+
+fleet_rollup = FleetRollup()
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, database
+from ..auth import require_device
+from ..config import get_settings
+from ..pki import certificate_authority, CertificateError, SigningRequest
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/devices",
+    tags=["certificates"]
+)
+
+def device_names(device: models.Device):
+    """Subject CN and DNS SANs for a device's certificate."""
+    # The id makes the CN unique; hostnames aren't, and may not be valid DNS names
+    dns_names = [device.hostname] if device.hostname and device.hostname.isascii() else []
+    return f"device-{device.id}", dns_names
+
+@router.post("/{device_id}/certificate", response_model=schemas.IssuedCertificate, dependencies=[Depends(require_device)])
+async def issue_certificate(device_id: int, request: schemas.CertificateRequest, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Sign the device's CSR, or without one issue a certificate for a
+    server-generated key (returned once, with the certificate).
+    """
+    device = await db.get(models.Device, device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    common_name, dns_names = device_names(device)
+
+    try:
+        if request.csr is not None:
+            issued = await certificate_authority.sign(SigningRequest(
+                request.csr.encode(), common_name, dns_names, settings.PKI_CERT_VALIDITY_DAYS
+            ))
+        elif certificate_authority.key_pool_size > 0:
+            issued = await certificate_authority.issue_with_key(common_name, dns_names, settings.PKI_CERT_VALIDITY_DAYS)
+        else:
+            raise HTTPException(status_code=400, detail="A CSR is required")
+    except CertificateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    serial = format(issued.serial, "x")
+    db.add(models.DeviceCertificate(serial=serial, device_id=device_id, not_after=issued.not_after))
+    await db.commit()
+
+    return schemas.IssuedCertificate(
+        device_id=device_id,
+        serial=serial,
+        not_after=issued.not_after,
+        certificate=issued.cert_pem.decode(),
+        ca_certificate=certificate_authority.ca_cert_pem.decode(),
+        private_key=issued.key_pem.decode() if issued.key_pem else None
+    )
@@ -0,0 +1,120 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+from .. import models, schemas, database
+from ..database import BULK_CHUNK_SIZE
+from ..auth import require_device
+from ..cache import publish_changes
+from ..cidr_index import selector_index
+from ..config import get_settings
+from ..heartbeat import heartbeats
+from ..notifier import notifier
+from ..sync import next_sync_seq, add_assignments, remove_assignment, assigned_policies_query, device_delta
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/devices",
+    tags=["devices"]
+)
+
+async def ensure_device(db: AsyncSession, device_id: int):
+    # Only devices not seen by this worker yet cost a lookup
+    if not heartbeats.is_known(device_id):
+        if await db.get(models.Device, device_id) is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+
+@router.get("/{device_id}/policies", response_model=List[schemas.Policy])
+async def read_device_policies(device_id: int, db: AsyncSession = Depends(database.get_device_read_db)):
+    """All policies assigned to a device (the primary one included)."""
+    await ensure_device(db, device_id)
+    return (await db.execute(assigned_policies_query(device_id))).scalars().all()
+
+@router.post("/{device_id}/policies", response_model=schemas.DevicePolicyAssignResult)
+async def add_device_policies(device_id: int, selection: schemas.DevicePolicyAssign, db: AsyncSession = Depends(database.get_async_db)):
+    """Add policies to a device's policy set, keeping the ones it already has."""
+    await ensure_device(db, device_id)
+
+    policy_ids = list(dict.fromkeys(selection.policy_ids))
+    found = set()
+    for start in range(0, len(policy_ids), BULK_CHUNK_SIZE):
+        chunk = policy_ids[start:start + BULK_CHUNK_SIZE]
+        found.update((await db.execute(select(models.Policy.id).where(models.Policy.id.in_(chunk)))).scalars())
+
+    # Skip policies overlapping one the device holds or one added before them
+    held = set((await db.execute(
+        select(models.DevicePolicy.policy_id).where(
+            models.DevicePolicy.device_id == device_id, models.DevicePolicy.removed.is_(False)
+        )
+    )).scalars())
+    assigned, conflicting = [], []
+    for policy_id in policy_ids:
+        if policy_id not in found:
+            continue
+        if held.intersection(selector_index.policy_conflicts(policy_id)):
+            conflicting.append(policy_id)
+            continue
+        assigned.append(policy_id)
+        held.add(policy_id)
+
+    if assigned:
+        # One sequence number for the whole batch
+        seq = await next_sync_seq(db)
+        for start in range(0, len(assigned), BULK_CHUNK_SIZE):
+            await add_assignments(db, [(device_id, policy_id) for policy_id in assigned[start:start + BULK_CHUNK_SIZE]], seq)
+        await publish_changes(db, device_ids=[device_id])
+        notifier.notify([device_id])
+        database.read_router.note_write("device", device_id)
+
+    return schemas.DevicePolicyAssignResult(
+        device_id=device_id,
+        assigned=assigned,
+        not_found=[policy_id for policy_id in policy_ids if policy_id not in found],
+        conflicting=conflicting
+    )
+
+@router.delete("/{device_id}/policies/{policy_id}")
+async def remove_device_policy(device_id: int, policy_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    device = await db.get(models.Device, device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    if not await remove_assignment(db, device_id, policy_id, await next_sync_seq(db)):
+        raise HTTPException(status_code=404, detail="Policy not assigned to this device")
+    if device.policy_id == policy_id:
+        device.policy_id = None
+    await publish_changes(db, device_ids=[device_id])
+    notifier.notify([device_id])
+    database.read_router.note_write("device", device_id)
+    return {"message": "Policy removed successfully"}
+
+async def _load_delta(device_id: int, cursor: int) -> schemas.SyncDelta:
+    # Short-lived session, so no connection is held while the request waits
+    async with database.AsyncSessionLocal() as db:
+        await ensure_device(db, device_id)
+        return await device_delta(db, device_id, cursor)
+
+@router.get("/{device_id}/sync", response_model=schemas.SyncDelta, dependencies=[Depends(require_device)])
+async def sync_device_policies(
+    device_id: int,
+    cursor: int = Query(0, ge=0, description="Cursor of the last delta the device applied, 0 for a full sync"),
+    timeout: float = Query(0, ge=0, le=settings.LONG_POLL_MAX_TIMEOUT)
+):
+    """
+    Policies added or changed and assignments removed since `cursor`.
+    With a timeout, an empty delta is held open until something changes.
+    """
+    with notifier.subscribe(device_id) as changed:
+        delta = await _load_delta(device_id, cursor)
+        heartbeats.record(device_id)
+        # A full delta for a non-zero cursor must go out even if empty, the
+        # device has to drop everything it holds
+        if timeout and not delta.changed and not delta.removed and not (delta.full and cursor):
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+                delta = await _load_delta(device_id, cursor)
+            except asyncio.TimeoutError:
+                pass
+    return delta
@@ -1,30 +1,64 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from typing import List, Optional
 from .. import models, schemas, database
-from datetime import datetime
+from ..database import BULK_CHUNK_SIZE
+from ..auth import device_tokens, require_device
+from ..cache import policy_cache
+from ..config import get_settings
+from ..heartbeat import heartbeats
+from ..rollup import fleet_rollup
+from datetime import datetime, timedelta
+from shared import rendering
+from shared.tunnels import TunnelStatus, ESTABLISHED
+
+settings = get_settings()
+
+# Rows fetched per keyset page when streaming an export
+EXPORT_PAGE_SIZE = 1000
 
 router = APIRouter(
     prefix="/devices",
     tags=["devices"]
 )
 
-@router.post("/enroll", response_model=schemas.Device)
-def enroll_device(device: schemas.DeviceCreate, db: Session = Depends(database.get_db)):
+async def get_device_with_policy(db: AsyncSession, device_id: int) -> Optional[models.Device]:
+    # Relationships can't be lazy-loaded on an AsyncSession, load the policy
+    # up front in the same query
+    result = await db.execute(
+        select(models.Device)
+        .options(joinedload(models.Device.policy))
+        .where(models.Device.id == device_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+def enrollment(device: models.Device) -> schemas.DeviceEnrollment:
+    """The enrolled device, with a fresh token for its agent endpoints."""
+    token, expires_in = device_tokens.issue(device.id)
+    return schemas.DeviceEnrollment(**dict(schemas.Device.model_validate(device)), token=token, token_expires_in=expires_in)
+
+@router.post("/enroll", response_model=schemas.DeviceEnrollment)
+async def enroll_device(device: schemas.DeviceCreate, db: AsyncSession = Depends(database.get_async_db)):
     # Check if token is valid (In real app, validate against a pre-generated list)
     # For now, we just check if a device with this token already exists, if so return it
-    
-    db_device = db.query(models.Device).filter(models.Device.enrollment_token == device.enrollment_token).first()
+
+    result = await db.execute(select(models.Device).where(models.Device.enrollment_token == device.enrollment_token))
+    db_device = result.scalars().first()
     if db_device:
         # Update existing device info
         db_device.hostname = device.hostname
         db_device.os_type = device.os_type
         db_device.public_ip = device.public_ip
         db_device.last_seen = datetime.utcnow()
-        db.commit()
-        db.refresh(db_device)
-        return db_device
-    
+        await db.commit()
+        heartbeats.track(db_device.id, db_device.last_seen)
+        database.read_router.note_write("device", db_device.id)
+        return enrollment(await get_device_with_policy(db, db_device.id))
+
     # Create new device
     new_device = models.Device(
         hostname=device.hostname,
@@ -34,29 +68,276 @@ def enroll_device(device: schemas.DeviceCreate, db: Session = Depends(database.g
         last_seen=datetime.utcnow()
     )
     db.add(new_device)
-    db.commit()
-    db.refresh(new_device)
-    return new_device
+    await db.commit()
+    heartbeats.track(new_device.id, new_device.last_seen)
+    database.read_router.note_write("device", new_device.id)
+    return enrollment(await get_device_with_policy(db, new_device.id))
+
+@router.post("/enroll/bulk", response_model=List[schemas.BulkEnrollResult])
+async def bulk_enroll_devices(devices: List[schemas.DeviceCreate], db: AsyncSession = Depends(database.get_async_db)):
+    # Last entry wins for duplicate tokens; an upsert can't touch a row twice
+    by_token = {device.enrollment_token: device for device in devices}
+    tokens = list(by_token)
+    now = datetime.utcnow()
+
+    results = {}
+    for start in range(0, len(tokens), BULK_CHUNK_SIZE):
+        chunk = tokens[start:start + BULK_CHUNK_SIZE]
+        existing = set((await db.execute(
+            select(models.Device.enrollment_token).where(models.Device.enrollment_token.in_(chunk))
+        )).scalars())
+        rows = [
+            {
+                "hostname": by_token[token].hostname,
+                "os_type": by_token[token].os_type,
+                "public_ip": by_token[token].public_ip,
+                "enrollment_token": token,
+                "last_seen": now,
+            }
+            for token in chunk
+        ]
+        enrolled = await database.upsert(
+            db, models.Device, rows, ["enrollment_token"],
+            ["hostname", "os_type", "public_ip", "last_seen"],
+            returning=["id", "enrollment_token"]
+        )
+        for device_id, token in enrolled:
+            heartbeats.track(device_id, now)
+            results[token] = schemas.BulkEnrollResult(
+                enrollment_token=token, id=device_id, created=token not in existing
+            )
+
+    # One transaction for the whole batch
+    await db.commit()
+    database.read_router.note_write("device", *(result.id for result in results.values()))
+    return [results[token] for token in tokens]
+
+def device_filters(
+    os_type: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    policy_id: Optional[int] = None,
+    hostname_prefix: Optional[str] = None,
+    last_seen_after: Optional[datetime] = None,
+    last_seen_before: Optional[datetime] = None
+) -> list:
+    filters = []
+    if os_type is not None:
+        filters.append(models.Device.os_type == os_type)
+    if is_active is not None:
+        filters.append(models.Device.is_active == is_active)
+    if policy_id is not None:
+        filters.append(models.Device.policy_id == policy_id)
+    if hostname_prefix is not None:
+        filters.append(models.Device.hostname.startswith(hostname_prefix, autoescape=True))
+    if last_seen_after is not None:
+        filters.append(models.Device.last_seen >= last_seen_after)
+    if last_seen_before is not None:
+        filters.append(models.Device.last_seen < last_seen_before)
+    return filters
+
+def device_page_query(filters: list, after: Optional[int], limit: int, with_policy: bool = True):
+    # Keyset pagination: seek past the last id instead of OFFSET, so deep
+    # pages cost the same as the first and inserts don't shift pages
+    query = select(models.Device).where(*filters)
+    if with_policy:
+        # One extra SELECT ... WHERE id IN (...) over the distinct policy ids
+        # of the page, instead of one SELECT per device
+        query = query.options(selectinload(models.Device.policy))
+    if after is not None:
+        query = query.where(models.Device.id > after)
+    return query.order_by(models.Device.id).limit(limit)
 
 @router.get("/", response_model=List[schemas.Device])
-def read_devices(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
-    devices = db.query(models.Device).offset(skip).limit(limit).all()
+async def read_devices(
+    response: Response,
+    after: Optional[int] = Query(None, description="Return devices with id greater than this cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    skip: int = Query(0, ge=0, description="Deprecated, use the `after` cursor"),
+    filters: list = Depends(device_filters),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    query = device_page_query(filters, after, limit)
+    if skip:
+        query = query.offset(skip)
+    devices = (await db.execute(query)).scalars().all()
+    if len(devices) == limit:
+        response.headers["X-Next-Cursor"] = str(devices[-1].id)
     return devices
 
+@router.get("/compact", response_model=schemas.DevicePage)
+async def read_devices_compact(
+    after: Optional[int] = Query(None, description="Return devices with id greater than this cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    filters: list = Depends(device_filters),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    """Like GET /devices/, but policies are listed once and referenced by id."""
+    devices = (await db.execute(device_page_query(filters, after, limit, with_policy=False))).scalars().all()
+    policy_ids = {device.policy_id for device in devices if device.policy_id is not None}
+    policies = []
+    if policy_ids:
+        policies = (await db.execute(select(models.Policy).where(models.Policy.id.in_(policy_ids)))).scalars().all()
+    return schemas.DevicePage(
+        devices=devices,
+        policies={policy.id: policy for policy in policies},
+        next_cursor=devices[-1].id if len(devices) == limit else None
+    )
+
+@router.get("/export")
+async def export_devices(filters: list = Depends(device_filters)):
+    """Stream every matching device as newline-delimited JSON."""
+    async def generate():
+        # Own session: the request-scoped one may be closed while streaming
+        async with database.read_router.session_factory()() as db:
+            after = None
+            while True:
+                devices = (await db.execute(device_page_query(filters, after, EXPORT_PAGE_SIZE))).scalars().all()
+                if not devices:
+                    break
+                yield "".join(schemas.Device.model_validate(device).model_dump_json() + "\n" for device in devices)
+                after = devices[-1].id
+                # Don't keep every exported row in the identity map
+                db.expunge_all()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.get("/liveness", response_model=schemas.FleetLiveness)
+async def fleet_liveness():
+    """Online/offline counts from the in-memory heartbeat view (no DB access)."""
+    window = settings.DEVICE_ONLINE_WINDOW
+    return schemas.FleetLiveness(**heartbeats.liveness(timedelta(seconds=window)), online_window_seconds=window)
+
+@router.get("/rollup", response_model=schemas.FleetRollup)
+async def read_fleet_rollup(if_none_match: Optional[str] = Header(None)):
+    """
+    Device counts by status (up/down/unknown/stale/never_seen) in total, per
+    os_type and per policy. Precomputed every ROLLUP_REFRESH_INTERVAL seconds.
+    """
+    body, etag = fleet_rollup.body, fleet_rollup.etag
+    if body is None:
+        raise HTTPException(status_code=503, detail="Fleet rollup not computed yet")
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+@router.get("/tunnels", response_model=List[schemas.DeviceTunnel])
+async def read_tunnels(
+    response: Response,
+    state: Optional[str] = Query(None, description="Only tunnels in this IKE SA state, e.g. DOWN"),
+    up: Optional[bool] = Query(None, description="false: only tunnels that are not ESTABLISHED"),
+    after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    """Reported tunnel status across the fleet, ordered by device and tunnel name."""
+    tunnel = models.DeviceTunnel
+    query = select(tunnel)
+    if state is not None:
+        query = query.where(tunnel.state == state)
+    if up is not None:
+        query = query.where(tunnel.state == ESTABLISHED if up else tunnel.state != ESTABLISHED)
+    if after:
+        device_id, _, name = after.partition(":")
+        if not device_id.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(or_(
+            tunnel.device_id > int(device_id),
+            and_(tunnel.device_id == int(device_id), tunnel.name > name)
+        ))
+    tunnels = (await db.execute(query.order_by(tunnel.device_id, tunnel.name).limit(limit))).scalars().all()
+    if len(tunnels) == limit:
+        response.headers["X-Next-Cursor"] = f"{tunnels[-1].device_id}:{tunnels[-1].name}"
+    return tunnels
+
 @router.get("/{device_id}", response_model=schemas.Device)
-def read_device(device_id: int, db: Session = Depends(database.get_db)):
-    device = db.query(models.Device).filter(models.Device.id == device_id).first()
+async def read_device(device_id: int, db: AsyncSession = Depends(database.get_device_read_db)):
+    device = await get_device_with_policy(db, device_id)
     if device is None:
         raise HTTPException(status_code=404, detail="Device not found")
     return device
 
-@router.get("/{device_id}/config", response_model=schemas.Policy)
-def get_device_config(device_id: int, db: Session = Depends(database.get_db)):
-    device = db.query(models.Device).filter(models.Device.id == device_id).first()
-    if device is None:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    if not device.policy:
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+@router.get("/{device_id}/config", response_model=schemas.Policy, dependencies=[Depends(require_device)])
+async def get_device_config(
+    device_id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    # Served from the policy cache: known devices need no DB access and
+    # the body is pre-serialized JSON
+    cached = await policy_cache.device_policy(db, device_id)
+    heartbeats.record(device_id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="No policy assigned to this device")
+
+    if etag_matches(if_none_match, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": cached.etag})
+
+    return Response(content=cached.body, media_type="application/json", headers={"ETag": cached.etag})
+
+@router.get("/{device_id}/config/rendered", response_model=schemas.RenderedConfig, dependencies=[Depends(require_device)])
+async def get_rendered_config(
+    device_id: int,
+    fmt: Optional[str] = Query(None, alias="format", description="ipsec, swanctl or powershell (default: by os_type)"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    The device's policy rendered as ready-to-apply platform config. Rendered
+    once per policy revision and format; the ETag is the content hash.
+    """
+    if fmt is None:
+        row = (await db.execute(select(models.Device.os_type).where(models.Device.id == device_id))).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+        fmt = rendering.DEFAULT_FORMATS.get(row[0])
+        if fmt is None:
+            raise HTTPException(status_code=400, detail=f"No default config format for os_type {row[0]!r}")
+    elif fmt not in rendering.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown config format {fmt!r}")
+
+    cached = await policy_cache.device_policy(db, device_id)
+    heartbeats.record(device_id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="No policy assigned to this device")
+
+    rendered = await policy_cache.rendered(db, cached.policy_id, fmt)
+    if rendered is None:
         raise HTTPException(status_code=404, detail="No policy assigned to this device")
-        
-    return device.policy
+    if etag_matches(if_none_match, rendered.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": rendered.etag})
+
+    return Response(content=rendered.body, media_type="application/json", headers={"ETag": rendered.etag})
+
+@router.post("/{device_id}/heartbeat", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(require_device)])
+async def device_heartbeat(device_id: int, heartbeat: schemas.Heartbeat, db: AsyncSession = Depends(database.get_async_db)):
+    # Only devices not seen by this worker yet cost a lookup
+    if not heartbeats.is_known(device_id):
+        if await db.get(models.Device, device_id) is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+    tunnels = None
+    try:
+        if heartbeat.tunnels is not None:
+            tunnels = [TunnelStatus.from_row(row) for row in heartbeat.tunnels]
+        heartbeats.record(device_id, heartbeat.tunnel_up, tunnels, heartbeat.applied_etag, heartbeat.sync_cursor)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid tunnel status: {e}")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.get("/{device_id}/tunnels", response_model=List[schemas.DeviceTunnel])
+async def read_device_tunnels(device_id: int, db: AsyncSession = Depends(database.get_device_read_db)):
+    """Per-tunnel status from the device's last report, as of the last heartbeat flush."""
+    if not heartbeats.is_known(device_id):
+        if await db.get(models.Device, device_id) is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+    result = await db.execute(
+        select(models.DeviceTunnel)
+        .where(models.DeviceTunnel.device_id == device_id)
+        .order_by(models.DeviceTunnel.name)
+    )
+    return result.scalars().all()
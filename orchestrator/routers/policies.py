@@ -1,47 +1,259 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+import ipaddress
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import select, exists
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, List, Optional
 from .. import models, schemas, database
+from ..database import BULK_CHUNK_SIZE
+from ..cache import policy_cache, publish_changes
+from ..cidr_index import selector_index, parse_cidr, holds_conflicting_policy, IPNetwork
+from ..config import get_settings
+from ..notifier import notifier
+from ..sync import next_sync_seq, assign_primary
+
+settings = get_settings()
+
+# At most this many policy ids are listed in X-Policy-Conflicts
+MAX_CONFLICTS_HEADER = 100
 
 router = APIRouter(
     prefix="/policies",
     tags=["policies"]
 )
 
+async def get_policy_or_404(db: AsyncSession, policy_id: int) -> models.Policy:
+    policy = await db.get(models.Policy, policy_id)
+    if policy is None:
+        raise HTTPException(status_code=404, detail="Policy not found")
+    return policy
+
+async def policy_name_taken(db: AsyncSession, name: str) -> bool:
+    result = await db.execute(select(models.Policy.id).where(models.Policy.name == name))
+    return result.first() is not None
+
+def parse_selectors(local: str, remote: str):
+    try:
+        return parse_cidr(local), parse_cidr(remote)
+    except (AttributeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid network selector: {e}")
+
+def check_overlaps(response: Response, local: IPNetwork, remote: IPNetwork, exclude: Iterable[int] = ()) -> List[int]:
+    """Reject or flag (per POLICY_OVERLAP_ACTION) policies overlapping these selectors."""
+    conflicts = selector_index.conflicts(local, remote, exclude)
+    if conflicts:
+        if settings.POLICY_OVERLAP_ACTION == "reject":
+            raise HTTPException(status_code=409, detail=f"Selectors overlap policies {conflicts[:MAX_CONFLICTS_HEADER]}")
+        response.headers["X-Policy-Conflicts"] = ",".join(str(policy_id) for policy_id in conflicts[:MAX_CONFLICTS_HEADER])
+    return conflicts
+
 @router.post("/", response_model=schemas.Policy)
-def create_policy(policy: schemas.PolicyCreate, db: Session = Depends(database.get_db)):
-    db_policy = db.query(models.Policy).filter(models.Policy.name == policy.name).first()
-    if db_policy:
+async def create_policy(policy: schemas.PolicyCreate, response: Response, db: AsyncSession = Depends(database.get_async_db)):
+    local, remote = parse_selectors(policy.local_network_cidr, policy.remote_network_cidr)
+    if await policy_name_taken(db, policy.name):
         raise HTTPException(status_code=400, detail="Policy with this name already exists")
-    
+    check_overlaps(response, local, remote)
+
     new_policy = models.Policy(**policy.model_dump())
     db.add(new_policy)
-    db.commit()
-    db.refresh(new_policy)
+    await db.flush()
+    await publish_changes(db, policy_ids=[new_policy.id])
+    selector_index.set(new_policy.id, local, remote)
+    database.read_router.note_write("policy", new_policy.id)
+    await db.refresh(new_policy)
     return new_policy
 
 @router.get("/", response_model=List[schemas.Policy])
-def read_policies(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
-    policies = db.query(models.Policy).offset(skip).limit(limit).all()
+async def read_policies(
+    response: Response,
+    after: Optional[int] = Query(None, description="Return policies with id greater than this cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    skip: int = Query(0, ge=0, description="Deprecated, use the `after` cursor"),
+    name_prefix: Optional[str] = None,
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    query = select(models.Policy)
+    if name_prefix is not None:
+        query = query.where(models.Policy.name.startswith(name_prefix, autoescape=True))
+    if after is not None:
+        query = query.where(models.Policy.id > after)
+    query = query.order_by(models.Policy.id).offset(skip).limit(limit)
+    policies = (await db.execute(query)).scalars().all()
+    if len(policies) == limit:
+        response.headers["X-Next-Cursor"] = str(policies[-1].id)
     return policies
 
+@router.get("/covering", response_model=List[schemas.Policy])
+async def read_covering_policies(
+    address: str = Query(..., description="IPv4 or IPv6 address"),
+    side: str = Query("remote", pattern="^(local|remote)$", description="Selector to match"),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    """Policies whose local or remote selector contains `address`, from the selector index."""
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid IP address {address!r}")
+
+    policy_ids = selector_index.covering(ip, side)
+    policies = []
+    for start in range(0, len(policy_ids), BULK_CHUNK_SIZE):
+        chunk = policy_ids[start:start + BULK_CHUNK_SIZE]
+        policies += (await db.execute(select(models.Policy).where(models.Policy.id.in_(chunk)))).scalars().all()
+    return sorted(policies, key=lambda policy: policy.id)
+
+@router.get("/{policy_id}/conflicts", response_model=schemas.PolicyConflicts)
+async def read_policy_conflicts(policy_id: int, db: AsyncSession = Depends(database.get_policy_read_db)):
+    """Policies whose local and remote selectors both overlap this one's."""
+    await get_policy_or_404(db, policy_id)
+    return schemas.PolicyConflicts(policy_id=policy_id, conflicts=selector_index.policy_conflicts(policy_id))
+
 @router.get("/{policy_id}", response_model=schemas.Policy)
-def read_policy(policy_id: int, db: Session = Depends(database.get_db)):
-    policy = db.query(models.Policy).filter(models.Policy.id == policy_id).first()
-    if policy is None:
+async def read_policy(policy_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    cached = await policy_cache.policy(db, policy_id)
+    if cached is None:
         raise HTTPException(status_code=404, detail="Policy not found")
+    return Response(content=cached.body, media_type="application/json", headers={"ETag": cached.etag})
+
+@router.put("/{policy_id}", response_model=schemas.Policy)
+async def update_policy(
+    policy_id: int,
+    policy_update: schemas.PolicyUpdate,
+    response: Response,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    policy = await get_policy_or_404(db, policy_id)
+
+    changes = policy_update.model_dump(exclude_unset=True)
+    if "name" in changes and changes["name"] != policy.name:
+        if await policy_name_taken(db, changes["name"]):
+            raise HTTPException(status_code=400, detail="Policy with this name already exists")
+
+    selectors = None
+    if "local_network_cidr" in changes or "remote_network_cidr" in changes:
+        selectors = parse_selectors(
+            changes.get("local_network_cidr", policy.local_network_cidr),
+            changes.get("remote_network_cidr", policy.remote_network_cidr)
+        )
+        conflicts = check_overlaps(response, *selectors, exclude=[policy_id])
+        if conflicts and await shares_device_with(db, policy_id, conflicts):
+            raise HTTPException(status_code=409, detail="Devices holding this policy also hold a policy with overlapping selectors")
+
+    for field, value in changes.items():
+        setattr(policy, field, value)
+    policy.revision = models.Policy.revision + 1
+    policy.sync_seq = await next_sync_seq(db)
+    await publish_changes(db, policy_ids=[policy_id])
+    if selectors is not None:
+        selector_index.set(policy_id, *selectors)
+    database.read_router.note_write("policy", policy_id)
+    await db.refresh(policy)
+
+    # Primary assignments plus devices holding it as an additional policy
+    result = await db.execute(
+        select(models.Device.id).where(models.Device.policy_id == policy_id)
+        .union(select(models.DevicePolicy.device_id).where(
+            models.DevicePolicy.policy_id == policy_id, models.DevicePolicy.removed.is_(False)
+        ))
+    )
+    affected = result.scalars().all()
+    notifier.notify(affected)
+    database.read_router.note_write("device", *affected)
     return policy
 
+async def shares_device_with(db: AsyncSession, policy_id: int, other_ids: List[int]) -> bool:
+    """Whether any device's policy set holds `policy_id` and one of `other_ids`."""
+    holder, other = models.DevicePolicy, aliased(models.DevicePolicy)
+    result = await db.execute(
+        select(holder.device_id).where(
+            holder.policy_id == policy_id,
+            holder.removed.is_(False),
+            exists().where(other.device_id == holder.device_id, other.policy_id.in_(other_ids), other.removed.is_(False))
+        ).limit(1)
+    )
+    return result.first() is not None
+
+@router.post("/{policy_id}/assign", response_model=schemas.BulkAssignResult)
+async def bulk_assign_policy(policy_id: int, selection: schemas.BulkAssign, db: AsyncSession = Depends(database.get_async_db)):
+    policy = await get_policy_or_404(db, policy_id)
+
+    filters = []
+    if selection.hostname_prefix is not None:
+        filters.append(models.Device.hostname.startswith(selection.hostname_prefix, autoescape=True))
+    if selection.os_type is not None:
+        filters.append(models.Device.os_type == selection.os_type)
+    if selection.device_ids is None and not filters:
+        raise HTTPException(status_code=400, detail="Provide device_ids or at least one selector")
+
+    # Devices already holding a policy that overlaps this one are skipped,
+    # unless it's the primary this assignment replaces
+    conflicts = selector_index.policy_conflicts(policy.id)
+    holds_conflict = holds_conflicting_policy(conflicts, replacing_primary=True) if conflicts else None
+
+    async def find_conflicting(*criteria):
+        if holds_conflict is None:
+            return []
+        return (await db.execute(select(models.Device.id).where(*filters, holds_conflict, *criteria))).scalars().all()
+
+    # The primary policy is also part of each device's policy set
+    seq = await next_sync_seq(db)
+
+    async def assign(*criteria):
+        if holds_conflict is not None:
+            criteria += (~holds_conflict,)
+        return await assign_primary(db, policy.id, [*filters, *criteria], seq)
+
+    assigned, conflicting = [], []
+    if selection.device_ids is None:
+        conflicting = await find_conflicting()
+        assigned = await assign()
+    else:
+        device_ids = list(dict.fromkeys(selection.device_ids))
+        for start in range(0, len(device_ids), BULK_CHUNK_SIZE):
+            chunk = models.Device.id.in_(device_ids[start:start + BULK_CHUNK_SIZE])
+            conflicting += await find_conflicting(chunk)
+            assigned += await assign(chunk)
+
+    # One transaction for the whole batch
+    await publish_changes(db, device_ids=assigned)
+    notifier.notify(assigned)
+    database.read_router.note_write("device", *assigned)
+
+    # Requested devices neither assigned nor conflicting either don't exist
+    # or were excluded by the hostname_prefix/os_type filters
+    handled = set(assigned) | set(conflicting)
+    unhandled = [device_id for device_id in dict.fromkeys(selection.device_ids or []) if device_id not in handled]
+    existing = set()
+    for start in range(0, len(unhandled), BULK_CHUNK_SIZE):
+        existing.update((await db.execute(
+            select(models.Device.id).where(models.Device.id.in_(unhandled[start:start + BULK_CHUNK_SIZE]))
+        )).scalars())
+    return schemas.BulkAssignResult(
+        policy_id=policy.id,
+        assigned=sorted(assigned),
+        not_found=[device_id for device_id in unhandled if device_id not in existing],
+        filtered=[device_id for device_id in unhandled if device_id in existing],
+        conflicting=sorted(conflicting)
+    )
+
 @router.post("/{policy_id}/assign/{device_id}")
-def assign_policy(policy_id: int, device_id: int, db: Session = Depends(database.get_db)):
-    policy = db.query(models.Policy).filter(models.Policy.id == policy_id).first()
-    if not policy:
-        raise HTTPException(status_code=404, detail="Policy not found")
-        
-    device = db.query(models.Device).filter(models.Device.id == device_id).first()
+async def assign_policy(policy_id: int, device_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    policy = await get_policy_or_404(db, policy_id)
+
+    device = await db.get(models.Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-        
-    device.policy_id = policy.id
-    db.commit()
+
+    conflicts = selector_index.policy_conflicts(policy.id)
+    if conflicts:
+        result = await db.execute(select(models.Device.id).where(
+            models.Device.id == device_id, holds_conflicting_policy(conflicts, replacing_primary=True)
+        ))
+        if result.first() is not None:
+            raise HTTPException(status_code=409, detail="Device already holds a policy with overlapping selectors")
+
+    await assign_primary(db, policy.id, [models.Device.id == device.id], await next_sync_seq(db))
+    await publish_changes(db, device_ids=[device.id])
+    notifier.notify([device.id])
+    database.read_router.note_write("device", device.id)
     return {"message": "Policy assigned successfully"}
@@ -0,0 +1,157 @@
+import math
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from .. import models, schemas, database
+from ..database import BULK_CHUNK_SIZE
+from ..rollouts import plan_waves, add_targets, target_counts, RUNNING, PAUSED, ABORTED, COMPLETED
+
+router = APIRouter(
+    prefix="/rollouts",
+    tags=["rollouts"]
+)
+
+async def get_rollout_or_404(db: AsyncSession, rollout_id: int) -> models.Rollout:
+    rollout = await db.get(models.Rollout, rollout_id)
+    if rollout is None:
+        raise HTTPException(status_code=404, detail="Rollout not found")
+    return rollout
+
+async def rollout_status(db: AsyncSession, rollout: models.Rollout) -> schemas.Rollout:
+    status = schemas.Rollout.model_validate(rollout)
+    status.targets = await target_counts(db, rollout.id)
+    return status
+
+@router.post("/", response_model=schemas.Rollout)
+async def create_rollout(rollout: schemas.RolloutCreate, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Assign a policy to the selected devices in waves instead of all at once.
+    The rollout scheduler starts it on its next tick.
+    """
+    if await db.get(models.Policy, rollout.policy_id) is None:
+        raise HTTPException(status_code=404, detail="Policy not found")
+    if (rollout.wave_size is None) == (rollout.wave_percent is None):
+        raise HTTPException(status_code=400, detail="Provide one of wave_size or wave_percent")
+    if (rollout.wave_size is not None and rollout.wave_size < 1) \
+            or (rollout.wave_percent is not None and not 0 < rollout.wave_percent <= 100):
+        raise HTTPException(status_code=400, detail="wave_size must be at least 1, wave_percent in (0, 100]")
+    if rollout.max_in_flight < 1 or rollout.ack_timeout < 1:
+        raise HTTPException(status_code=400, detail="max_in_flight and ack_timeout must be positive")
+    if rollout.canary_size < 0 or rollout.max_failures < 0:
+        raise HTTPException(status_code=400, detail="canary_size and max_failures cannot be negative")
+
+    filters = []
+    if rollout.hostname_prefix is not None:
+        filters.append(models.Device.hostname.startswith(rollout.hostname_prefix, autoescape=True))
+    if rollout.os_type is not None:
+        filters.append(models.Device.os_type == rollout.os_type)
+    if rollout.device_ids is None and not filters:
+        raise HTTPException(status_code=400, detail="Provide device_ids or at least one selector")
+
+    if rollout.device_ids is None:
+        device_ids = (await db.execute(select(models.Device.id).where(*filters))).scalars().all()
+    else:
+        requested = list(dict.fromkeys(rollout.device_ids))
+        device_ids = []
+        for start in range(0, len(requested), BULK_CHUNK_SIZE):
+            chunk = requested[start:start + BULK_CHUNK_SIZE]
+            device_ids += (await db.execute(
+                select(models.Device.id).where(models.Device.id.in_(chunk), *filters)
+            )).scalars().all()
+    if not device_ids:
+        raise HTTPException(status_code=400, detail="No devices match the selection")
+
+    canary_size = min(rollout.canary_size, len(device_ids))
+    remaining = len(device_ids) - canary_size
+    wave_size = rollout.wave_size or max(1, math.ceil(remaining * rollout.wave_percent / 100))
+    waves = plan_waves(device_ids, wave_size, canary_size)
+
+    db_rollout = models.Rollout(
+        policy_id=rollout.policy_id,
+        state=RUNNING,
+        waves=max(waves.values()) + 1,
+        current_wave=0,
+        canary_size=canary_size,
+        max_in_flight=rollout.max_in_flight,
+        ack_timeout=rollout.ack_timeout,
+        max_failures=rollout.max_failures,
+        accepted_failures=0
+    )
+    db.add(db_rollout)
+    await db.flush()
+    await add_targets(db, db_rollout.id, waves)
+    # One transaction for the rollout and all its targets
+    await db.commit()
+    await db.refresh(db_rollout)
+    return await rollout_status(db, db_rollout)
+
+@router.get("/", response_model=List[schemas.Rollout])
+async def read_rollouts(
+    state: Optional[str] = Query(None, description="running, paused, completed or aborted"),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    query = select(models.Rollout).order_by(models.Rollout.id)
+    if state is not None:
+        query = query.where(models.Rollout.state == state)
+    return [await rollout_status(db, rollout) for rollout in (await db.execute(query)).scalars().all()]
+
+@router.get("/{rollout_id}", response_model=schemas.Rollout)
+async def read_rollout(rollout_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    return await rollout_status(db, await get_rollout_or_404(db, rollout_id))
+
+@router.get("/{rollout_id}/targets", response_model=List[schemas.RolloutTarget])
+async def read_rollout_targets(
+    rollout_id: int,
+    response: Response,
+    state: Optional[str] = Query(None, description="pending, applying, acked, timed_out or skipped"),
+    after: Optional[int] = Query(None, description="Return targets with device id greater than this cursor"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    await get_rollout_or_404(db, rollout_id)
+    target = models.RolloutTarget
+    query = select(target).where(target.rollout_id == rollout_id)
+    if state is not None:
+        query = query.where(target.state == state)
+    if after is not None:
+        query = query.where(target.device_id > after)
+    targets = (await db.execute(query.order_by(target.device_id).limit(limit))).scalars().all()
+    if len(targets) == limit:
+        response.headers["X-Next-Cursor"] = str(targets[-1].device_id)
+    return targets
+
+@router.post("/{rollout_id}/pause", response_model=schemas.Rollout)
+async def pause_rollout(rollout_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    """Stop assigning to more devices; devices already assigned keep the policy."""
+    rollout = await get_rollout_or_404(db, rollout_id)
+    if rollout.state != RUNNING:
+        raise HTTPException(status_code=409, detail=f"Rollout is {rollout.state}")
+    rollout.state, rollout.reason = PAUSED, "Paused by operator"
+    await db.commit()
+    await db.refresh(rollout)
+    return await rollout_status(db, rollout)
+
+@router.post("/{rollout_id}/resume", response_model=schemas.Rollout)
+async def resume_rollout(rollout_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    """Continue a paused rollout, accepting the devices that timed out so far."""
+    rollout = await get_rollout_or_404(db, rollout_id)
+    if rollout.state != PAUSED:
+        raise HTTPException(status_code=409, detail=f"Rollout is {rollout.state}")
+    counts = await target_counts(db, rollout_id)
+    rollout.state, rollout.reason = RUNNING, None
+    rollout.accepted_failures = counts.get("timed_out", 0)
+    await db.commit()
+    await db.refresh(rollout)
+    return await rollout_status(db, rollout)
+
+@router.post("/{rollout_id}/abort", response_model=schemas.Rollout)
+async def abort_rollout(rollout_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    """End the rollout for good. Devices already assigned keep the policy."""
+    rollout = await get_rollout_or_404(db, rollout_id)
+    if rollout.state in (COMPLETED, ABORTED):
+        raise HTTPException(status_code=409, detail=f"Rollout is {rollout.state}")
+    rollout.state, rollout.reason = ABORTED, "Aborted by operator"
+    await db.commit()
+    await db.refresh(rollout)
+    return await rollout_status(db, rollout)
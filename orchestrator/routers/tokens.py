@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, database
+from ..auth import device_tokens, require_device
+
+router = APIRouter(
+    prefix="/devices",
+    tags=["tokens"]
+)
+
+@router.post("/{device_id}/token", response_model=schemas.DeviceToken, dependencies=[Depends(require_device)])
+async def refresh_token(device_id: int):
+    """
+    Exchange a still valid device token for a new one. Agents call this
+    before their token expires; an expired token means enrolling again.
+    """
+    token, expires_in = device_tokens.issue(device_id)
+    return schemas.DeviceToken(token=token, token_expires_in=expires_in)
+
+@router.post("/{device_id}/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_tokens(device_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Reject every token issued to the device so far. Its agent gets a new
+    one by enrolling again with its enrollment token.
+    """
+    if await db.get(models.Device, device_id) is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    await device_tokens.revoke(db, device_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
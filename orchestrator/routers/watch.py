@@ -0,0 +1,55 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response, status
+from typing import Optional
+from .. import schemas, database
+from ..auth import require_device
+from ..cache import CachedPolicy, policy_cache
+from ..config import get_settings
+from ..heartbeat import heartbeats
+from ..notifier import notifier
+from .devices import etag_matches
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/devices",
+    tags=["devices"]
+)
+
+async def _load_config_state(device_id: int) -> Optional[CachedPolicy]:
+    # Short-lived session (only opened on a cache miss), so no connection
+    # is held while the request waits
+    async with database.AsyncSessionLocal() as db:
+        return await policy_cache.device_policy(db, device_id)
+
+@router.get("/{device_id}/config/watch", response_model=schemas.Policy, dependencies=[Depends(require_device)])
+async def watch_device_config(
+    device_id: int,
+    timeout: float = Query(25, ge=0, le=settings.LONG_POLL_MAX_TIMEOUT),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Long-poll variant of GET /devices/{device_id}/config.
+    Returns as soon as the device's policy differs from If-None-Match,
+    or 304 once `timeout` seconds pass without a change.
+    """
+    # Subscribe before reading the current state so a change committed
+    # in between still wakes us up
+    with notifier.subscribe(device_id) as changed:
+        state = await _load_config_state(device_id)
+        heartbeats.record(device_id)
+        unchanged = etag_matches(if_none_match, state.etag) if state else not if_none_match
+        if unchanged:
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+                state = await _load_config_state(device_id)
+            except asyncio.TimeoutError:
+                pass
+
+    if state is None:
+        raise HTTPException(status_code=404, detail="No policy assigned to this device")
+
+    if etag_matches(if_none_match, state.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": state.etag})
+
+    return Response(content=state.body, media_type="application/json", headers={"ETag": state.etag})
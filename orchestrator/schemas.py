@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Union
 from datetime import datetime
 
 # Policy Schemas
@@ -18,14 +18,36 @@ class PolicyBase(BaseModel):
 class PolicyCreate(PolicyBase):
     pass
 
+class PolicyUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    ike_version: Optional[str] = None
+    encryption_algorithm: Optional[str] = None
+    integrity_algorithm: Optional[str] = None
+    dh_group: Optional[str] = None
+    local_network_cidr: Optional[str] = None
+    remote_network_cidr: Optional[str] = None
+    auth_method: Optional[str] = None
+    psk_secret: Optional[str] = None
+
 class Policy(PolicyBase):
     id: int
+    revision: int = 1
     created_at: datetime
     updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class RenderedConfig(BaseModel):
+    policy_id: int
+    policy_name: str
+    revision: int
+    format: str
+    # Artifact name -> content, ready to write/run on the device
+    files: Dict[str, str]
+    hash: str
+
 # Device Schemas
 class DeviceBase(BaseModel):
     hostname: str
@@ -39,13 +61,178 @@ class DeviceUpdate(BaseModel):
     public_ip: Optional[str] = None
     is_active: Optional[bool] = None
 
-class Device(DeviceBase):
+class BulkEnrollResult(BaseModel):
+    enrollment_token: str
+    id: int
+    created: bool
+
+class BulkAssign(BaseModel):
+    # Devices are selected by explicit IDs and/or filters; all given criteria must match
+    device_ids: Optional[List[int]] = None
+    hostname_prefix: Optional[str] = None
+    os_type: Optional[str] = None
+
+class BulkAssignResult(BaseModel):
+    policy_id: int
+    assigned: List[int]
+    not_found: List[int] = []
+    # Requested devices that exist but don't match hostname_prefix/os_type
+    filtered: List[int] = []
+    # Devices skipped because they hold a policy with overlapping selectors
+    conflicting: List[int] = []
+
+class DeviceSummary(DeviceBase):
     id: int
     is_active: bool
     last_seen: Optional[datetime] = None
+    tunnel_up: Optional[bool] = None
     policy_id: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class Device(DeviceSummary):
     policy: Optional[Policy] = None
+
+class DeviceToken(BaseModel):
+    # Bearer token for the device's agent endpoints
+    token: str
+    token_expires_in: int  # Seconds
+
+class DeviceEnrollment(Device, DeviceToken):
+    pass
+
+class Heartbeat(BaseModel):
+    tunnel_up: Optional[bool] = None
+    # One row per tunnel in shared.tunnels.TUNNEL_FIELDS order; replaces
+    # the device's previously reported tunnels
+    tunnels: Optional[List[List[Union[str, int, None]]]] = None
+    # ETag of the config the agent has applied, or for delta-syncing agents
+    # the last sync cursor applied; acknowledge rollouts
+    applied_etag: Optional[str] = None
+    sync_cursor: Optional[int] = None
+
+class DeviceTunnel(BaseModel):
+    device_id: int
+    name: str
+    state: str
+    child_sas: int
+    established_at: Optional[datetime] = None
+    rekey_at: Optional[datetime] = None
+    bytes_in: Optional[int] = None
+    bytes_out: Optional[int] = None
+    packets_in: Optional[int] = None
+    packets_out: Optional[int] = None
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class FleetLiveness(BaseModel):
+    online: int
+    offline: int
+    never_seen: int
+    total: int
+    online_window_seconds: int
+
+class StatusCounts(BaseModel):
+    up: int = 0  # Online, tunnel up
+    down: int = 0  # Online, tunnel down
+    unknown: int = 0  # Online, no tunnel state reported
+    stale: int = 0  # Not heard from within the online window
+    never_seen: int = 0
+    total: int = 0
+
+class FleetRollup(BaseModel):
+    generated_at: datetime
+    online_window_seconds: int
+    total: StatusCounts
+    by_os_type: Dict[str, StatusCounts]
+    # By policy id; devices count towards every policy assigned to them
+    by_policy: Dict[int, StatusCounts]
+    unassigned: StatusCounts
+
+class DevicePage(BaseModel):
+    # Devices reference their policy by policy_id; each policy appears once
+    devices: List[DeviceSummary]
+    policies: Dict[int, Policy]
+    next_cursor: Optional[int] = None
+
+class DevicePolicyAssign(BaseModel):
+    policy_ids: List[int]
+
+class DevicePolicyAssignResult(BaseModel):
+    device_id: int
+    assigned: List[int]
+    not_found: List[int]
+    # Skipped: selectors overlap a policy already in the device's set
+    conflicting: List[int] = []
+
+class PolicyConflicts(BaseModel):
+    policy_id: int
+    # Policies whose local and remote selectors both overlap this one's
+    conflicts: List[int]
+
+class CertificateRequest(BaseModel):
+    # PEM CSR; without one the orchestrator supplies the key (if its key pool is enabled)
+    csr: Optional[str] = None
+
+class IssuedCertificate(BaseModel):
+    device_id: int
+    serial: str
+    not_after: datetime
+    certificate: str
+    ca_certificate: str
+    private_key: Optional[str] = None  # Only for server-generated keys
+
+class RolloutCreate(BulkAssign):
+    # Targets are selected like POST /policies/{id}/assign
+    policy_id: int
+    # Devices per wave, as a count or a percentage of the targets
+    wave_size: Optional[int] = None
+    wave_percent: Optional[float] = None
+    # Devices in a first canary wave; any of them failing pauses the rollout
+    canary_size: int = 0
+    # Assigned but not yet acknowledged devices at any time
+    max_in_flight: int = 50
+    ack_timeout: int = 300  # Seconds for a device to acknowledge
+    max_failures: int = 0  # Timed-out devices tolerated before pausing
+
+class Rollout(BaseModel):
+    id: int
+    policy_id: int
+    state: str
+    reason: Optional[str] = None
+    waves: int
+    current_wave: int
+    canary_size: int
+    max_in_flight: int
+    ack_timeout: int
+    max_failures: int
+    accepted_failures: int
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    # Targets per state (pending, applying, acked, timed_out, skipped)
+    targets: Dict[str, int] = {}
 
     class Config:
         from_attributes = True
+
+class RolloutTarget(BaseModel):
+    device_id: int
+    wave: int
+    state: str
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class SyncDelta(BaseModel):
+    # Send back as `cursor` on the next sync once this delta is applied
+    cursor: int
+    # True: `changed` is the complete policy set, drop anything not in it
+    full: bool
+    changed: List[Policy]
+    removed: List[int]  # Policy ids no longer assigned
@@ -0,0 +1,150 @@
+from collections import defaultdict
+from typing import Iterable, List, Tuple
+from sqlalchemy import select, update, insert, exists, literal, false
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, database
+
+COUNTER_ID = 1
+
+async def next_sync_seq(db: AsyncSession) -> int:
+    """
+    Allocate the next sync sequence number in the caller's transaction.
+    The counter row stays locked until commit, so sequence numbers become
+    visible in commit order and a cursor never skips over a change.
+    """
+    stmt = update(models.SyncCounter) \
+        .where(models.SyncCounter.id == COUNTER_ID) \
+        .values(value=models.SyncCounter.value + 1) \
+        .returning(models.SyncCounter.value) \
+        .execution_options(synchronize_session=False)
+    seq = (await db.execute(stmt)).scalar()
+    if seq is None:
+        await database.upsert(db, models.SyncCounter, [{"id": COUNTER_ID, "value": 1}], ["id"])
+        seq = (await db.execute(stmt)).scalar()
+    return seq
+
+async def current_sync_seq(db: AsyncSession) -> int:
+    result = await db.execute(select(models.SyncCounter.value).where(models.SyncCounter.id == COUNTER_ID))
+    return result.scalar() or 0
+
+async def add_assignments(db: AsyncSession, pairs: Iterable[Tuple[int, int]], seq: int):
+    """Upsert (device_id, policy_id) assignments, reviving removed ones."""
+    rows = [{"device_id": device_id, "policy_id": policy_id, "seq": seq, "removed": False} for device_id, policy_id in pairs]
+    await database.upsert(db, models.DevicePolicy, rows, ["device_id", "policy_id"], ["seq", "removed"])
+
+async def assign_primary(db: AsyncSession, policy_id: int, criteria: list, seq: int) -> List[int]:
+    """
+    Make `policy_id` the primary policy of the devices matching `criteria`
+    and add it to their policy sets. The primary it replaces is tombstoned
+    in the same transaction, so delta-syncing agents drop its connection.
+    Returns the ids of the devices assigned.
+    """
+    rows = (await db.execute(
+        select(models.Device.id, models.Device.policy_id).where(*criteria).with_for_update()
+    )).all()
+    device_ids = [device_id for device_id, _ in rows]
+    replaced = defaultdict(list)
+    for device_id, previous in rows:
+        if previous is not None and previous != policy_id:
+            replaced[previous].append(device_id)
+
+    for start in range(0, len(device_ids), database.BULK_CHUNK_SIZE):
+        chunk = device_ids[start:start + database.BULK_CHUNK_SIZE]
+        await db.execute(
+            update(models.Device).where(models.Device.id.in_(chunk))
+            .values(policy_id=policy_id)
+            .execution_options(synchronize_session=False)
+        )
+        await add_assignments(db, [(device_id, policy_id) for device_id in chunk], seq)
+    for previous, previous_devices in replaced.items():
+        for start in range(0, len(previous_devices), database.BULK_CHUNK_SIZE):
+            await db.execute(
+                update(models.DevicePolicy)
+                .where(
+                    models.DevicePolicy.device_id.in_(previous_devices[start:start + database.BULK_CHUNK_SIZE]),
+                    models.DevicePolicy.policy_id == previous,
+                    models.DevicePolicy.removed.is_(False)
+                )
+                .values(removed=True, seq=seq)
+                .execution_options(synchronize_session=False)
+            )
+    return device_ids
+
+async def remove_assignment(db: AsyncSession, device_id: int, policy_id: int, seq: int) -> bool:
+    """Tombstone an assignment. Returns False if it wasn't assigned."""
+    result = await db.execute(
+        update(models.DevicePolicy)
+        .where(
+            models.DevicePolicy.device_id == device_id,
+            models.DevicePolicy.policy_id == policy_id,
+            models.DevicePolicy.removed.is_(False)
+        )
+        .values(removed=True, seq=seq)
+        .returning(models.DevicePolicy.policy_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.first() is not None
+
+def assigned_policies_query(device_id: int):
+    return select(models.Policy) \
+        .join(models.DevicePolicy, models.DevicePolicy.policy_id == models.Policy.id) \
+        .where(models.DevicePolicy.device_id == device_id, models.DevicePolicy.removed.is_(False)) \
+        .order_by(models.Policy.id)
+
+async def device_delta(db: AsyncSession, device_id: int, cursor: int) -> schemas.SyncDelta:
+    """
+    Policies added to or changed for `device_id` and assignments removed
+    since `cursor`. Cursor 0 (or one from the future, e.g. after a database
+    restore) returns the full policy set.
+    """
+    # Read the counter first: anything committed later is at worst sent twice
+    current = await current_sync_seq(db)
+    if cursor <= 0 or cursor > current:
+        policies = (await db.execute(assigned_policies_query(device_id))).scalars().all()
+        return schemas.SyncDelta(cursor=current, full=True, changed=policies, removed=[])
+
+    # Assignments added or removed since the cursor
+    assignments = (await db.execute(
+        select(models.DevicePolicy.policy_id, models.DevicePolicy.removed)
+        .where(models.DevicePolicy.device_id == device_id, models.DevicePolicy.seq > cursor)
+    )).all()
+    removed = sorted(policy_id for policy_id, is_removed in assignments if is_removed)
+    added = {policy_id for policy_id, is_removed in assignments if not is_removed}
+
+    # Assigned policies whose content changed since the cursor; driven by the
+    # sync_seq index, so unchanged policies of a hub device aren't scanned
+    changed = {
+        policy.id: policy for policy in (await db.execute(
+            assigned_policies_query(device_id).where(models.Policy.sync_seq > cursor)
+        )).scalars()
+    }
+    missing = added - changed.keys()
+    if missing:
+        for policy in (await db.execute(select(models.Policy).where(models.Policy.id.in_(missing)))).scalars():
+            changed[policy.id] = policy
+
+    return schemas.SyncDelta(
+        cursor=current,
+        full=False,
+        changed=[changed[policy_id] for policy_id in sorted(changed)],
+        removed=removed
+    )
+
+def init_sync_state(engine):
+    """
+    Create the sequence counter (starting at 1, so a full sync never hands
+    out cursor 0) and DevicePolicy rows for primary policies assigned
+    before they existed.
+    """
+    already_assigned = exists().where(
+        models.DevicePolicy.device_id == models.Device.id,
+        models.DevicePolicy.policy_id == models.Device.policy_id
+    )
+    with engine.begin() as conn:
+        if conn.execute(select(models.SyncCounter.id).where(models.SyncCounter.id == COUNTER_ID)).first() is None:
+            conn.execute(insert(models.SyncCounter).values(id=COUNTER_ID, value=1))
+        conn.execute(insert(models.DevicePolicy).from_select(
+            ["device_id", "policy_id", "seq", "removed"],
+            select(models.Device.id, models.Device.policy_id, literal(0), false())
+            .where(models.Device.policy_id.isnot(None), ~already_assigned)
+        ))
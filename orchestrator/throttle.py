@@ -0,0 +1,70 @@
+import re
+
+# Endpoints agents poll on a schedule
+AGENT_PATH = re.compile(r"^/devices/\d+/(config(/watch|/rendered)?|sync|heartbeat|token)$")
+# Long-polls mostly sit idle, so they don't count towards the in-flight limit
+LONG_POLL_PATH = re.compile(r"^/devices/\d+/(config/watch|sync)$")
+
+class AgentThrottleMiddleware:
+    """
+    ASGI middleware pacing agents. Agent-facing responses carry an
+    X-Poll-Interval hint that grows from `poll_interval` to 4x as in-flight
+    requests approach `max_in_flight`; at the limit, agent requests are
+    answered with 503 and Retry-After before they reach the database.
+    Limits are per worker process.
+    """
+
+    def __init__(self, app, poll_interval: int = 30, max_in_flight: int = 0, retry_after: int = 30):
+        self.app = app
+        self.base_interval = poll_interval
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+
+    def poll_interval(self) -> int:
+        if not self.max_in_flight:
+            return self.base_interval
+        load = min(1.0, self.in_flight / self.max_in_flight)
+        # Unchanged up to half load, then linear up to 4x at the limit
+        return round(self.base_interval * (1 + 6 * max(0.0, load - 0.5)))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        is_agent = AGENT_PATH.match(path) is not None
+        if is_agent and self.max_in_flight and self.in_flight >= self.max_in_flight:
+            await self._shed(send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-poll-interval", str(self.poll_interval()).encode())
+                ]
+            await send(message)
+
+        counted = LONG_POLL_PATH.match(path) is None
+        if counted:
+            self.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper if is_agent else send)
+        finally:
+            if counted:
+                self.in_flight -= 1
+
+    async def _shed(self, send):
+        body = b'{"detail":"Orchestrator overloaded, retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after).encode()),
+                (b"x-poll-interval", str(self.poll_interval()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
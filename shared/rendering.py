@@ -0,0 +1,172 @@
+"""
+Platform-native config rendering, shared by the orchestrator (which renders
+once per policy revision and serves the result) and the agents.
+"""
+import hashlib
+from typing import Dict, Any, Optional
+
+# ipsec: legacy ipsec.conf/ipsec.secrets, swanctl: a conf.d file,
+# powershell: a script for the NetSecurity module
+FORMATS = ("ipsec", "swanctl", "powershell")
+
+# Format used when a device doesn't ask for one, by Device.os_type
+DEFAULT_FORMATS = {
+    "linux": "ipsec",
+    "windows": "powershell",
+}
+
+def render_policy(policy: Dict[str, Any], fmt: str) -> Dict[str, str]:
+    """Render `policy` as artifact name -> content for the given format."""
+    if fmt == "ipsec":
+        return {
+            "ipsec.conf": render_ipsec_conf(policy),
+            "ipsec.secrets": render_ipsec_secrets(policy),
+        }
+    if fmt == "swanctl":
+        return {swanctl_conf_name(policy['name']): render_swanctl_conf(policy)}
+    if fmt == "powershell":
+        return {"apply.ps1": render_powershell(policy)}
+    raise ValueError(f"Unknown config format: {fmt}")
+
+def artifact_hash(files: Dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode())
+        digest.update(b"\0")
+        digest.update(files[name].encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# strongSwan, ipsec.conf
+
+def render_ipsec_conf(policy: Dict[str, Any]) -> str:
+    # Map API fields to strongSwan config
+    # This is a simplified template
+
+    left = "%defaultroute"
+    leftsubnet = policy.get('local_network_cidr', '0.0.0.0/0')
+    right = policy.get('remote_gateway', '%any') # Needs to be passed in policy or discovered
+    rightsubnet = policy.get('remote_network_cidr', '0.0.0.0/0')
+
+    ike = f"{policy.get('encryption_algorithm', 'aes256')}-{policy.get('integrity_algorithm', 'sha256')}-{policy.get('dh_group', 'modp2048')}!"
+    esp = f"{policy.get('encryption_algorithm', 'aes256')}-{policy.get('integrity_algorithm', 'sha256')}!"
+
+    config = f"""# Generated by Unified IPsec Agent
+config setup
+    charondebug="ike 1, knl 1, cfg 0"
+    uniqueids=no
+
+conn {policy['name']}
+    authby={policy.get('auth_method', 'secret')}
+    auto=start
+    keyexchange={policy.get('ike_version', 'ikev2')}
+    ike={ike}
+    esp={esp}
+    left={left}
+    leftsubnet={leftsubnet}
+    right={right}
+    rightsubnet={rightsubnet}
+    type=tunnel
+"""
+    return config
+
+def render_ipsec_secrets(policy: Dict[str, Any]) -> str:
+    if policy.get('auth_method') == 'psk':
+        psk = policy.get('psk_secret', 'default_psk')
+        # Format: left_id right_id : PSK "secret"
+        return f': PSK "{psk}"\n'
+    return ""
+
+# strongSwan, swanctl / VICI
+
+def swanctl_connection(policy: Dict[str, Any]) -> Dict[str, Any]:
+    enc = policy.get('encryption_algorithm', 'aes256')
+    integ = policy.get('integrity_algorithm', 'sha256')
+    dh_group = policy.get('dh_group', 'modp2048')
+    auth = "psk" if policy.get('auth_method', 'psk') == 'psk' else "pubkey"
+    return {
+        "version": "1" if policy.get('ike_version') == 'ikev1' else "2",
+        "local_addrs": ["%any"],
+        "remote_addrs": [policy.get('remote_gateway', '%any')],
+        "proposals": [f"{enc}-{integ}-{dh_group}"],
+        "local": {"auth": auth},
+        "remote": {"auth": auth},
+        "children": {
+            policy['name']: {
+                "local_ts": [policy.get('local_network_cidr', '0.0.0.0/0')],
+                "remote_ts": [policy.get('remote_network_cidr', '0.0.0.0/0')],
+                "esp_proposals": [f"{enc}-{integ}"],
+                "mode": "tunnel",
+                "start_action": "start",
+            }
+        },
+    }
+
+def swanctl_secret(policy: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if policy.get('auth_method') != 'psk':
+        return None
+    return {
+        "id": swanctl_secret_id(policy['name']),
+        "type": "IKE",
+        "data": policy.get('psk_secret') or 'default_psk',
+    }
+
+def swanctl_secret_id(name: str) -> str:
+    return f"ike-{name}"
+
+def swanctl_conf_name(name: str) -> str:
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    return f"{safe_name}.conf"
+
+def render_swanctl_conf(policy: Dict[str, Any]) -> str:
+    return swanctl_conf_content(policy['name'], swanctl_connection(policy), swanctl_secret(policy))
+
+def swanctl_conf_content(name: str, conn: Dict[str, Any], secret: Optional[Dict[str, Any]]) -> str:
+    content = "# Generated by Unified IPsec Agent\n"
+    content += _render_section("connections", {name: conn})
+    if secret is not None:
+        content += _render_section("secrets", {secret["id"]: {"secret": f'"{secret["data"]}"'}})
+    return content
+
+def _render_section(name: str, values: Dict[str, Any], indent: str = "") -> str:
+    lines = f"{indent}{name} {{\n"
+    for key, value in values.items():
+        if isinstance(value, dict):
+            lines += _render_section(key, value, indent + "    ")
+        elif isinstance(value, list):
+            lines += f"{indent}    {key} = {','.join(value)}\n"
+        else:
+            lines += f"{indent}    {key} = {value}\n"
+    return lines + f"{indent}}}\n"
+
+# Windows, PowerShell
+
+def render_powershell(policy: Dict[str, Any]) -> str:
+    # This is a simplified example. Real implementation needs robust error handling and parameter mapping.
+
+    local_net = policy.get('local_network_cidr', '0.0.0.0/0')
+    remote_net = policy.get('remote_network_cidr', '0.0.0.0/0')
+
+    # Note: New-NetIPsecRule is complex. We'll use a wrapper script or direct command.
+    # For this MVP, we'll construct a command string.
+
+    return f"""
+        $ErrorActionPreference = "Stop"
+
+        # Remove existing rule if exists
+        Remove-NetIPsecRule -DisplayName "{policy['name']}" -ErrorAction SilentlyContinue
+
+        # Create new rule
+        New-NetIPsecRule -DisplayName "{policy['name']}" `
+            -LocalAddress {local_net} `
+            -RemoteAddress {remote_net} `
+            -Phase1AuthSet DefaultPhase1AuthSet `
+            -Phase2AuthSet DefaultPhase2AuthSet `
+            -KeyModule IKEv2 `
+            -Enabled True
+        """
+
+def render_powershell_removal(name: str) -> str:
+    return f"""
+        Remove-NetIPsecRule -DisplayName "{name}" -ErrorAction SilentlyContinue
+        """
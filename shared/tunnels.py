@@ -0,0 +1,39 @@
+"""
+Per-tunnel status as collected by the agents and reported in heartbeats.
+Heartbeats carry one row (list) per tunnel in TUNNEL_FIELDS order instead of
+an object per tunnel, so thousands of tunnels don't repeat every key.
+"""
+from dataclasses import dataclass, astuple, fields
+from typing import List, Any, Optional
+
+# IKE SA states as reported by strongSwan; DOWN means no SA at all
+ESTABLISHED = "ESTABLISHED"
+DOWN = "DOWN"
+
+@dataclass
+class TunnelStatus:
+    name: str
+    state: str = DOWN
+    child_sas: int = 0  # Installed CHILD (quick mode) SAs
+    established: Optional[int] = None  # Seconds since the IKE SA came up
+    rekey_in: Optional[int] = None  # Seconds until the next IKE rekey
+    # Traffic counters summed over the CHILD SAs, None if the platform has none
+    bytes_in: Optional[int] = None
+    bytes_out: Optional[int] = None
+    packets_in: Optional[int] = None
+    packets_out: Optional[int] = None
+
+    @property
+    def up(self) -> bool:
+        return self.state == ESTABLISHED
+
+    def as_row(self) -> List[Any]:
+        return list(astuple(self))
+
+    @classmethod
+    def from_row(cls, row: List[Any]) -> "TunnelStatus":
+        if not row or len(row) > len(TUNNEL_FIELDS):
+            raise ValueError(f"Tunnel status rows have 1 to {len(TUNNEL_FIELDS)} fields")
+        return cls(*row)
+
+TUNNEL_FIELDS = tuple(field.name for field in fields(TunnelStatus))
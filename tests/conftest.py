@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# The orchestrator reads its settings and creates its engines on import;
+# point it at a throwaway SQLite database and CA before any test imports it
+_state_dir = tempfile.mkdtemp(prefix="ipsec-orchestrator-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_state_dir}/orchestrator.db"
+os.environ["CA_CERT_PATH"] = os.path.join(_state_dir, "ca_cert.pem")
+os.environ["CA_KEY_PATH"] = os.path.join(_state_dir, "ca_key.pem")
+os.environ["READ_REPLICA_URLS"] = ""
+os.environ["DEVICE_TOKEN_REQUIRED"] = "false"
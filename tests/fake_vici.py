@@ -0,0 +1,132 @@
+"""
+A stand-in for charon's VICI socket: speaks the wire protocol over TCP or a
+UNIX socket and keeps loaded connections and shared secrets in memory, so
+SwanctlManager can be tested without strongSwan.
+"""
+import os
+import socket
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from agent.platforms import vici
+
+class FakeCharon:
+    """
+    Serves load-conn, unload-conn, load-shared, unload-shared and list-sas
+    (streaming one list-sa event per entry of `sas`). Every command is
+    recorded in `requests` as (command, message). Commands named in
+    `failing` answer success=no.
+    """
+
+    def __init__(self, family: int = socket.AF_INET, path: Optional[str] = None):
+        self.family = family
+        self.conns: Dict[str, Dict[str, Any]] = {}
+        self.shared: Dict[str, Dict[str, Any]] = {}
+        self.sas: List[Dict[str, Any]] = []
+        self.requests: List[Tuple[str, Dict[str, Any]]] = []
+        self.failing: set = set()
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            self._listener.bind(path)
+        else:
+            self._listener.bind(("127.0.0.1", 0))
+        self.address = self._listener.getsockname()
+        self._listener.listen()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+
+    def start(self) -> "FakeCharon":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._listener.close()
+        if self.family == socket.AF_UNIX:
+            try:
+                os.remove(self.address)
+            except FileNotFoundError:
+                pass
+
+    def transport(self) -> vici.SocketTransport:
+        return vici.SocketTransport(self.address, self.family, timeout=5)
+
+    def commands(self) -> List[str]:
+        return [command for command, _ in self.requests]
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        registered = set()
+        with conn:
+            while True:
+                try:
+                    packet_type, name, payload = self._recv(conn)
+                except (ConnectionError, struct.error):
+                    return
+                if packet_type == vici.EVENT_REGISTER:
+                    registered.add(name)
+                    self._send(conn, vici.EVENT_CONFIRM)
+                elif packet_type == vici.EVENT_UNREGISTER:
+                    registered.discard(name)
+                    self._send(conn, vici.EVENT_CONFIRM)
+                elif packet_type == vici.CMD_REQUEST:
+                    self._command(conn, name, vici.decode_message(payload), registered)
+
+    def _command(self, conn: socket.socket, command: str, message: Dict[str, Any], registered: set):
+        self.requests.append((command, message))
+        if command in self.failing:
+            self._respond(conn, {"success": "no", "errmsg": f"{command} rejected"})
+            return
+        if command == "load-conn":
+            self.conns.update(message)
+        elif command == "unload-conn":
+            if self.conns.pop(message["name"], None) is None:
+                self._respond(conn, {"success": "no", "errmsg": f"connection '{message['name']}' not found"})
+                return
+        elif command == "load-shared":
+            self.shared[message["id"]] = message
+        elif command == "unload-shared":
+            self.shared.pop(message["id"], None)
+        elif command == "list-sas":
+            if "list-sa" in registered:
+                for sa in self.sas:
+                    self._send(conn, vici.EVENT, "list-sa", vici.encode_message(sa))
+        else:
+            self._send(conn, vici.CMD_UNKNOWN)
+            return
+        self._respond(conn, {"success": "yes"})
+
+    def _respond(self, conn: socket.socket, message: Dict[str, Any]):
+        self._send(conn, vici.CMD_RESPONSE, payload=vici.encode_message(message))
+
+    @staticmethod
+    def _send(conn: socket.socket, packet_type: int, name: Optional[str] = None, payload: bytes = b""):
+        packet = struct.pack("!B", packet_type)
+        if name is not None:
+            packet += struct.pack("!B", len(name)) + name.encode()
+        packet += payload
+        conn.sendall(struct.pack("!I", len(packet)) + packet)
+
+    @staticmethod
+    def _recv(conn: socket.socket) -> Tuple[int, Optional[str], bytes]:
+        (length,) = struct.unpack("!I", _read(conn, 4))
+        packet = _read(conn, length)
+        packet_type = packet[0]
+        if packet_type in (vici.CMD_REQUEST, vici.EVENT_REGISTER, vici.EVENT_UNREGISTER):
+            name_length = packet[1]
+            return packet_type, packet[2:2 + name_length].decode(), packet[2 + name_length:]
+        return packet_type, None, packet[1:]
+
+def _read(conn: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("client closed the connection")
+        data += chunk
+    return data
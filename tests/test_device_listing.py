@@ -0,0 +1,52 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from orchestrator import database, metrics, models
+from orchestrator.main import app
+
+POLICIES = 20
+DEVICES = 250
+
+@pytest.fixture(scope="module")
+def client():
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Policy), [
+            {"id": policy_id, "name": f"listing-{policy_id}", "local_network_cidr": "10.0.0.0/24",
+             "remote_network_cidr": f"10.{policy_id}.0.0/24"}
+            for policy_id in range(1, POLICIES + 1)
+        ])
+        conn.execute(insert(models.Device), [
+            {"hostname": f"listing-{n}", "os_type": "linux", "enrollment_token": f"listing-{n}",
+             "policy_id": n % POLICIES + 1 if n % 5 else None}
+            for n in range(DEVICES)
+        ])
+    # No lifespan: listings need neither the background tasks nor the PKI pool
+    return TestClient(app)
+
+def query_count(client: TestClient, route: str, **params) -> int:
+    """SQL statements issued by one GET `route`, as counted by the metrics middleware."""
+    def total():
+        entry = metrics.db_queries_per_request._values.get(("GET", route))
+        return entry[1] if entry else 0
+
+    before = total()
+    response = client.get(route, params=params)
+    assert response.status_code == 200
+    return int(total() - before)
+
+@pytest.mark.parametrize("route", ["/devices/", "/devices/compact"])
+def test_listing_query_count_does_not_grow_with_page_size(client, route):
+    small = query_count(client, route, limit=10)
+    large = query_count(client, route, limit=200)
+    assert small == large
+    # Devices and, separately, the distinct policies of the page
+    assert 1 <= large <= 2
+
+def test_page_contents(client):
+    devices = client.get("/devices/", params={"limit": 200}).json()
+    assert len(devices) == 200
+    assert all((device["policy"] is None) == (device["policy_id"] is None) for device in devices)
+
+    page = client.get("/devices/compact", params={"limit": 200}).json()
+    assert len(page["devices"]) == 200
+    assert set(page["policies"]) == {str(device["policy_id"]) for device in page["devices"] if device["policy_id"]}
@@ -0,0 +1,39 @@
+import asyncio
+from datetime import timedelta
+from sqlalchemy import delete, insert
+from orchestrator import database, models
+from orchestrator.main import app  # noqa: F401 -- creates the schema
+from orchestrator.heartbeat import HeartbeatBuffer
+
+WINDOW = timedelta(seconds=90)
+
+def add_devices(*hostnames: str):
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Device), [
+            {"hostname": hostname, "enrollment_token": f"heartbeat-{hostname}"} for hostname in hostnames
+        ])
+
+def test_flush_picks_up_other_workers():
+    async def scenario():
+        add_devices("hb-1", "hb-2")
+        worker_a, worker_b = HeartbeatBuffer(), HeartbeatBuffer()
+        await worker_a.load()
+        await worker_b.load()
+        before = worker_b.liveness(WINDOW)
+
+        # Worker A gets a heartbeat and, separately, a device is enrolled
+        add_devices("hb-3")
+        device_id = next(iter(worker_a._last_seen))
+        worker_a.record(device_id)
+        await worker_a.flush()
+        await worker_b.flush()
+        return before, worker_a.liveness(WINDOW), worker_b.liveness(WINDOW)
+
+    try:
+        before, seen_by_a, seen_by_b = asyncio.run(scenario())
+    finally:
+        with database.engine.begin() as conn:
+            conn.execute(delete(models.Device).where(models.Device.hostname.startswith("hb-")))
+    assert seen_by_b == seen_by_a
+    assert seen_by_b["online"] == before["online"] + 1
+    assert seen_by_b["total"] == before["total"] + 1
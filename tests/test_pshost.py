@@ -0,0 +1,64 @@
+import sys
+import pytest
+from agent.platforms.pshost import PowerShellHost, PowerShellError
+
+# Stands in for the PowerShell host script: answers each JSON request line
+# with the script text echoed back as its output
+ECHO_HOST = r"""
+import sys, json
+print("banner that is not a protocol line", flush=True)
+for line in sys.stdin:
+    try:
+        request = json.loads(line)
+    except ValueError:
+        print(json.dumps({"id": None, "ok": False, "error": "bad request"}), flush=True)
+        continue
+    script = request["script"]
+    if script == "exit":
+        sys.exit(1)
+    if script == "hang":
+        continue
+    if script.startswith("fail"):
+        response = {"id": request["id"], "ok": False, "error": script}
+    else:
+        response = {"id": request["id"], "ok": True, "output": script}
+    print(json.dumps(response), flush=True)
+"""
+
+@pytest.fixture
+def host(tmp_path):
+    script = tmp_path / "echo_host.py"
+    script.write_text(ECHO_HOST)
+    host = PowerShellHost(command=[sys.executable, str(script)], timeout=10)
+    yield host
+    host.close()
+
+def test_runs_scripts_in_one_session(host):
+    assert host.run("Get-NetIPsecRule") == "Get-NetIPsecRule"
+    process = host._process
+    assert host.run("Get-NetIPsecMainModeSA") == "Get-NetIPsecMainModeSA"
+    assert host._process is process
+
+def test_failed_script_raises_and_keeps_session(host):
+    host.run("warm up")
+    process = host._process
+    with pytest.raises(PowerShellError, match="fail: access denied"):
+        host.run("fail: access denied")
+    assert host.run("after") == "after"
+    assert host._process is process
+
+def test_restarts_after_host_exits(host):
+    host.run("warm up")
+    process = host._process
+    # The host exits without answering; the request is retried once on a new one
+    with pytest.raises(PowerShellError, match="unavailable"):
+        host.run("exit")
+    assert host.run("after") == "after"
+    assert host._process is not process
+
+def test_timeout_discards_session(host):
+    host.run("warm up")
+    with pytest.raises(PowerShellError, match="Timed out"):
+        host.run("hang", timeout=0.2)
+    assert host._process is None
+    assert host.run("after") == "after"
@@ -0,0 +1,21 @@
+from argparse import Namespace
+import pytest
+from benchmarks.poll_schedule_sim import simulate
+
+def fleet(seed: int) -> Namespace:
+    # A mass reboot of 300 agents against an orchestrator that is down for a
+    # minute and then serves 40 requests per second
+    return Namespace(agents=300, interval=30.0, capacity=40, outage=60.0, retry_after=30.0, duration=300.0, seed=seed)
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_request_rate_flattens_after_recovery(seed):
+    fixed = simulate("fixed", fleet(seed))
+    scheduled = simulate("scheduler", fleet(seed))
+
+    # The fixed loop keeps the whole fleet in lockstep
+    assert fixed["peak_rps"] == 300 and fixed["rejected"] > 0
+    assert scheduled["peak_rps"] * 4 < fixed["peak_rps"]
+    assert scheduled["seconds_over_capacity"] == 0
+    assert scheduled["rejected"] == 0
+    # Spreading the polls doesn't cost throughput
+    assert scheduled["served"] > fixed["served"]
@@ -0,0 +1,143 @@
+import os
+import socket
+import pytest
+from fake_vici import FakeCharon
+from agent.platforms.swanctl import SwanctlManager
+from agent.platforms.vici import ViciSession, ViciError
+
+def make_policy(policy_id: int, name: str, **fields):
+    policy = {
+        "id": policy_id,
+        "name": name,
+        "auth_method": "psk",
+        "psk_secret": f"secret-{policy_id}",
+        "local_network_cidr": "10.0.0.0/24",
+        "remote_network_cidr": f"10.{policy_id}.0.0/24",
+    }
+    policy.update(fields)
+    return policy
+
+@pytest.fixture(params=[socket.AF_INET, socket.AF_UNIX], ids=["tcp", "unix"])
+def charon(request, tmp_path):
+    server = FakeCharon(request.param, str(tmp_path / "charon.vici")).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def manager(charon, tmp_path):
+    return SwanctlManager(
+        session_factory=lambda: ViciSession(charon.transport()),
+        conf_dir=str(tmp_path / "conf.d"),
+        state_path=str(tmp_path / "state" / "swanctl.json")
+    )
+
+def test_apply_policy_loads_connection_and_secret(manager, charon, tmp_path):
+    assert manager.apply_policy(make_policy(1, "office"))
+
+    assert charon.commands() == ["load-shared", "load-conn"]
+    assert charon.conns["office"]["children"]["office"]["remote_ts"] == ["10.1.0.0/24"]
+    assert charon.shared["ike-office"]["data"] == "secret-1"
+    assert (tmp_path / "conf.d" / "office.conf").exists()
+
+def test_unchanged_connections_are_not_reloaded(manager, charon):
+    office, branch = make_policy(1, "office"), make_policy(2, "branch")
+    assert manager.apply_connections({"office": office, "branch": branch})
+    charon.requests.clear()
+
+    assert manager.apply_connections({"office": office, "branch": dict(branch, psk_secret="rotated")})
+    assert charon.requests == [
+        ("load-shared", {"id": "ike-branch", "type": "IKE", "data": "rotated"}),
+        ("load-conn", {"branch": charon.conns["branch"]}),
+    ]
+
+    charon.requests.clear()
+    assert manager.apply_connections({"office": office, "branch": dict(branch, psk_secret="rotated")})
+    assert charon.requests == []
+
+def test_apply_connections_unloads_dropped_connections(manager, charon, tmp_path):
+    manager.apply_connections({"office": make_policy(1, "office"), "branch": make_policy(2, "branch")})
+    charon.requests.clear()
+
+    assert manager.apply_connections({"office": make_policy(1, "office")})
+    assert charon.commands() == ["unload-conn", "unload-shared"]
+    assert set(charon.conns) == {"office"}
+    assert not (tmp_path / "conf.d" / "branch.conf").exists()
+
+def test_delta_reloads_only_the_changed_connection(manager, charon):
+    manager.apply_delta([make_policy(1, "office"), make_policy(2, "branch"), make_policy(3, "lab")], [], full=True)
+    charon.requests.clear()
+
+    changed = make_policy(1, "office", remote_network_cidr="172.16.0.0/24")
+    assert manager.apply_delta([changed], [2])
+
+    assert charon.requests[:2] == [("unload-conn", {"name": "branch"}), ("unload-shared", {"id": "ike-branch"})]
+    assert [command for command, _ in charon.requests[2:]] == ["load-shared", "load-conn"]
+    assert list(charon.requests[3][1]) == ["office"]
+    assert set(charon.conns) == {"office", "lab"}
+    assert charon.conns["office"]["children"]["office"]["remote_ts"] == ["172.16.0.0/24"]
+    assert manager.policy_names == {1: "office", 3: "lab"}
+
+def test_delta_rename_unloads_the_old_name(manager, charon):
+    manager.apply_delta([make_policy(1, "office")], [], full=True)
+
+    assert manager.apply_delta([make_policy(1, "hq")], [])
+    assert set(charon.conns) == {"hq"}
+    assert manager.policy_names == {1: "hq"}
+
+def test_delta_state_survives_restart(manager, charon, tmp_path):
+    manager.apply_delta([make_policy(1, "office"), make_policy(2, "branch")], [], full=True)
+    restarted = SwanctlManager(
+        session_factory=manager.session_factory,
+        conf_dir=manager.conf_dir,
+        state_path=manager.state_path
+    )
+    charon.requests.clear()
+
+    assert restarted.apply_delta([], [2])
+    assert charon.commands() == ["unload-conn", "unload-shared"]
+    assert set(charon.conns) == {"office"}
+
+def test_failed_load_reports_failure(manager, charon):
+    charon.failing.add("load-conn")
+    assert not manager.apply_policy(make_policy(1, "office"))
+    assert manager.applied == {}
+
+    # Retried on the next apply once charon accepts it
+    charon.failing.clear()
+    assert manager.apply_policy(make_policy(1, "office"))
+    assert "office" in charon.conns
+
+def test_tunnel_status_from_list_sas(manager, charon):
+    manager.apply_connections({"office": make_policy(1, "office"), "branch": make_policy(2, "branch")})
+    charon.sas = [{
+        "office": {
+            "state": "ESTABLISHED",
+            "established": "120",
+            "rekey-time": "3000",
+            "child-sas": {
+                "office-1": {"state": "INSTALLED", "bytes-in": "100", "bytes-out": "50", "packets-in": "2", "packets-out": "1"},
+                "office-2": {"state": "INSTALLED", "bytes-in": "10", "bytes-out": "5", "packets-in": "1", "packets-out": "1"},
+                "office-3": {"state": "REKEYING", "bytes-in": "999"},
+            },
+        }
+    }]
+
+    tunnels = {tunnel.name: tunnel for tunnel in manager.tunnel_status()}
+    assert tunnels["office"].up and tunnels["office"].child_sas == 2
+    assert (tunnels["office"].bytes_in, tunnels["office"].bytes_out) == (110, 55)
+    assert tunnels["office"].established == 120 and tunnels["office"].rekey_in == 3000
+    assert not tunnels["branch"].up
+    assert manager.check_tunnel_status()
+    assert charon.commands()[-1] == "list-sas"
+
+def test_tunnel_status_when_charon_is_unreachable(manager, charon):
+    charon.stop()
+    assert manager.tunnel_status() == []
+    assert not manager.check_tunnel_status()
+
+def test_unknown_command(charon):
+    with ViciSession(charon.transport()) as session:
+        with pytest.raises(ViciError, match="Unknown VICI command"):
+            session.request("reload-settings")
+        # The session stays usable
+        assert session.request("load-conn", {"x": {"version": "2"}}) == {"success": "yes"}